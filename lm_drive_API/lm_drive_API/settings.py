@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
@@ -109,6 +110,25 @@ DATABASES = {
     }
 }
 
+# Cache Configuration: it must be shared by every worker process, which it
+# keeps in step (catalog, reference table, search, suggest and store locator
+# versions, order id node leases). The file-based default suits processes of
+# one host; prefer Redis or Memcached in production, for instance
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache (needs redis-py)
+# with CACHE_LOCATION=redis://127.0.0.1:6379/1.
+CACHES = {
+    "default": {
+        "BACKEND": config(
+            "CACHE_BACKEND",
+            default="django.core.cache.backends.filebased.FileBasedCache",
+        ),
+        "LOCATION": config(
+            "CACHE_LOCATION",
+            default=os.path.join(tempfile.gettempdir(), "lm_drive_API_cache"),
+        ),
+    }
+}
+
 # Authentication & Authorization
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -172,3 +192,15 @@ STRIPE_PUBLISHABLE_KEY = config("STRIPE_PUBLISHABLE_KEY")
 STRIPE_SECRET_KEY = config("STRIPE_SECRET_KEY")
 STRIPE_TEST_SECRET_KEY = config("STRIPE_TEST_SECRET_KEY")
 STRIPE_RETURN_URL = config("STRIPE_RETURN_URL", default="http://localhost:5173/")
+
+# Stock reservations of pending orders (see store.reservations)
+STOCK_RESERVATION_TTL_MINUTES = config(
+    "STOCK_RESERVATION_TTL_MINUTES", default=30, cast=int
+)
+
+# Order ids (see orders.ids): give each worker process its own node, 0 to 1023,
+# or leave ORDER_ID_NODE unset to lease one in the shared cache
+ORDER_ID_ALLOCATOR = config(
+    "ORDER_ID_ALLOCATOR", default="orders.ids.TimeOrderedIdAllocator"
+)
+ORDER_ID_NODE = config("ORDER_ID_NODE", default=None)
@@ -1,10 +1,12 @@
 from django.contrib import admin
+from store.utils import EstimatedCountPaginator
 from .models import Order, OrderItem
 
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 1  # Number of empty forms to display for new OrderItems
+    autocomplete_fields = ("product",)
     readonly_fields = (
         "price_ht",
         "tva",
@@ -27,13 +29,19 @@ class OrderAdmin(admin.ModelAdmin):
         "confirmed_date",
         "fulfilled_date",
     )
-    list_filter = ("status", "store", "customer", "order_date")
+    list_select_related = ("customer__user", "store")
+    # Customers are searched rather than listed in the sidebar
+    list_filter = ("status", "store", "order_date")
     search_fields = (
         "order_id",
         "customer__user__username",  # Adjust based on your models
+        "customer__email",
         "store__name",  # Adjust if store has a name field
     )
+    autocomplete_fields = ("customer", "store")
     ordering = ("-order_date",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     inlines = [OrderItemInline]
     readonly_fields = (
         "total_ht",
@@ -55,11 +63,14 @@ class OrderItemAdmin(admin.ModelAdmin):
         "total_ht",
         "total_ttc",
     )
-    list_filter = ("order", "product")
+    list_select_related = ("order__customer__user", "product")
+    # Orders and products are searched rather than listed in the sidebar
     search_fields = (
         "order__order_id",
         "product__product_name",
     )  # Adjust based on your models
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     readonly_fields = (
         "order",
         "product",
@@ -0,0 +1,225 @@
+"""
+Order ids.
+
+Order ids are the primary key of Order, hence of its clustered index on
+MySQL/InnoDB. Random ids (the 8 hex characters of a uuid4 used so far) land
+anywhere in that index, splitting pages on insert, and their 32 bits collide
+after a few hundred thousand orders. The default allocator instead builds ids
+that increase with time, so new orders are appended next to each other:
+
+    40 bits  milliseconds since ID_EPOCH (until 2058)
+    10 bits  node: the process allocating the id (settings.ORDER_ID_NODE)
+    10 bits  sequence within the millisecond
+
+written as 12 Crockford base32 characters (digits and upper-case letters
+without I, L, O and U), which sort like the numbers they encode. Ids of a
+node never repeat and only increase, even when its clock goes back, and
+distinct nodes never allocate the same id, so each process needs a node of
+its own. Give every worker its ORDER_ID_NODE (0 to 1023), or leave it unset
+to lease a free node in Django's shared cache (NodeLease): like the store's
+indexes, this needs a cache shared by the processes. Leases in a cache of
+their own (LocMemCache) would exclude nothing, so processes refuse to start
+that way unless DEBUG is on (check_node_lease). Should two processes still
+share a node, Order.save retries with a new id when its id is taken.
+
+Existing orders keep their ids: they are referenced by payments, stock
+reservations, invoices and customers, and both forms fit the column. The
+legacy ids are lower-case hexadecimal and at most 8 characters long, so they
+are never mistaken for (or equal to) time-ordered ones.
+
+The allocator is chosen by settings.ORDER_ID_ALLOCATOR, the dotted path of a
+class with an allocate() method, RandomOrderIdAllocator restoring the former
+ids. See the `benchmark_order_ids` command to compare their insert throughput.
+"""
+
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+ID_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+TIME_BITS = 40
+NODE_BITS = 10
+SEQUENCE_BITS = 10
+ID_LENGTH = 12  # ceil((40 + 10 + 10) / 5)
+MAX_NODE = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+DEFAULT_ALLOCATOR = "orders.ids.TimeOrderedIdAllocator"
+
+NODE_LEASE_KEY = "orders:id-node:{}"
+# Seconds a leased node stays reserved; leases are renewed halfway.
+NODE_LEASE_TIMEOUT = 60 * 60
+# Cache backends private to each process, where leases exclude nothing
+LOCAL_CACHE_BACKENDS = (LocMemCache, DummyCache)
+
+
+def encode(number, length=ID_LENGTH):
+    """Write `number` as `length` Crockford base32 characters."""
+    characters = []
+    for _ in range(length):
+        number, digit = divmod(number, 32)
+        characters.append(ALPHABET[digit])
+    if number:
+        raise ValueError("Number too large to encode.")
+    return "".join(reversed(characters))
+
+
+def decode(text):
+    """Read a number written by encode."""
+    number = 0
+    for character in text.upper():
+        number = number * 32 + ALPHABET.index(character)
+    return number
+
+
+class RandomOrderIdAllocator:
+    """The former ids: 8 random hexadecimal characters."""
+
+    def allocate(self):
+        return uuid.uuid4().hex[:8]
+
+
+def check_node_lease():
+    """
+    Raise ImproperlyConfigured when time-ordered ids would be allocated from
+    nodes leased in a cache private to the process, outside DEBUG.
+    """
+    if settings.DEBUG or getattr(settings, "ORDER_ID_NODE", None) not in (None, ""):
+        return
+    allocator = import_string(
+        getattr(settings, "ORDER_ID_ALLOCATOR", DEFAULT_ALLOCATOR)
+    )
+    if issubclass(allocator, TimeOrderedIdAllocator) and isinstance(
+        caches["default"], LOCAL_CACHE_BACKENDS
+    ):
+        raise ImproperlyConfigured(
+            "Order id nodes cannot be leased in a per-process cache: set "
+            "ORDER_ID_NODE for each process or configure a shared cache."
+        )
+
+
+class NodeLease:
+    """
+    A node reserved for this process in the shared cache, for allocators
+    without ORDER_ID_NODE. The lease is taken on the first allocation and
+    renewed by the following ones; a process idle for longer than
+    NODE_LEASE_TIMEOUT may lose its node and lease another one.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.holder = uuid.uuid4().hex
+        self.clock = clock
+        self.node = None
+        self.renewed_at = None
+
+    def acquire(self):
+        """Lease a free node, the former one first, and return it."""
+        nodes = list(range(MAX_NODE + 1))
+        random.SystemRandom().shuffle(nodes)
+        if self.node is not None:
+            nodes.insert(0, self.node)
+        for node in nodes:
+            if cache.add(NODE_LEASE_KEY.format(node), self.holder, NODE_LEASE_TIMEOUT):
+                return node
+        raise ImproperlyConfigured(
+            "Every order id node is leased: set ORDER_ID_NODE for each process."
+        )
+
+    def get_node(self):
+        """Return the leased node, renewing the lease or leasing a new one."""
+        now = self.clock()
+        if self.node is not None and now - self.renewed_at < NODE_LEASE_TIMEOUT / 2:
+            return self.node
+        key = NODE_LEASE_KEY.format(self.node)
+        if self.node is not None and cache.get(key) == self.holder:
+            cache.touch(key, NODE_LEASE_TIMEOUT)
+        else:
+            self.node = self.acquire()
+        self.renewed_at = now
+        return self.node
+
+
+class TimeOrderedIdAllocator:
+    """Time-ordered ids of one node, see the module docstring."""
+
+    def __init__(self, node=None, clock=time.time):
+        if node is None:
+            node = getattr(settings, "ORDER_ID_NODE", None)
+        self.lease = None
+        if node in (None, ""):
+            # Leased on the first allocation, once the cache is in use
+            self.lease = NodeLease()
+        else:
+            node = int(node)
+            if not 0 <= node <= MAX_NODE:
+                raise ValueError(f"Order id node must be between 0 and {MAX_NODE}.")
+        self.node = node
+        self.clock = clock
+        self.last_tick = -1
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def tick(self):
+        """Return the milliseconds elapsed since ID_EPOCH."""
+        return int(self.clock() * 1000) - int(ID_EPOCH.timestamp() * 1000)
+
+    def allocate(self):
+        with self.lock:
+            if self.lease is not None:
+                self.node = self.lease.get_node()
+            tick = self.tick()
+            if tick > self.last_tick:
+                self.last_tick, self.sequence = tick, 0
+            elif self.sequence < MAX_SEQUENCE:
+                # Same millisecond, or the clock went back: stay on the last one
+                self.sequence += 1
+            else:
+                # Sequence exhausted: borrow the next millisecond
+                self.last_tick, self.sequence = self.last_tick + 1, 0
+            tick, node, sequence = self.last_tick, self.node, self.sequence
+        if tick >= 1 << TIME_BITS:
+            raise OverflowError("Order id clock out of range.")
+        return encode(
+            (tick << (NODE_BITS + SEQUENCE_BITS)) | (node << SEQUENCE_BITS) | sequence
+        )
+
+    @staticmethod
+    def parse(order_id):
+        """
+        Return the (created_at, node, sequence) of a time-ordered id, or None
+        for other ids.
+        """
+        if len(order_id) != ID_LENGTH or order_id.strip(ALPHABET):
+            return None
+        number = decode(order_id)
+        tick = number >> (NODE_BITS + SEQUENCE_BITS)
+        created_at = datetime.fromtimestamp(
+            ID_EPOCH.timestamp() + tick / 1000, tz=timezone.utc
+        )
+        return created_at, (number >> SEQUENCE_BITS) & MAX_NODE, number & MAX_SEQUENCE
+
+
+_allocator = None
+
+
+def get_allocator():
+    """Return the configured allocator (settings.ORDER_ID_ALLOCATOR)."""
+    global _allocator
+    if _allocator is None:
+        _allocator = import_string(
+            getattr(settings, "ORDER_ID_ALLOCATOR", DEFAULT_ALLOCATOR)
+        )()
+    return _allocator
+
+
+def allocate_order_id():
+    return get_allocator().allocate()
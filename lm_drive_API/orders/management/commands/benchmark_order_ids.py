@@ -0,0 +1,69 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from authentication.models import Customer
+from orders.ids import RandomOrderIdAllocator, TimeOrderedIdAllocator
+from orders.models import Order
+from store.models import Store
+
+SCHEMES = {
+    "random": RandomOrderIdAllocator,
+    "time-ordered": TimeOrderedIdAllocator,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the insert throughput of random and time-ordered order ids on "
+        "the configured database. Every insert is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=20000)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1,
+            help="Orders per INSERT (1 is one order per checkout).",
+        )
+
+    def handle(self, *args, **options):
+        for label, allocator_class in SCHEMES.items():
+            allocator = allocator_class()
+            order_ids = [allocator.allocate() for _ in range(options["orders"])]
+            with transaction.atomic():
+                elapsed = self.insert(order_ids, options["batch_size"])
+                transaction.set_rollback(True)
+            self.stdout.write(
+                f"{label}: {len(order_ids)} orders in {elapsed:.2f} s, "
+                f"{len(order_ids) / elapsed:.0f} orders/s, "
+                f"{self.out_of_order(order_ids):.0%} inserted before a larger id"
+            )
+
+    def insert(self, order_ids, batch_size):
+        user = User.objects.create_user(username="benchmark_order_ids")
+        customer = Customer.objects.create(
+            user=user, email="benchmark_order_ids@example.com"
+        )
+        store = Store.objects.create(store_id="BENCH", name="Benchmark")
+        start = time.perf_counter()
+        for offset in range(0, len(order_ids), batch_size):
+            Order.objects.bulk_create(
+                [
+                    Order(order_id=order_id, customer=customer, store=store)
+                    for order_id in order_ids[offset : offset + batch_size]
+                ]
+            )
+        return time.perf_counter() - start
+
+    @staticmethod
+    def out_of_order(order_ids):
+        """Share of the ids inserted in the middle of the index, not at its end."""
+        largest, count = "", 0
+        for order_id in order_ids:
+            if order_id < largest:
+                count += 1
+            largest = max(largest, order_id)
+        return count / len(order_ids)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from orders.recommendations import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the product co-occurrence counts and the frequently bought "
+        "together recommendations from all fulfilled orders."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of rows read or written per query.",
+        )
+
+    def handle(self, *args, **options):
+        pairs, products = rebuild(batch_size=options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{pairs} product pairs, recommendations for {products} products."
+            )
+        )
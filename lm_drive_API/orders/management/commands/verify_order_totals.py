@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from orders.models import find_total_drift, recompute_order_totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Check that the totals of every order equal the sum of its items, and "
+        "with --repair recompute the ones that drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--repair", action="store_true", help="Recompute the drifted totals."
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of orders checked or repaired per query.",
+        )
+
+    def handle(self, *args, **options):
+        drifted = []
+        for order_id, stored, expected in find_total_drift(options["batch_size"]):
+            drifted.append(order_id)
+            self.stdout.write(
+                f"{order_id}: {stored[0]} HT / {stored[1]} TTC stored, "
+                f"{expected[0]} HT / {expected[1]} TTC from its items"
+            )
+            if options["repair"] and len(drifted) % options["batch_size"] == 0:
+                recompute_order_totals(drifted[-options["batch_size"] :])
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS("All order totals are consistent."))
+            return
+        if options["repair"]:
+            remainder = len(drifted) % options["batch_size"]
+            if remainder:
+                recompute_order_totals(drifted[-remainder:])
+            self.stdout.write(self.style.SUCCESS(f"{len(drifted)} orders repaired."))
+        else:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"{len(drifted)} orders drifted, run with --repair to fix them."
+                )
+            )
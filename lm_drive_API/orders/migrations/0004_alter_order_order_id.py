@@ -0,0 +1,20 @@
+# Generated by Django 5.1.4 on 2026-10-17 00:05
+
+import orders.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """Existing ids are kept; the foreign keys to orders widen with the column."""
+
+    dependencies = [
+        ('orders', '0003_product_recommendations'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='order_id',
+            field=models.CharField(default=orders.models.generate_order_id, max_length=12, primary_key=True, serialize=False, unique=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.4 on 2026-10-17 00:10
+
+from django.db import migrations, models
+
+
+def mark_fulfilled_baskets(apps, schema_editor):
+    """Orders already fulfilled were counted when they were fulfilled."""
+    Order = apps.get_model('orders', 'Order')
+    Order.objects.filter(status='fulfilled').update(basket_recorded=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_alter_order_order_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='basket_recorded',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_fulfilled_baskets, migrations.RunPython.noop),
+    ]
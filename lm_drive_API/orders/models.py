@@ -1,15 +1,27 @@
-from django.db import models
-from store.models import Product
-import uuid
+from decimal import Decimal
+
+from django.db import IntegrityError, models, transaction
+from store.models import Product, compute_price_ttc
+from store.utils import bulk_upsert
 from authentication.models import Customer
 from django.utils import timezone
-from django.db.models import Sum, F
+from django.db.models import F, Sum, Window
+from django.db.models.functions import RowNumber
 from rest_framework.exceptions import ValidationError as DRFValidationError
 
+from .ids import allocate_order_id
+
 
 def generate_order_id():
-    """Generate a unique 8-character UUID."""
-    return uuid.uuid4().hex[:8]  # Increased to 8 characters for better uniqueness
+    """Allocate the id of a new order, see orders.ids."""
+    return allocate_order_id()
+
+
+# Ids allocated for a new order before giving up on id collisions
+ORDER_ID_ATTEMPTS = 3
+
+# Order fields kept equal to the sum of the items' totals
+TOTAL_FIELDS = ("total_ht", "total_ttc")
 
 
 class Order(models.Model):
@@ -31,19 +43,29 @@ class Order(models.Model):
         max_digits=10, decimal_places=2, default=0.00, verbose_name="Total TTC"
     )
     order_id = models.CharField(
-        max_length=8, default=generate_order_id, unique=True, primary_key=True
+        max_length=12, default=generate_order_id, unique=True, primary_key=True
     )
     store = models.ForeignKey("store.Store", on_delete=models.CASCADE)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
     confirmed_date = models.DateTimeField(null=True, blank=True)
     fulfilled_date = models.DateTimeField(null=True, blank=True)
+    # Whether the basket was counted in the recommendations (see ProductPair)
+    basket_recorded = models.BooleanField(default=False, editable=False)
     update_date = models.DateTimeField(auto_now=True)
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Whether order_id comes from the allocator, which save may call again
+        self._order_id_allocated = not args and not {"order_id", "pk"} & kwargs.keys()
+
     def __str__(self):
         return f"Order {self.order_id} for {self.customer}"
 
     def update_totals(self):
-        """Update the total HT and total TTC of the order based on related OrderItems."""
+        """
+        Recompute the total HT and total TTC of the order from its OrderItems.
+        The items keep the totals up to date themselves; this repairs them.
+        """
         totals = self.items.aggregate(
             total_ht=Sum(F("price_ht") * F("quantity")),
             total_ttc=Sum(F("price_ttc") * F("quantity")),
@@ -68,8 +90,48 @@ class Order(models.Model):
         elif self.status != "fulfilled":
             self.fulfilled_date = None
 
-        super().save(*args, **kwargs)  # Save first to ensure the order exists
-        self.update_totals()  # Ensure totals are calculated
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            # The totals are maintained by the items with increments: writing
+            # them back from memory could undo concurrent item changes.
+            # basket_recorded is only ever set below.
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in TOTAL_FIELDS + ("basket_recorded",)
+            ]
+        if self._state.adding and self._order_id_allocated:
+            self.insert_with_free_id(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
+
+        if self.status == "fulfilled" and not self.basket_recorded:
+            # Feed the "frequently bought together" recommendations, once per
+            # order even if it is fulfilled again after going back to pending.
+            self.basket_recorded = True
+            if Order.objects.filter(pk=self.pk, basket_recorded=False).update(
+                basket_recorded=True
+            ):
+                ProductPair.record_basket(
+                    self.items.values_list("product_id", flat=True)
+                )
+
+    def insert_with_free_id(self, *args, **kwargs):
+        """
+        Insert the order, allocating another id when its id is already taken
+        (by a process sharing its node, see orders.ids).
+        """
+        for attempt in range(ORDER_ID_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                if attempt == ORDER_ID_ATTEMPTS - 1 or not (
+                    Order.objects.filter(pk=self.order_id).exists()
+                ):
+                    raise
+                self.order_id = generate_order_id()
 
 
 class OrderItem(models.Model):
@@ -115,26 +177,277 @@ class OrderItem(models.Model):
         if self.quantity < 1:
             raise DRFValidationError("The quantity must be at least 1.")
 
-    def save(self, *args, **kwargs):
-        """Set the price and totals before saving."""
-        self.full_clean()  # Validate the model
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_saved_totals()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self.remember_saved_totals()
+
+    def remember_saved_totals(self):
+        """
+        Remember what the item adds to its order (see add_to_order_totals)
+        and the product it was priced from (see set_prices).
+        """
+        self._saved_totals = (
+            self.__dict__.get("order_id"),
+            self.__dict__.get("total_ht"),
+            self.__dict__.get("total_ttc"),
+        )
+        self._saved_product_id = self.__dict__.get("product_id")
 
-        if self.product:
+    def add_to_order_totals(self, total_ht, total_ttc):
+        """
+        Add amounts to the totals of the item's order, with an increment in
+        the database rather than an aggregate of the items.
+        """
+        if not (total_ht or total_ttc):
+            return
+        add_to_order_totals(self.order_id, total_ht, total_ttc)
+        if OrderItem.order.is_cached(self):
+            # New orders hold the float defaults.
+            self.order.total_ht = cents(self.order.total_ht) + total_ht
+            self.order.total_ttc = cents(self.order.total_ttc) + total_ttc
+
+    def set_prices(self, copy=True):
+        """
+        Copy the product's prices, if any and unless `copy` is false (the
+        item keeps the prices it was added at), and compute the line totals.
+        """
+        if copy and self.product:
             # Use product's price_ht and tva
             self.price_ht = self.product.price_ht
             self.tva = self.product.tva
-            self.price_ttc = round(self.price_ht * (1 + self.tva / 100), 2)
+            self.price_ttc = compute_price_ttc(self.price_ht, self.tva)
 
         # Calculate totals based on quantity
         self.total_ht = round(self.price_ht * self.quantity, 2)
         self.total_ttc = round(self.price_ttc * self.quantity, 2)
 
-        super().save(*args, **kwargs)
+    def save(self, *args, **kwargs):
+        """Set the price and totals before saving."""
+        self.full_clean()  # Validate the model
+        previous = product_id = None
+        if not self._state.adding:
+            previous = getattr(self, "_saved_totals", None)
+            product_id = getattr(self, "_saved_product_id", None)
+            if previous is None or None in previous or product_id is None:
+                row = (
+                    OrderItem.objects.filter(pk=self.pk)
+                    .values_list("order_id", "total_ht", "total_ttc", "product_id")
+                    .first()
+                )
+                previous, product_id = (row[:3], row[3]) if row else (None, None)
+        # Prices are copied once: repricings decide what existing items pay
+        # (see store.repricing).
+        self.set_prices(copy=self._state.adding or product_id != self.product_id)
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            # Move the order's totals by the change of the line totals
+            total_ht = total_ttc = 0
+            if previous is not None:
+                order_id, total_ht, total_ttc = previous
+                if order_id != self.order_id:
+                    add_to_order_totals(order_id, -total_ht, -total_ttc)
+                    total_ht = total_ttc = 0
+            self.add_to_order_totals(
+                self.total_ht - total_ht, self.total_ttc - total_ttc
+            )
+        self.remember_saved_totals()
+
+
+def add_to_order_totals(order_id, total_ht, total_ttc):
+    """Increment the totals of an order, within the current transaction."""
+    Order.objects.filter(pk=order_id).update(
+        total_ht=F("total_ht") + total_ht,
+        total_ttc=F("total_ttc") + total_ttc,
+        update_date=timezone.now(),
+    )
+
+
+def find_total_drift(batch_size=1000):
+    """
+    Yield (order_id, (total_ht, total_ttc) stored, (total_ht, total_ttc) of
+    its items) for the orders whose totals differ from their items', reading
+    the orders in primary key batches of `batch_size`.
+    """
+    orders = Order.objects.order_by("pk").values_list("pk", *TOTAL_FIELDS)
+    last = None
+    while True:
+        batch = orders if last is None else orders.filter(pk__gt=last)
+        batch = list(batch[:batch_size])
+        if not batch:
+            return
+        last = batch[-1][0]
+        computed = {
+            order_id: (total_ht, total_ttc)
+            for order_id, total_ht, total_ttc in OrderItem.objects.filter(
+                order_id__in=[order_id for order_id, _, _ in batch]
+            )
+            .order_by()
+            .values("order_id")
+            .annotate(
+                total_ht=Sum(F("price_ht") * F("quantity")),
+                total_ttc=Sum(F("price_ttc") * F("quantity")),
+            )
+            .values_list("order_id", "total_ht", "total_ttc")
+        }
+        for order_id, total_ht, total_ttc in batch:
+            stored = (cents(total_ht), cents(total_ttc))
+            expected = tuple(cents(total) for total in computed.get(order_id, (0, 0)))
+            if stored != expected:
+                yield order_id, stored, expected
+
+
+def cents(amount):
+    return Decimal(str(amount or 0)).quantize(Decimal("0.01"))
 
-        # Update the order's totals
-        self.order.update_totals()
 
-    def delete(self, *args, **kwargs):
-        """Update the order's totals before deleting."""
-        super().delete(*args, **kwargs)
-        self.order.update_totals()
+def recompute_order_totals(order_ids):
+    """
+    Recompute the totals of several orders from their items, with one grouped
+    query and one bulk update (Order.update_totals does one order at a time).
+    """
+    order_ids = set(order_ids)
+    if not order_ids:
+        return 0
+    totals = {
+        order_id: (total_ht, total_ttc)
+        for order_id, total_ht, total_ttc in OrderItem.objects.filter(
+            order_id__in=order_ids
+        )
+        .order_by()
+        .values("order_id")
+        .annotate(
+            total_ht=Sum(F("price_ht") * F("quantity")),
+            total_ttc=Sum(F("price_ttc") * F("quantity")),
+        )
+        .values_list("order_id", "total_ht", "total_ttc")
+    }
+    update_date = timezone.now()
+    orders = []
+    for order_id in order_ids:
+        total_ht, total_ttc = totals.get(order_id, (0, 0))
+        orders.append(
+            Order(
+                order_id=order_id,
+                total_ht=total_ht or 0,
+                total_ttc=total_ttc or 0,
+                update_date=update_date,
+            )
+        )
+    return Order.objects.bulk_update(
+        orders, ["total_ht", "total_ttc", "update_date"], batch_size=500
+    )
+
+
+# Number of related products kept per product by ProductRecommendation
+RECOMMENDATIONS_PER_PRODUCT = 20
+
+
+class ProductPair(models.Model):
+    """
+    How many fulfilled orders contained both products: one cell of the sparse
+    co-occurrence matrix, stored in both directions. Kept up to date as orders
+    are fulfilled and rebuilt by the `rebuild_recommendations` command.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("product", "related")
+        indexes = [
+            models.Index(fields=["product", "-count"], name="pair_product_count_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} + {self.related_id}: {self.count}"
+
+    @classmethod
+    def record_basket(cls, product_ids):
+        """
+        Count one more order containing each pair of `product_ids` and refresh
+        their recommendations. Rows created concurrently for the same new
+        pair may lose an increment, which the nightly rebuild restores.
+        """
+        product_ids = sorted({product_id for product_id in product_ids if product_id})
+        if len(product_ids) < 2:
+            return
+        with transaction.atomic():
+            existing = {
+                (pair.product_id, pair.related_id): pair
+                for pair in cls.objects.select_for_update()
+                .filter(product_id__in=product_ids, related_id__in=product_ids)
+                .order_by("pk")
+            }
+            for pair in existing.values():
+                pair.count += 1
+            cls.objects.bulk_update(existing.values(), ["count"], batch_size=1000)
+            cls.objects.bulk_create(
+                [
+                    cls(product_id=product_id, related_id=related_id, count=1)
+                    for product_id in product_ids
+                    for related_id in product_ids
+                    if product_id != related_id
+                    and (product_id, related_id) not in existing
+                ],
+                batch_size=1000,
+                ignore_conflicts=True,
+            )
+            ProductRecommendation.refresh(product_ids)
+
+
+class ProductRecommendation(models.Model):
+    """
+    The products most often bought with a product, precomputed from
+    ProductPair so that serving them is a primary key lookup.
+    """
+
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True, related_name="+"
+    )
+    # [[related product_id, count], ...], most frequent first
+    related = models.JSONField(default=list)
+    update_date = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Recommendations for {self.product_id}"
+
+    @classmethod
+    def refresh(cls, product_ids):
+        """Recompute the recommendations of `product_ids` from their pairs."""
+        product_ids = set(product_ids)
+        top = (
+            ProductPair.objects.filter(product_id__in=product_ids)
+            .annotate(
+                rank=Window(
+                    RowNumber(),
+                    partition_by=F("product_id"),
+                    order_by=[F("count").desc(), F("related_id").asc()],
+                )
+            )
+            .filter(rank__lte=RECOMMENDATIONS_PER_PRODUCT)
+            .order_by("product_id", "rank")
+            .values_list("product_id", "related_id", "count")
+        )
+        related = {product_id: [] for product_id in product_ids}
+        for product_id, related_id, count in top:
+            related[product_id].append([related_id, count])
+        bulk_upsert(
+            cls,
+            [
+                cls(product_id=product_id, related=pairs, update_date=timezone.now())
+                for product_id, pairs in related.items()
+            ],
+            unique_fields=["product"],
+            update_fields=["related", "update_date"],
+            batch_size=1000,
+        )
@@ -0,0 +1,107 @@
+"""
+"Frequently bought together" recommendations.
+
+The co-occurrence matrix of products in fulfilled orders is stored sparsely
+as ProductPair rows (one per pair of products bought together at least
+once, in both directions). Fulfilling an order increments the pairs of its
+basket (Order.save, only the first time: see Order.basket_recorded) and
+refreshes the ProductRecommendation rows of its products, which hold the
+precomputed top products: serving them is a single primary key lookup.
+`rebuild_recommendations` recomputes everything from the order history,
+nightly.
+"""
+
+from collections import Counter, defaultdict
+from itertools import permutations
+
+from django.db import transaction
+
+from store.models import Product
+
+from .models import (
+    RECOMMENDATIONS_PER_PRODUCT,
+    OrderItem,
+    ProductPair,
+    ProductRecommendation,
+)
+
+
+def count_pairs(baskets):
+    """Return a Counter of (product_id, related_id) over `baskets`."""
+    counts = Counter()
+    for basket in baskets:
+        counts.update(permutations(sorted(set(basket)), 2))
+    return counts
+
+
+def fulfilled_baskets(chunk_size=5000):
+    """Yield the product ids of each fulfilled order, streaming the items."""
+    items = (
+        OrderItem.objects.filter(order__status="fulfilled", product__isnull=False)
+        .order_by("order_id")
+        .values_list("order_id", "product_id")
+        .iterator(chunk_size=chunk_size)
+    )
+    current, basket = None, []
+    for order_id, product_id in items:
+        if order_id != current:
+            if len(basket) > 1:
+                yield basket
+            current, basket = order_id, []
+        basket.append(product_id)
+    if len(basket) > 1:
+        yield basket
+
+
+def rebuild(batch_size=5000):
+    """
+    Recompute every pair and recommendation from the fulfilled orders.
+    Returns (number of pairs, number of products with recommendations).
+    """
+    counts = count_pairs(fulfilled_baskets(batch_size))
+    by_product = defaultdict(list)
+    for (product_id, related_id), count in counts.items():
+        by_product[product_id].append((-count, related_id))
+    with transaction.atomic():
+        ProductPair.objects.all().delete()
+        ProductPair.objects.bulk_create(
+            (
+                ProductPair(product_id=product_id, related_id=related_id, count=count)
+                for (product_id, related_id), count in counts.items()
+            ),
+            batch_size=batch_size,
+        )
+        ProductRecommendation.objects.all().delete()
+        ProductRecommendation.objects.bulk_create(
+            (
+                ProductRecommendation(
+                    product_id=product_id,
+                    related=[
+                        [related_id, -negative]
+                        for negative, related_id in sorted(pairs)[
+                            :RECOMMENDATIONS_PER_PRODUCT
+                        ]
+                    ],
+                )
+                for product_id, pairs in by_product.items()
+            ),
+            batch_size=batch_size,
+        )
+    return len(counts), len(by_product)
+
+
+def related_products(product_id, limit=RECOMMENDATIONS_PER_PRODUCT):
+    """
+    Return the products for sale most often bought with `product_id`, as
+    [(product, count)], from its precomputed recommendations.
+    """
+    recommendation = ProductRecommendation.objects.filter(pk=product_id).first()
+    if recommendation is None:
+        return []
+    counts = dict(recommendation.related)
+    products = Product.objects.filter(pk__in=counts, is_for_sale=True).in_bulk()
+    return [
+        (products[related_id], count)
+        for related_id, count in recommendation.related
+        if related_id in products
+    ][:limit]
@@ -1,9 +1,12 @@
 from rest_framework import serializers
-from rest_framework.exceptions import ValidationError
 from .models import Order, OrderItem
 from authentication.models import Customer
-from store.models import Product, Store
-from store.serializers import ProductSerializer  # Assuming ProductSerializer exists
+from store.models import Store
+from store.serializers import (  # Assuming ProductSerializer exists
+    ProductSerializer,
+    SparseFieldsetMixin,
+)
+from .services import create_order, load_products, reserve_items
 from django.db import transaction
 
 
@@ -11,7 +14,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
     product = ProductSerializer(
         read_only=True
     )  # Use ProductSerializer for product details
-    product_id = serializers.IntegerField(write_only=True)  # Allow writable product_id
+    product_id = serializers.CharField(write_only=True)  # Allow writable product_id
     total_ht = serializers.ReadOnlyField()  # Total HT is calculated automatically
     total_ttc = serializers.ReadOnlyField()  # Total TTC is calculated automatically
 
@@ -34,20 +37,13 @@ class OrderItemSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Quantity must be greater than zero.")
         return value
 
-    def validate_product_id(self, value):
-        if not Product.objects.filter(id=value).exists():
-            raise serializers.ValidationError("Product with this ID does not exist.")
-        return value
-
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, required=False)  # Allow writable items
     total_ht = serializers.ReadOnlyField()  # Make total_ht read-only
     total_ttc = serializers.ReadOnlyField()  # Make total_ttc read-only
-    store_id = serializers.IntegerField(write_only=True)  # Allow writable store_id
-    customer_id = serializers.IntegerField(
-        write_only=True
-    )  # Allow writable customer_id
+    store_id = serializers.CharField(write_only=True)  # Allow writable store_id
+    customer_id = serializers.CharField(write_only=True)  # Allow writable customer_id
 
     class Meta:
         model = Order
@@ -82,34 +78,8 @@ class OrderSerializer(serializers.ModelSerializer):
         store = validated_data.pop("store_id")
         customer = validated_data.pop("customer_id")
 
-        with transaction.atomic():
-            order = Order.objects.create(
-                customer=customer, store=store, **validated_data
-            )
-
-            order_items = []
-            for item_data in items_data:
-                product = Product.objects.get(id=item_data["product_id"])
-                item_data["price_ht"] = product.price_ht
-                item_data["tva"] = product.tva
-                item_data["price_ttc"] = round(
-                    product.price_ht * (1 + product.tva / 100), 2
-                )
-                item_data["total_ht"] = round(
-                    item_data["price_ht"] * item_data["quantity"], 2
-                )
-                item_data["total_ttc"] = round(
-                    item_data["price_ttc"] * item_data["quantity"], 2
-                )
-
-                order_items.append(OrderItem(order=order, **item_data))
-
-            OrderItem.objects.bulk_create(order_items)
-
-            # Update totals in the order
-            order.update_totals()
-
-            return order
+        # Priced and inserted in bulk, see orders.services
+        return create_order(customer, store, items_data, **validated_data)
 
     def update(self, instance, validated_data):
         items_data = validated_data.pop("items", None)
@@ -132,19 +102,12 @@ class OrderSerializer(serializers.ModelSerializer):
                     order=instance, id__in=existing_items - current_item_ids
                 ).delete()
 
+                products = load_products(
+                    {item_data["product_id"] for item_data in items_data}
+                )
                 for item_data in items_data:
-                    product = Product.objects.get(id=item_data["product_id"])
-                    item_data["price_ht"] = product.price_ht
-                    item_data["tva"] = product.tva
-                    item_data["price_ttc"] = round(
-                        product.price_ht * (1 + product.tva / 100), 2
-                    )
-                    item_data["total_ht"] = round(
-                        item_data["price_ht"] * item_data["quantity"], 2
-                    )
-                    item_data["total_ttc"] = round(
-                        item_data["price_ttc"] * item_data["quantity"], 2
-                    )
+                    # Prices and totals are set by OrderItem.save
+                    item_data["product"] = products[item_data.pop("product_id")]
 
                     if "id" in item_data:
                         order_item = OrderItem.objects.get(
@@ -156,13 +119,15 @@ class OrderSerializer(serializers.ModelSerializer):
                     else:
                         OrderItem.objects.create(order=instance, **item_data)
 
-            # Update totals in the order
-            instance.update_totals()
+                reserve_items(instance)
+
+            # Kept up to date by the items, see OrderItem.save
+            instance.refresh_from_db(fields=["total_ht", "total_ttc"])
 
         return instance
 
 
-class OrderListSerializer(serializers.ModelSerializer):
+class OrderListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     customer_id = serializers.CharField(source="customer.customer_id", read_only=True)
     store_id = serializers.CharField(source="store.store_id", read_only=True)
     total_ht = serializers.DecimalField(
@@ -187,7 +152,6 @@ class OrderListSerializer(serializers.ModelSerializer):
         ]
 
 
-
 class OrderItemUpdateSerializer(serializers.ModelSerializer):
     customer_id = serializers.CharField(
         source="order.customer.customer_id", read_only=True
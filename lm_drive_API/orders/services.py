@@ -0,0 +1,103 @@
+"""
+Order creation.
+
+A basket is validated and priced in memory: its products are loaded with one
+query, its items inserted with one bulk_create and the order totals computed
+once, instead of a product lookup, a validation, an insert and a totals
+aggregate per item.
+"""
+
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from store.models import Product
+from store.reservations import InsufficientStock, reserve_order
+
+from .models import Order, OrderItem
+
+PRICE_FIELDS = ["product_id", "price_ht", "tva"]
+
+
+def reserve_items(order, quantities=None):
+    """
+    Reserve the stock of a pending order's items (see store.reservations),
+    read from the database unless given as {product_id: quantity}. The
+    reservations of other orders are left as they are, until they expire.
+    """
+    if order.status != "pending":
+        return
+    if quantities is None:
+        quantities = dict(order.items.values_list("product_id", "quantity"))
+    try:
+        reserve_order(order, quantities)
+    except InsufficientStock as e:
+        raise ValidationError({"stock": e.messages})
+
+
+def basket_quantities(items):
+    """
+    Return {product_id: quantity} of `items`, [{"product_id", "quantity"}]
+    (quantity 1 by default), merging repeated products.
+    """
+    quantities = {}
+    errors = []
+    for item in items:
+        product_id = item.get("product_id")
+        try:
+            quantity = int(item.get("quantity", 1))
+        except (TypeError, ValueError):
+            quantity = 0
+        if not product_id:
+            errors.append("Each item needs a product_id.")
+        elif quantity < 1:
+            errors.append(f"Quantity of product {product_id} must be at least 1.")
+        else:
+            product_id = str(product_id)
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+    if errors:
+        raise ValidationError({"items": errors})
+    return quantities
+
+
+def load_products(product_ids):
+    """Return {product_id: product} with their prices, in one query."""
+    products = Product.objects.only(*PRICE_FIELDS).in_bulk(product_ids)
+    unknown = sorted(set(product_ids) - set(products))
+    if unknown:
+        raise ValidationError(
+            {
+                "items": [
+                    f"Product {product_id} does not exist." for product_id in unknown
+                ]
+            }
+        )
+    return products
+
+
+@transaction.atomic
+def create_order(customer, store, items, **fields):
+    """
+    Create an order of `store` for `customer` with its `items` (see
+    basket_quantities) and reserve their stock if it is pending. Raises
+    ValidationError, creating nothing, for unknown products, invalid
+    quantities or missing stock.
+    """
+    quantities = basket_quantities(items)
+    products = load_products(quantities)
+
+    order = Order(customer=customer, store=store, **fields)
+    order.save()
+    order_items = []
+    for product_id, quantity in quantities.items():
+        item = OrderItem(order=order, product=products[product_id], quantity=quantity)
+        item.set_prices()
+        order_items.append(item)
+    OrderItem.objects.bulk_create(order_items)
+
+    order.total_ht = sum(item.total_ht for item in order_items)
+    order.total_ttc = sum(item.total_ttc for item in order_items)
+    Order.objects.filter(pk=order.pk).update(
+        total_ht=order.total_ht, total_ttc=order.total_ttc
+    )
+    reserve_items(order, quantities)
+    return order
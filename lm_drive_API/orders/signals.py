@@ -0,0 +1,18 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .models import Order, OrderItem
+
+
+@receiver(post_delete, sender=OrderItem)
+def subtract_deleted_item(sender, instance, origin=None, **kwargs):
+    """
+    Take deleted items out of their order's totals, whether deleted one by
+    one, in bulk or by cascade (of a product, for instance).
+    """
+    if isinstance(origin, Order) or getattr(origin, "model", None) is Order:
+        return  # The order goes too.
+    previous = getattr(instance, "_saved_totals", None)
+    if previous is None or None in previous:
+        previous = (instance.order_id, instance.total_ht, instance.total_ttc)
+    _, total_ht, total_ttc = previous
+    instance.add_to_order_totals(-total_ht, -total_ttc)
@@ -1,3 +1,457 @@
-from django.test import TestCase
+import io
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from rest_framework.test import APIClient
+from store.models import Product, Stock
+from store.testing import StoreTestMixin
+from . import ids
+from .ids import TimeOrderedIdAllocator
+from .models import Order, OrderItem, ProductPair, ProductRecommendation
+from .recommendations import rebuild
+from .serializers import OrderSerializer
 
-# Create your tests here.
+
+class OrderConditionalGetTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        self.customer = self.create_customer()
+        self.user = self.customer.user
+        self.store = self.create_store()
+        self.product = self.create_product()
+        self.order = Order.objects.create(customer=self.customer, store=self.store)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_order_detail_and_list_answer_304_until_the_order_changes(self):
+        for url in [f"/api/orders/{self.order.order_id}/", "/api/orders/"]:
+            etag = self.client.get(url).headers["ETag"]
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+            OrderItem.objects.create(order=self.order, product=self.product)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            OrderItem.objects.filter(order=self.order).delete()
+
+    def test_order_detail_changes_with_its_products(self):
+        OrderItem.objects.create(order=self.order, product=self.product)
+        url = f"/api/orders/{self.order.order_id}/"
+        etag = self.client.get(url).headers["ETag"]
+        # A stock change or a repricing marks the product as modified.
+        Product.objects.filter(pk=self.product.pk).touch()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+
+class OrderReservationTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        self.customer = self.create_customer()
+        self.user = self.customer.user
+        self.store = self.create_store()
+        self.product = self.create_product()
+        self.stock = Stock.objects.create(
+            store=self.store, product=self.product, quantity_in_stock=3
+        )
+        self.order = Order.objects.create(customer=self.customer, store=self.store)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def add_item(self, quantity):
+        return self.client.post(
+            f"/api/orders/{self.order.order_id}/add-item/",
+            {"order_id": self.order.order_id, "product_id": "P1", "quantity": quantity},
+            format="json",
+        )
+
+    def test_adding_items_reserves_stock(self):
+        self.assertEqual(self.add_item(2).status_code, 201)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.available_to_promise, 1)
+
+        response = self.add_item(2)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("stock", response.data)
+        # The rejected addition left the item unchanged.
+        self.assertEqual(self.order.items.get().quantity, 2)
+
+        item = self.order.items.get()
+        self.client.delete(f"/api/orders/{self.order.order_id}/item/{item.id}/")
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.reserved_quantity, 0)
+
+    def test_confirming_an_order_restarts_its_reservations(self):
+        self.add_item(2)
+        self.order.reservations.update(expires_at=now())
+        response = self.client.patch(
+            f"/api/orders/{self.order.order_id}/",
+            {"status": "confirmed"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        reservation = self.order.reservations.get()
+        self.assertGreater(reservation.expires_at, now() + timedelta(minutes=20))
+
+
+class OrderAdminQueryBudgetTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        self.store = self.create_store()
+        self.product = self.create_product()
+        admin = User.objects.create_superuser(username="admin", password="x")
+        self.client.force_login(admin)
+
+    def create_rows(self, count):
+        for index in range(Order.objects.count(), count):
+            customer = self.create_customer(f"customer{index}")
+            order = Order.objects.create(customer=customer, store=self.store)
+            OrderItem.objects.create(order=order, product=self.product, quantity=1)
+
+    def test_order_changelist(self):
+        # Session, user, count, orders with customers and stores, then the
+        # store filter; customers are not listed
+        self.assertChangelistQueries("/admin/orders/order/", 5, self.create_rows)
+
+    def test_order_item_changelist(self):
+        self.assertChangelistQueries("/admin/orders/orderitem/", 4, self.create_rows)
+
+
+class RecommendationTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        self.customer = self.create_customer()
+        self.store = self.create_store()
+        for index in range(1, 5):
+            self.create_product(f"P{index}", f"Buldak {index}")
+        self.client = APIClient()
+
+    def fulfil(self, *product_ids):
+        order = Order.objects.create(customer=self.customer, store=self.store)
+        for product_id in product_ids:
+            OrderItem.objects.create(order=order, product_id=product_id, quantity=1)
+        order.status = "fulfilled"
+        order.save()
+        return order
+
+    def related(self, product_id):
+        return ProductRecommendation.objects.get(pk=product_id).related
+
+    def test_fulfilled_orders_update_recommendations(self):
+        self.fulfil("P1", "P2", "P3")
+        order = self.fulfil("P1", "P3")
+        # Saving a fulfilled order again counts nothing.
+        order.save()
+        Order.objects.create(customer=self.customer, store=self.store)
+
+        self.assertEqual(self.related("P1"), [["P3", 2], ["P2", 1]])
+        self.assertEqual(self.related("P2"), [["P1", 1], ["P3", 1]])
+        self.assertEqual(ProductPair.objects.count(), 6)
+
+    def test_orders_fulfilled_again_are_counted_once(self):
+        order = self.fulfil("P1", "P2")
+        order.status = "pending"
+        order.save()
+        order.status = "fulfilled"
+        order.save()
+        self.assertEqual(self.related("P1"), [["P2", 1]])
+
+        # Nor twice by two copies of an order fulfilled at the same time
+        order = Order.objects.create(customer=self.customer, store=self.store)
+        OrderItem.objects.create(order=order, product_id="P1", quantity=1)
+        OrderItem.objects.create(order=order, product_id="P2", quantity=1)
+        copy = Order.objects.get(pk=order.pk)
+        for instance in (order, copy):
+            instance.status = "fulfilled"
+            instance.save()
+        self.assertEqual(self.related("P1"), [["P2", 2]])
+
+    def test_rebuild_matches_incremental_counts(self):
+        self.fulfil("P1", "P2", "P3")
+        self.fulfil("P1", "P3")
+        self.fulfil("P4")
+        incremental = {pk: self.related(pk) for pk in ("P1", "P2", "P3")}
+        ProductPair.objects.update(count=0)
+        self.assertEqual(rebuild(), (6, 3))
+        self.assertEqual(
+            {pk: self.related(pk) for pk in ("P1", "P2", "P3")}, incremental
+        )
+
+    def test_endpoint_serves_products_for_sale(self):
+        self.fulfil("P1", "P2", "P3")
+        self.fulfil("P1", "P3")
+        Product.objects.filter(pk="P2").update(is_for_sale=False)
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/orders/recommendations/P1/")
+        self.assertEqual(
+            response.data["related"],
+            [{"product_id": "P3", "product_name": "Buldak 3", "count": 2}],
+        )
+        response = self.client.get("/api/orders/recommendations/P4/")
+        self.assertEqual(response.data["related"], [])
+
+
+class OrderCreationTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        self.customer = self.create_customer()
+        self.user = self.customer.user
+        self.store = self.create_store()
+        for index in range(8):
+            product = self.create_product(
+                f"P{index}", f"Buldak {index}", price_ht=Decimal("2.00") + index
+            )
+            Stock.objects.create(
+                store=self.store, product=product, quantity_in_stock=10
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def post(self, items):
+        return self.client.post(
+            "/api/orders/",
+            {
+                "customer_id": self.customer.customer_id,
+                "store_id": "S0",
+                "items": items,
+            },
+            format="json",
+        )
+
+    def test_basket_is_priced_and_reserved(self):
+        response = self.post(
+            [
+                {"product_id": "P0", "quantity": 2},
+                {"product_id": "P1"},
+                {"product_id": "P0", "quantity": 1},
+            ]
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        order = Order.objects.get(pk=response.data["order_id"])
+        self.assertEqual(
+            sorted(order.items.values_list("product_id", "quantity", "total_ttc")),
+            [("P0", 3, Decimal("6.33")), ("P1", 1, Decimal("3.16"))],
+        )
+        self.assertEqual(order.total_ht, Decimal("9.00"))
+        self.assertEqual(order.total_ttc, Decimal("9.49"))
+        self.assertEqual(response.data["total_ttc"], Decimal("9.49"))
+        self.assertEqual(Stock.objects.get(product_id="P0").reserved_quantity, 3)
+
+    def test_query_count_does_not_grow_with_the_basket(self):
+        counts = []
+        for size in (2, 8):
+            Order.objects.all().delete()
+            items = [{"product_id": f"P{index}"} for index in range(size)]
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.post(items).status_code, 201)
+            reservations = sum(
+                "store_stock" in query["sql"] and query["sql"].startswith("UPDATE")
+                for query in queries.captured_queries
+            )
+            # Only the stock reservations are made one product at a time.
+            counts.append(len(queries) - reservations)
+            self.assertEqual(reservations, size)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_invalid_items_create_nothing(self):
+        response = self.post([{"product_id": "P0"}, {"product_id": "NOPE"}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("NOPE", str(response.data["items"]))
+        response = self.post([{"product_id": "P0", "quantity": 0}])
+        self.assertEqual(response.status_code, 400)
+        response = self.post([{"product_id": "P0", "quantity": 11}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("stock", response.data)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Stock.objects.filter(reserved_quantity__gt=0).count(), 0)
+
+    def test_order_serializer_creates_through_the_service(self):
+        serializer = OrderSerializer(
+            data={
+                "customer_id": self.customer.customer_id,
+                "store_id": "S0",
+                "items": [{"product_id": "P2", "quantity": 2}],
+            }
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        order = serializer.save()
+        self.assertEqual(order.total_ht, Decimal("8.00"))
+        self.assertEqual(order.items.get().price_ttc, Decimal("4.22"))
+
+
+class OrderTotalsTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        self.customer = self.create_customer()
+        self.store = self.create_store()
+        for index in range(20):
+            self.create_product(f"P{index}", f"Buldak {index}", tva=Decimal("10.00"))
+        self.order = Order.objects.create(customer=self.customer, store=self.store)
+
+    def totals(self, order=None):
+        order = Order.objects.get(pk=(order or self.order).pk)
+        return order.total_ht, order.total_ttc
+
+    def test_item_changes_move_the_totals(self):
+        first = OrderItem.objects.create(order=self.order, product_id="P0", quantity=2)
+        OrderItem.objects.create(order=self.order, product_id="P1")
+        self.assertEqual(self.totals(), (Decimal("6.00"), Decimal("6.60")))
+        # The order in memory follows too.
+        self.assertEqual(self.order.total_ttc, Decimal("6.60"))
+
+        item = OrderItem.objects.get(pk=first.pk)
+        item.quantity = 5
+        item.save()
+        self.assertEqual(self.totals(), (Decimal("12.00"), Decimal("13.20")))
+
+        other = Order.objects.create(customer=self.customer, store=self.store)
+        item.order = other
+        item.save()
+        self.assertEqual(self.totals(), (Decimal("2.00"), Decimal("2.20")))
+        self.assertEqual(self.totals(other), (Decimal("10.00"), Decimal("11.00")))
+
+        OrderItem.objects.filter(order=other).delete()
+        self.assertEqual(self.totals(other), (Decimal("0.00"), Decimal("0.00")))
+        Product.objects.get(pk="P1").delete()
+        self.assertEqual(self.totals(), (Decimal("0.00"), Decimal("0.00")))
+
+    def test_saving_an_order_leaves_its_totals_alone(self):
+        stale = Order.objects.get(pk=self.order.pk)
+        OrderItem.objects.create(order=self.order, product_id="P0")
+        stale.status = "confirmed"
+        stale.save()
+        self.assertEqual(self.totals(), (Decimal("2.00"), Decimal("2.20")))
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, "confirmed")
+
+    def test_item_save_cost_does_not_grow_with_the_order(self):
+        counts = []
+        for size in (2, 20):
+            for index in range(self.order.items.count(), size):
+                OrderItem.objects.create(order=self.order, product_id=f"P{index}")
+            item = self.order.items.first()
+            item.quantity += 1
+            with CaptureQueriesContext(connection) as queries:
+                item.save()
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_verify_command_repairs_drift(self):
+        OrderItem.objects.create(order=self.order, product_id="P0", quantity=3)
+        Order.objects.create(customer=self.customer, store=self.store)
+        Order.objects.filter(pk=self.order.pk).update(total_ht=Decimal("1.00"))
+
+        output = io.StringIO()
+        call_command("verify_order_totals", stdout=output)
+        self.assertIn(f"{self.order.pk}: 1.00 HT", output.getvalue())
+        self.assertIn("1 orders drifted", output.getvalue())
+        self.assertEqual(self.totals()[0], Decimal("1.00"))
+
+        call_command("verify_order_totals", "--repair", stdout=io.StringIO())
+        self.assertEqual(self.totals(), (Decimal("6.00"), Decimal("6.60")))
+        output = io.StringIO()
+        call_command("verify_order_totals", stdout=output)
+        self.assertIn("All order totals are consistent.", output.getvalue())
+
+
+class OrderIdTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        ids._allocator = None
+        self.addCleanup(setattr, ids, "_allocator", None)
+
+    def test_ids_increase_within_and_across_milliseconds(self):
+        now = [1_800_000_000.0]
+        allocator = TimeOrderedIdAllocator(node=7, clock=lambda: now[0])
+        # More ids than a millisecond holds, then a clock going back
+        allocated = [allocator.allocate() for _ in range(3000)]
+        now[0] -= 1
+        allocated += [allocator.allocate() for _ in range(10)]
+        now[0] += 2
+        allocated.append(allocator.allocate())
+
+        self.assertEqual(allocated, sorted(set(allocated)))
+        self.assertTrue(all(len(order_id) == 12 for order_id in allocated))
+        created_at, node, sequence = TimeOrderedIdAllocator.parse(allocated[0])
+        self.assertEqual((created_at.timestamp(), node, sequence), (now[0] - 1, 7, 0))
+        self.assertIsNone(TimeOrderedIdAllocator.parse("deadbeef"))
+
+    def test_nodes_allocate_distinct_ids(self):
+        def clock():
+            return 1_800_000_000.0
+
+        first = [TimeOrderedIdAllocator(1, clock).allocate() for _ in range(2)]
+        second = TimeOrderedIdAllocator(2, clock).allocate()
+        self.assertEqual(first[0], first[1])  # Separate allocators, same node
+        self.assertNotEqual(first[0], second)
+        with self.assertRaises(ValueError):
+            TimeOrderedIdAllocator(1024)
+
+    def test_processes_without_a_node_lease_distinct_ones(self):
+        allocators = [TimeOrderedIdAllocator(node="") for _ in range(20)]
+        for allocator in allocators:
+            allocator.allocate()
+        self.assertEqual(len({allocator.node for allocator in allocators}), 20)
+
+        # A lease lost while idle is not reused.
+        lease = allocators[0].lease
+        lost = lease.node
+        cache.set(ids.NODE_LEASE_KEY.format(lost), "another process")
+        lease.renewed_at -= ids.NODE_LEASE_TIMEOUT
+        allocators[0].allocate()
+        self.assertNotEqual(allocators[0].node, lost)
+        self.assertEqual(cache.get(ids.NODE_LEASE_KEY.format(lease.node)), lease.holder)
+
+    def test_orders_get_time_ordered_ids_next_to_legacy_ones(self):
+        customer = self.create_customer()
+        store = self.create_store()
+        legacy = Order.objects.create(
+            order_id="deadbeef", customer=customer, store=store
+        )
+        orders = [
+            Order.objects.create(customer=customer, store=store) for _ in range(3)
+        ]
+
+        self.assertEqual(
+            [order.order_id for order in orders],
+            sorted(order.order_id for order in orders),
+        )
+        self.assertIsNotNone(TimeOrderedIdAllocator.parse(orders[0].order_id))
+        self.assertEqual(Order.objects.get(pk="deadbeef"), legacy)
+
+        ids._allocator = None
+        with override_settings(ORDER_ID_ALLOCATOR="orders.ids.RandomOrderIdAllocator"):
+            order = Order.objects.create(customer=customer, store=store)
+        self.assertRegex(order.order_id, r"^[0-9a-f]{8}$")
+
+    def test_nodes_are_not_leased_in_a_per_process_cache(self):
+        local = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        }
+        with override_settings(CACHES=local, ORDER_ID_NODE=None):
+            with self.assertRaises(ImproperlyConfigured):
+                ids.check_node_lease()
+            with override_settings(DEBUG=True):
+                ids.check_node_lease()
+            with override_settings(ORDER_ID_NODE="3"):
+                ids.check_node_lease()
+        ids.check_node_lease()
+
+    def test_taken_ids_are_replaced_by_new_ones(self):
+        customer = self.create_customer()
+        store = self.create_store()
+        taken = Order.objects.create(customer=customer, store=store)
+        # Another process sharing the node allocates the same ids.
+        allocated = iter([taken.order_id, taken.order_id, "0000000000ZZ"])
+        ids._allocator = type(
+            "Allocator", (), {"allocate": lambda _: next(allocated)}
+        )()
+
+        order = Order.objects.create(customer=customer, store=store)
+        self.assertEqual(order.order_id, "0000000000ZZ")
+        # Ids given explicitly are not replaced.
+        with self.assertRaises(IntegrityError):
+            Order.objects.create(
+                order_id=order.order_id, customer=customer, store=store
+            )
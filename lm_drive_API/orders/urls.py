@@ -5,9 +5,16 @@ from .views import (
     OrderDetailView,
     AddOrderItemView,
     OrderItemRetrieveUpdateDestroyView,
+    RelatedProductsView,
 )
 
 urlpatterns = [
+    # Products frequently bought together with a product
+    path(
+        "recommendations/<str:product_id>/",
+        RelatedProductsView.as_view(),
+        name="product-recommendations",
+    ),
     path(
         "", OrderListCreateView.as_view(), name="order-list-create"
     ),  # List and create orders
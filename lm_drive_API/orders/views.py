@@ -11,7 +11,9 @@ from rest_framework.exceptions import (
 from rest_framework.response import Response
 
 from lm_drive_API import settings
-from .models import Order, OrderItem
+from .models import RECOMMENDATIONS_PER_PRODUCT, Order, OrderItem
+from .recommendations import related_products
+from .services import create_order, reserve_items
 from .serializers import (
     OrderSerializer,
     OrderListSerializer,
@@ -19,15 +21,19 @@ from .serializers import (
     OrderItemUpdateSerializer,
 )
 from authentication.models import Customer
+from authentication.permissions import IsStaffOrReadOnly
+from store.conditional import ConditionalGetMixin
 from store.models import Product, Store
+from store.reservations import extend_reservations
 from django.db import transaction
+from django.db.models import Prefetch
 from django.template.loader import render_to_string
 from django.utils.timezone import now
 from weasyprint import HTML
 
 
 # Order List and Create View
-class OrderListCreateView(generics.ListCreateAPIView):
+class OrderListCreateView(ConditionalGetMixin, generics.ListCreateAPIView):
     serializer_class = OrderListSerializer
     permission_classes = [IsAuthenticated]
 
@@ -60,52 +66,36 @@ class OrderListCreateView(generics.ListCreateAPIView):
                 "Only one pending order can be created per customer."
             )
 
-        with transaction.atomic():
-            order = serializer.save(customer=customer, store=store)
-            total_ht, total_ttc = 0, 0
-
-            for item_data in items_data:
-                product = get_object_or_404(Product, product_id=item_data["product_id"])
-                quantity = int(item_data.get("quantity", 1))
-                if quantity < 1:
-                    raise DRFValidationError("Quantity must be at least 1.")
-
-                price_ht = product.price_ht
-                tva = product.tva
-                price_ttc = round(price_ht * (1 + tva / 100), 2)
-                total_ht += price_ht * quantity
-                total_ttc += price_ttc * quantity
-
-                OrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    price_ht=price_ht,
-                    tva=tva,
-                    price_ttc=price_ttc,
-                    quantity=quantity,
-                    total_ht=price_ht * quantity,
-                    total_ttc=price_ttc * quantity,
-                )
-
-            # Update order totals
-            order.total_ht = total_ht
-            order.total_ttc = total_ttc
-            order.save()
+        # Products loaded, items inserted and totals computed in bulk
+        serializer.instance = create_order(
+            customer, store, items_data, **serializer.validated_data
+        )
 
 
-class OrderDetailView(generics.RetrieveUpdateDestroyAPIView):
+class OrderDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Order.objects.select_related("customer", "store").prefetch_related(
         "items"
     )
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
     lookup_field = "order_id"
+    # The nested products (prices, stocks) are rendered too.
+    related_modified_fields = ["items__product__update_date"]
 
     def get_queryset(self):
         user = self.request.user
-        if user.is_staff:
-            return Order.objects.all()
-        return Order.objects.filter(customer__user=user)
+        queryset = Order.objects.select_related("customer__user", "store")
+        if not user.is_staff:
+            queryset = queryset.filter(customer__user=user)
+
+        # Only load the items, and their products, when they are rendered
+        fields = OrderSerializer.get_requested_fields(self.request)
+        if fields is None or "items" in fields:
+            items = OrderItem.objects.prefetch_related(
+                Prefetch("product", queryset=Product.objects.for_catalog())
+            )
+            queryset = queryset.prefetch_related(Prefetch("items", queryset=items))
+        return queryset
 
     def perform_update(self, serializer):
         order = self.get_object()
@@ -124,6 +114,8 @@ class OrderDetailView(generics.RetrieveUpdateDestroyAPIView):
         with transaction.atomic():
             if new_status == "confirmed" and order.status != "confirmed":
                 serializer.save(confirmed_date=now())
+                # Hold the stock while the order is paid
+                extend_reservations(order)
             elif new_status == "fulfilled" and order.status != "fulfilled":
                 serializer.save(fulfilled_date=now())
             else:
@@ -157,14 +149,16 @@ class AddOrderItemView(generics.CreateAPIView):
         if order.customer.user != request.user and not request.user.is_staff:
             raise PermissionDenied("You do not have permission to modify this order.")
 
-        order_item, created = OrderItem.objects.get_or_create(
-            order=order,
-            product=product,
-            defaults={"quantity": quantity, "price_ttc": product.price_ttc},
-        )
-        if not created:
-            order_item.quantity += quantity
-            order_item.save()
+        with transaction.atomic():
+            order_item, created = OrderItem.objects.get_or_create(
+                order=order,
+                product=product,
+                defaults={"quantity": quantity, "price_ttc": product.price_ttc},
+            )
+            if not created:
+                order_item.quantity += quantity
+                order_item.save()
+            reserve_items(order)
 
         return Response(
             OrderItemSerializer(order_item).data, status=status.HTTP_201_CREATED
@@ -188,14 +182,18 @@ class OrderItemRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
         new_quantity = serializer.validated_data.get("quantity", order_item.quantity)
         if int(new_quantity) < 1:
             raise serializers.ValidationError("Quantity must be at least 1.")
-        serializer.save()
+        with transaction.atomic():
+            order_item = serializer.save()
+            reserve_items(order_item.order)
 
     def perform_destroy(self, instance):
         if (
             self.request.user.is_staff
             or instance.order.customer.user == self.request.user
         ):
-            instance.delete()
+            with transaction.atomic():
+                instance.delete()
+                reserve_items(instance.order)
         else:
             raise PermissionDenied(
                 "You do not have permission to delete this order item."
@@ -253,3 +251,30 @@ class GenerateInvoiceView(views.APIView):
         return response
 
 
+class RelatedProductsView(views.APIView):
+    """
+    Products most often bought together with `product_id` (at most `limit`),
+    from the precomputed recommendations (see orders.recommendations).
+    """
+
+    permission_classes = [IsStaffOrReadOnly]
+
+    def get(self, request, product_id):
+        try:
+            limit = int(request.query_params.get("limit", 10))
+        except ValueError:
+            raise DRFValidationError({"limit": "Enter a whole number."})
+        limit = min(max(limit, 1), RECOMMENDATIONS_PER_PRODUCT)
+        return Response(
+            {
+                "product_id": product_id,
+                "related": [
+                    {
+                        "product_id": product.product_id,
+                        "product_name": product.product_name,
+                        "count": count,
+                    }
+                    for product, count in related_products(product_id, limit)
+                ],
+            }
+        )
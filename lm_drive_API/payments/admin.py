@@ -14,6 +14,8 @@ class PaymentAdmin(admin.ModelAdmin):
         "created_at",
     )
 
+    list_select_related = ("order",)
+
     # Specify all fields as read-only
     readonly_fields = (
         "order",
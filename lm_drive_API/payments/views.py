@@ -7,7 +7,7 @@ from rest_framework.exceptions import ValidationError as DRFValidationError
 from django.utils.timezone import now
 from django.db import transaction
 from .models import Order, Payment
-from store.models import Stock
+from store.reservations import InsufficientStock, commit_order_stock
 import stripe
 
 # Set Stripe secret key from settings
@@ -188,28 +188,13 @@ class UpdatePaymentStatusView(APIView):
                 {"error": "Store information is missing or invalid."}
             )
 
-        # Iterate through the items in the order
-        for (
-            order_item
-        ) in order.items.all():  # Assuming `order.items` is a related manager
-            product_id = order_item.product.product_id
-            quantity = order_item.quantity
-
-            try:
-                # Adjust stock atomically using the handle_payment_success method
-                Stock.handle_payment_success(store.store_id, product_id, quantity)
-            except DRFValidationError as e:
-                raise DRFValidationError(
-                    {
-                        "error": f"Stock adjustment failed for product '{order_item.product.product_name}': {e.messages[0]}."
-                    }
-                )
-            except Stock.DoesNotExist:
-                raise DRFValidationError(
-                    {
-                        "error": f"Stock entry does not exist for product '{order_item.product.product_name}' in store '{store.name}'."
-                    }
-                )
+        # Turn the order's stock reservations into a decrement, all or nothing
+        try:
+            commit_order_stock(order)
+        except InsufficientStock as e:
+            raise DRFValidationError(
+                {"error": f"Stock adjustment failed: {' '.join(e.messages)}"}
+            )
 
         return {
             "success": True,
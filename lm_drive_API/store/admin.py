@@ -1,6 +1,8 @@
 from django import forms
 from django.contrib import admin
+from .images import current_variants, variant_urls
 from .models import Product, Category, SubCategory, Stock, Store, Packaging, Brand
+from .utils import EstimatedCountPaginator
 from django.utils.html import mark_safe
 
 
@@ -135,6 +137,7 @@ class ProductAdmin(admin.ModelAdmin):
         "image_thumbnail",
     )
 
+    list_select_related = ("brand", "category", "packaging")
     search_fields = ("product_name", "product_id", "brand__name")
     ordering = ("product_name",)
     list_filter = (
@@ -142,6 +145,9 @@ class ProductAdmin(admin.ModelAdmin):
         "category",
         "subcategories",
     )
+    # Large table: no exact COUNT(*) per page (see EstimatedCountPaginator)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     inlines = [
         SubCategoryInline,
@@ -152,6 +158,10 @@ class ProductAdmin(admin.ModelAdmin):
     #     "get_prix_ttc",
     # )  # Use the callable instead of assuming a DB field
 
+    def get_queryset(self, request):
+        """Sum the stocks in the changelist query rather than per row."""
+        return super().get_queryset(request).with_total_stock()
+
     def get_readonly_fields(self, request, obj=None):
         """
         Dynamically set readonly fields.
@@ -182,12 +192,14 @@ class ProductAdmin(admin.ModelAdmin):
         Display image thumbnails in the admin interface.
         """
         images = []
-        if obj.image1:
-            images.append(f'<img src="{obj.image1.url}" width="50" height="50" />')
-        if obj.image2:
-            images.append(f'<img src="{obj.image2.url}" width="50" height="50" />')
-        if obj.image3:
-            images.append(f'<img src="{obj.image3.url}" width="50" height="50" />')
+        for field_name in ("image1", "image2", "image3"):
+            image = getattr(obj, field_name)
+            if not image:
+                continue
+            # Use the precomputed thumbnail rather than the original.
+            thumb = variant_urls(current_variants(obj, field_name)).get("thumb")
+            url = thumb["webp"] if thumb else image.url
+            images.append(f'<img src="{url}" width="50" height="50" />')
         return mark_safe(" ".join(images)) if images else "No Images"
 
     image_thumbnail.short_description = "Image Previews"
@@ -206,11 +218,12 @@ class ProductAdmin(admin.ModelAdmin):
 
     def total_stock(self, obj):
         """
-        Calculate and display total stock across all stores.
+        Display total stock across all stores, annotated by get_queryset.
         """
-        return sum(stock.quantity_in_stock for stock in obj.stocks.all())
+        return obj.total_stock
 
     total_stock.short_description = "Total Stock"
+    total_stock.admin_order_field = "total_stock"
 
 
 # Stock Admin
@@ -222,12 +235,17 @@ class StockAdmin(admin.ModelAdmin):
         "quantity_in_stock",
         "expiration_date",
     )
+    list_select_related = ("store", "product")
     ordering = ("store",)
     search_fields = (
         "store__name",  # Search by store name
         "product__product_name",  # Search by product name
-        "product__brand",  # Search by brand
+        "product__brand__name",  # Search by brand
     )
+    # Product and store pickers search instead of listing every row
+    autocomplete_fields = ("store", "product")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     list_filter = (
         "store",  # Filter by store
         "product__brand",  # Filter by brand through product
@@ -0,0 +1,128 @@
+"""
+Versioned cache for catalog reads.
+
+Every committed write to the catalog (products, categories, subcategories,
+brands, packagings and stocks) bumps a monotonically increasing version kept
+in Django's cache, see store.signals. Cached catalog data is stored under
+keys that include the version, so a bump makes every older entry unreachable
+and it simply expires.
+
+Only get/set/add/incr/delete are used, so any Django cache backend shared by
+the worker processes works (see CACHES in the settings): a local-memory cache
+would keep each process on its own version.
+"""
+
+import hashlib
+import time
+
+from django.core.cache import cache
+from rest_framework.response import Response
+
+CATALOG_VERSION_KEY = "store:catalog-version"
+
+
+def get_version(key):
+    """Return the current value of the version counter `key`."""
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock, so that losing the key (eviction, restart of
+        # the cache) never brings an older version, and its entries, back.
+        version = int(time.time() * 1000)
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(key):
+    """Increment the version counter `key`."""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        return get_version(key)
+
+
+def get_catalog_version():
+    """Return the current catalog version."""
+    return get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    """Invalidate all cached catalog data."""
+    return bump_version(CATALOG_VERSION_KEY)
+
+
+def catalog_cache_key(prefix, params):
+    """
+    Build a cache key for `params` (a dict of strings) that is only valid for
+    the current catalog version.
+    """
+    normalized = "&".join(f"{key}={params[key]}" for key in sorted(params))
+    digest = hashlib.sha1(normalized.encode()).hexdigest()
+    return f"store:{prefix}:{get_catalog_version()}:{digest}"
+
+
+def get_or_compute(key, compute, timeout=300, lock_timeout=10, poll_interval=0.05):
+    """
+    Return the cached value for `key`, computing and caching it on a miss.
+
+    Only one caller recomputes a missing value (single flight): the others
+    wait for its result instead of all hitting the database at once, and
+    fall back to computing it themselves if it does not arrive in time.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = f"{key}:lock"
+    if cache.add(lock_key, 1, lock_timeout):
+        try:
+            value = compute()
+            cache.set(key, value, timeout)
+        finally:
+            cache.delete(lock_key)
+        return value
+
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline:
+        time.sleep(poll_interval)
+        value = cache.get(key)
+        if value is not None:
+            return value
+        if cache.get(lock_key) is None:
+            break  # The computing caller failed.
+    return compute()
+
+
+class CatalogCacheMixin:
+    """
+    Serve successful GET list/retrieve responses of catalog views from the
+    versioned cache. Entries are shared between users, except that anonymous
+    and authenticated users (who see prices) are kept apart.
+    """
+
+    cache_timeout = 300
+
+    def get_cache_params(self):
+        request = self.request
+        params = {
+            key: ",".join(sorted(request.query_params.getlist(key)))
+            for key in request.query_params
+        }
+        params["@url"] = request.build_absolute_uri(request.path)
+        params["@authenticated"] = str(request.user.is_authenticated)
+        return params
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        key = catalog_cache_key(type(self).__name__, self.get_cache_params())
+        data = get_or_compute(
+            key,
+            lambda: handler(request, *args, **kwargs).data,
+            timeout=self.cache_timeout,
+        )
+        return Response(data)
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,151 @@
+"""
+Derivative images for product and brand pictures.
+
+Every original image is resized to a fixed set of sizes, each saved in WebP
+and JPEG, under names derived from the original's content:
+
+    variants/<digest[:2]>/<digest>-<size>.<format>
+
+so unchanged images are never processed twice and variant URLs can be cached
+forever. The names are recorded in the model's `image_variants` field, keyed
+by image field, together with the original they were built from:
+
+    {"image1": {"source": "images/a.jpg",
+                "thumb": {"webp": "variants/...", "jpeg": "variants/..."}, ...}}
+
+Variants are built by the `generate_image_variants` command, outside the
+requests that upload the images: run it every minute or so (with --since to
+only look at recently modified products). Until then a new image is listed
+without variants and clients fall back to the original.
+"""
+
+import hashlib
+import io
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# Name -> bounding box; images are scaled down to fit, never up.
+VARIANT_SIZES = {
+    "thumb": (100, 100),
+    "card": (400, 400),
+    "zoom": (1200, 1200),
+}
+# Format -> (Pillow format, save options)
+VARIANT_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+# Bump to rebuild every variant after changing the sizes or encoders.
+VARIANTS_REVISION = 1
+
+IMAGE_FIELDS = {
+    "store.product": ("image1", "image2", "image3"),
+    "store.brand": ("logo",),
+}
+
+
+def variant_name(digest, size, file_format):
+    return f"variants/{digest[:2]}/{digest}-{size}.{file_format}"
+
+
+def encode(image, file_format):
+    pillow_format, options = VARIANT_FORMATS[file_format]
+    if pillow_format == "JPEG" and image.mode != "RGB":
+        # JPEG has no alpha channel: flatten transparent images on white.
+        background = Image.new("RGB", image.size, "white")
+        if "A" in image.getbands():
+            background.paste(image, mask=image.getchannel("A"))
+        else:
+            background.paste(image.convert("RGB"))
+        image = background
+    output = io.BytesIO()
+    image.save(output, pillow_format, **options)
+    return output.getvalue()
+
+
+def build_variants(name, storage=None):
+    """
+    Build the missing variants of the stored image `name` and return its
+    `image_variants` entry. Only touches the storage, not the database, so it
+    can run in worker processes.
+    """
+    storage = storage or default_storage
+    with storage.open(name, "rb") as original:
+        content = original.read()
+    digest = hashlib.sha256(b"%d:" % VARIANTS_REVISION + content).hexdigest()[:32]
+
+    entry = {"source": name}
+    wanted = [
+        (size, file_format) for size in VARIANT_SIZES for file_format in VARIANT_FORMATS
+    ]
+    missing = [
+        (size, file_format)
+        for size, file_format in wanted
+        if not storage.exists(variant_name(digest, size, file_format))
+    ]
+    if missing:
+        with Image.open(io.BytesIO(content)) as image:
+            # Decode large JPEGs at a reduced scale directly.
+            image.draft("RGB", max(VARIANT_SIZES.values()))
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+            # Largest first, each size being scaled down from the previous one.
+            resized = image
+            for size in sorted(
+                VARIANT_SIZES, key=lambda size: VARIANT_SIZES[size], reverse=True
+            ):
+                resized = resized.copy()
+                resized.thumbnail(VARIANT_SIZES[size], Image.LANCZOS)
+                for file_format in VARIANT_FORMATS:
+                    if (size, file_format) in missing:
+                        storage.save(
+                            variant_name(digest, size, file_format),
+                            ContentFile(encode(resized, file_format)),
+                        )
+
+    for size, file_format in wanted:
+        entry.setdefault(size, {})[file_format] = variant_name(
+            digest, size, file_format
+        )
+    return entry
+
+
+def current_variants(instance, field_name):
+    """
+    Return the `image_variants` entry of an image field, or None while it was
+    built from another image (or not built yet).
+    """
+    name = getattr(instance, field_name).name or None
+    recorded = (instance.image_variants or {}).get(field_name)
+    if name is None or (recorded or {}).get("source") != name:
+        return None
+    return recorded
+
+
+def stale_fields(instance):
+    """Image fields of `instance` whose variants do not match the original."""
+    variants = instance.image_variants or {}
+    stale = []
+    for field_name in IMAGE_FIELDS[instance._meta.label_lower]:
+        name = getattr(instance, field_name).name or None
+        recorded = variants.get(field_name)
+        if (recorded or {}).get("source") != name:
+            stale.append(field_name)
+    return stale
+
+
+def variant_urls(variants, build_uri=None):
+    """Turn an `image_variants` entry into {size: {format: url}}."""
+    urls = {}
+    for size in VARIANT_SIZES:
+        names = (variants or {}).get(size)
+        if not names:
+            continue
+        urls[size] = {}
+        for file_format, name in names.items():
+            url = default_storage.url(name)
+            urls[size][file_format] = build_uri(url) if build_uri else url
+    return urls
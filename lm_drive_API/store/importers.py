@@ -0,0 +1,302 @@
+"""
+Bulk product import from supplier catalogs in CSV or JSON Lines format.
+
+Both formats use the same columns: product_id, product_name, upc,
+description, price_ht, tva, is_for_sale, brand, category, subcategories,
+packaging_quantity, packaging_value and packaging_type. In CSV files the
+subcategories are separated by "|"; in JSON Lines they may also be a list.
+
+Rows are streamed in batches. For each batch, categories, subcategories,
+brands and packagings are resolved through the reference cache
+(store.references), the missing ones being bulk created, then the products
+and their subcategory links are upserted in one transaction. Products are
+matched on product_id; their images are left untouched.
+"""
+
+import csv
+import io
+import json
+import os
+import time
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from .models import (
+    Brand,
+    Category,
+    Packaging,
+    Product,
+    SubCategory,
+    compute_price_ttc,
+)
+from .references import packaging_ids, reference_ids
+from .signals import products_bulk_changed
+from .utils import bulk_upsert
+
+CSV_LIST_SEPARATOR = "|"
+
+PRODUCT_FIELDS = [
+    "product_id",
+    "product_name",
+    "upc",
+    "description",
+    "price_ht",
+    "tva",
+    "is_for_sale",
+]
+PACKAGING_FIELDS = ["packaging_quantity", "packaging_value", "packaging_type"]
+PRODUCT_UPDATE_FIELDS = [
+    "product_name",
+    "upc",
+    "description",
+    "price_ht",
+    "tva",
+    "price_ttc",
+    "is_for_sale",
+    "brand",
+    "category",
+    "packaging",
+    "update_date",
+]
+
+
+class RowError(ValueError):
+    """An invalid row, reported with its line number."""
+
+
+def read_csv(stream):
+    """Yield (line number, row) from a CSV file object with a header line."""
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_jsonl(stream):
+    """Yield (line number, row) from a JSON Lines file object."""
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            row = RowError(f"Invalid JSON: {error}")
+        else:
+            if not isinstance(row, dict):
+                row = RowError("Each line must be a JSON object.")
+        yield line_number, row
+
+
+READERS = {"csv": read_csv, "jsonl": read_jsonl}
+
+
+def detect_format(filename):
+    """Guess the file format from its extension (.csv, .jsonl or .ndjson)."""
+    extension = os.path.splitext(filename)[1].lower()
+    return "jsonl" if extension in (".jsonl", ".ndjson") else "csv"
+
+
+def open_upload(uploaded_file):
+    """Wrap an uploaded file in a text stream."""
+    return io.TextIOWrapper(uploaded_file.file, encoding="utf-8-sig", newline="")
+
+
+def clean_value(model, name, value):
+    """Validate a raw value with the model field's own validation."""
+    if isinstance(value, str):
+        value = value.strip()
+    field = model._meta.get_field(name)
+    if value in (None, "") and field.has_default():
+        return field.get_default()
+    if value == "" and field.null:
+        value = None
+    try:
+        return field.clean(value, None)
+    except ValidationError as error:
+        raise RowError(f"{name}: {' '.join(error.messages)}")
+
+
+def parse_row(row):
+    """Validate a raw row and return the cleaned values."""
+    cleaned = {
+        name: clean_value(Product, name, row.get(name)) for name in PRODUCT_FIELDS
+    }
+    # Same rules as Product.save
+    if cleaned["price_ht"] < 0:
+        raise RowError("price_ht: Prix HT cannot be negative.")
+    if not (0 <= cleaned["tva"] <= 100):
+        raise RowError("tva: TVA must be between 0 and 100.")
+    cleaned["category"] = clean_value(Category, "name", row.get("category"))
+
+    brand = (row.get("brand") or "").strip()
+    cleaned["brand"] = clean_value(Brand, "name", brand) if brand else None
+
+    subcategories = row.get("subcategories") or []
+    if isinstance(subcategories, str):
+        subcategories = subcategories.split(CSV_LIST_SEPARATOR)
+    cleaned["subcategories"] = {
+        clean_value(SubCategory, "name", name)
+        for name in subcategories
+        if str(name).strip()
+    }
+
+    packaging = [row.get(name) for name in PACKAGING_FIELDS]
+    if any(value not in (None, "") for value in packaging):
+        cleaned["packaging"] = tuple(
+            clean_value(Packaging, name, value)
+            for name, value in zip(PACKAGING_FIELDS, packaging)
+        )
+    else:
+        cleaned["packaging"] = None
+    return cleaned
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.errors = []  # (line number, message)
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def add_error(self, line_number, message):
+        self.errors.append((line_number, message))
+
+    def as_dict(self, max_errors=None):
+        errors = self.errors if max_errors is None else self.errors[:max_errors]
+        return {
+            "rows": self.rows,
+            "created": self.created,
+            "updated": self.updated,
+            "error_count": len(self.errors),
+            "errors": [
+                {"line": line_number, "error": message}
+                for line_number, message in errors
+            ],
+            "elapsed_seconds": round(self.elapsed, 3),
+            "rows_per_second": round(self.rows_per_second, 1),
+        }
+
+
+class ProductImporter:
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.report = ImportReport()
+        # Name (or packaging triple) -> id of the references seen so far
+        self.categories = {}
+        self.subcategories = {}
+        self.brands = {}
+        self.packagings = {}
+
+    def run(self, rows, progress=None):
+        """
+        Import (line number, row) pairs, calling `progress(report)` after
+        each batch, and return the ImportReport.
+        """
+        start = time.monotonic()
+        batch = []
+        for line_number, row in rows:
+            self.report.rows += 1
+            try:
+                if isinstance(row, Exception):
+                    raise row
+                batch.append((line_number, parse_row(row)))
+            except RowError as error:
+                self.report.add_error(line_number, str(error))
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                batch = []
+                self.report.elapsed = time.monotonic() - start
+                if progress:
+                    progress(self.report)
+        if batch:
+            self.import_batch(batch)
+        self.report.elapsed = time.monotonic() - start
+        return self.report
+
+    def import_batch(self, batch):
+        # The last row of a product wins.
+        rows = {row["product_id"]: (line_number, row) for line_number, row in batch}
+        self.reject_duplicate_upcs(rows)
+        if not rows:
+            return
+
+        self.resolve_references([row for _, row in rows.values()])
+        products = [self.build_product(row) for _, row in rows.values()]
+        through = Product.subcategories.through
+        links = [
+            through(product_id=product_id, subcategory_id=self.subcategories[name])
+            for product_id, (_, row) in rows.items()
+            for name in row["subcategories"]
+        ]
+        existing = set(Product.objects.filter(pk__in=rows).values_list("pk", flat=True))
+
+        try:
+            with transaction.atomic():
+                bulk_upsert(
+                    Product,
+                    products,
+                    unique_fields=["product_id"],
+                    update_fields=PRODUCT_UPDATE_FIELDS,
+                )
+                through.objects.filter(product_id__in=rows).delete()
+                through.objects.bulk_create(links)
+        except IntegrityError as error:
+            for line_number, _ in rows.values():
+                self.report.add_error(line_number, f"Batch rejected: {error}")
+            return
+
+        products_bulk_changed.send(sender=Product, product_ids=list(rows))
+        self.report.updated += len(existing)
+        self.report.created += len(rows) - len(existing)
+
+    def reject_duplicate_upcs(self, rows):
+        """Drop rows whose UPC belongs to another product."""
+        owners = {}
+        for product_id, (line_number, row) in list(rows.items()):
+            upc = row["upc"]
+            if upc is None:
+                continue
+            if owners.setdefault(upc, product_id) != product_id:
+                self.report.add_error(line_number, f"upc: '{upc}' is duplicated.")
+                del rows[product_id]
+        existing = Product.objects.filter(upc__in=owners).exclude(pk__in=rows)
+        for upc, owner in existing.values_list("upc", "pk"):
+            product_id = owners[upc]
+            if product_id in rows:
+                line_number, _ = rows.pop(product_id)
+                self.report.add_error(
+                    line_number, f"upc: '{upc}' already belongs to product {owner}."
+                )
+
+    def resolve_references(self, rows):
+        # Looked up in the reference cache, the missing rows being created
+        self.categories.update(
+            reference_ids(Category, {row["category"] for row in rows}, create=True)
+        )
+        self.brands.update(
+            reference_ids(Brand, {row["brand"] for row in rows} - {None}, create=True)
+        )
+        self.subcategories.update(
+            reference_ids(
+                SubCategory,
+                {name for row in rows for name in row["subcategories"]},
+                create=True,
+            )
+        )
+        self.packagings.update(
+            packaging_ids({row["packaging"] for row in rows} - {None}, create=True)
+        )
+
+    def build_product(self, row):
+        product = Product(**{name: row[name] for name in PRODUCT_FIELDS})
+        product.price_ttc = compute_price_ttc(product.price_ht, product.tva)
+        product.category_id = self.categories[row["category"]]
+        product.brand_id = self.brands[row["brand"]] if row["brand"] else None
+        if row["packaging"]:
+            product.packaging_id = self.packagings.get(row["packaging"])
+        return product
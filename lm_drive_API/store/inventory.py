@@ -0,0 +1,164 @@
+"""
+Bulk stock upsert for store inventory feeds.
+
+A feed lists, for one store, rows with a product_id, a quantity_in_stock and
+an optional expiration_date (today by default). Rows are validated in memory
+with the Stock rules; the products of each chunk are fetched in one query and
+the stocks are upserted on (store, product) in one transaction per chunk,
+with the differences journaled as stock movements.
+"""
+
+from django.db import IntegrityError, transaction
+from django.utils.timezone import localdate
+
+from .importers import RowError, clean_value
+from .models import Product, Stock, StockMovement
+from .signals import stocks_bulk_changed
+from .utils import bulk_upsert
+
+STATUS_CREATED = "created"
+STATUS_UPDATED = "updated"
+STATUS_ERROR = "error"
+# Reference of the stock movements journaled for feeds
+FEED_REFERENCE = "inventory feed"
+
+
+def parse_stock_row(row):
+    """Validate a raw feed row and return (product_id, quantity, expiration)."""
+    if not isinstance(row, dict):
+        raise RowError("Each row must be an object.")
+    product_id = clean_value(Product, "product_id", row.get("product_id"))
+    if row.get("quantity_in_stock") in (None, ""):
+        raise RowError("quantity_in_stock: This field is required.")
+    quantity = clean_value(Stock, "quantity_in_stock", row.get("quantity_in_stock"))
+    expiration_date = row.get("expiration_date")
+    if expiration_date in (None, ""):
+        expiration_date = localdate()
+    else:
+        expiration_date = clean_value(Stock, "expiration_date", expiration_date)
+    # Same rule as Stock.clean
+    if expiration_date < localdate():
+        raise RowError("expiration_date: Expiration date must be in the future.")
+    return product_id, quantity, expiration_date
+
+
+class StockUpsertReport:
+    def __init__(self):
+        self.results = []  # (row number, product_id, status, error)
+
+    def add(self, row_number, product_id, status, error=None):
+        self.results.append((row_number, product_id, status, error))
+
+    def count(self, status):
+        return sum(1 for result in self.results if result[2] == status)
+
+    def as_dict(self):
+        """
+        Counts per status, then one compact [row, product_id, status] entry
+        per row, errors carrying their message as a fourth item.
+        """
+        return {
+            "rows": len(self.results),
+            "created": self.count(STATUS_CREATED),
+            "updated": self.count(STATUS_UPDATED),
+            "errors": self.count(STATUS_ERROR),
+            "results": [
+                [row_number, product_id, status] + ([error] if error else [])
+                for row_number, product_id, status, error in sorted(
+                    self.results, key=lambda result: result[0]
+                )
+            ],
+        }
+
+
+class StockUpserter:
+    def __init__(self, store, batch_size=1000):
+        self.store = store
+        self.batch_size = batch_size
+        self.report = StockUpsertReport()
+
+    def run(self, rows):
+        """Upsert (row number, row) pairs and return the StockUpsertReport."""
+        batch = []
+        for row_number, row in rows:
+            try:
+                if isinstance(row, Exception):
+                    raise row
+                batch.append((row_number, *parse_stock_row(row)))
+            except RowError as error:
+                product_id = row.get("product_id") if isinstance(row, dict) else None
+                self.report.add(row_number, product_id, STATUS_ERROR, str(error))
+            if len(batch) >= self.batch_size:
+                self.upsert_batch(batch)
+                batch = []
+        if batch:
+            self.upsert_batch(batch)
+        return self.report
+
+    def upsert_batch(self, batch):
+        # The last row of a product wins; earlier ones are reported as
+        # superseded.
+        rows = {}
+        for row_number, product_id, quantity, expiration_date in batch:
+            if product_id in rows:
+                self.report.add(
+                    rows[product_id][0],
+                    product_id,
+                    STATUS_ERROR,
+                    "Superseded by a later row.",
+                )
+            rows[product_id] = (row_number, quantity, expiration_date)
+
+        known = set(Product.objects.filter(pk__in=rows).values_list("pk", flat=True))
+        for product_id in set(rows) - known:
+            row_number, _, _ = rows.pop(product_id)
+            self.report.add(
+                row_number, product_id, STATUS_ERROR, "Product does not exist."
+            )
+        if not rows:
+            return
+
+        stocks = [
+            Stock(
+                store=self.store,
+                product_id=product_id,
+                quantity_in_stock=quantity,
+                expiration_date=expiration_date,
+            )
+            for product_id, (_, quantity, expiration_date) in rows.items()
+        ]
+        try:
+            with transaction.atomic():
+                existing = dict(
+                    Stock.objects.filter(store=self.store, product_id__in=rows)
+                    .select_for_update()
+                    .values_list("product_id", "quantity_in_stock")
+                )
+                bulk_upsert(
+                    Stock,
+                    stocks,
+                    unique_fields=["store", "product"],
+                    update_fields=["quantity_in_stock", "expiration_date"],
+                )
+                StockMovement.record(
+                    self.store.pk,
+                    {
+                        product_id: quantity - existing.get(product_id, 0)
+                        for product_id, (_, quantity, _) in rows.items()
+                    },
+                    StockMovement.Kind.CORRECTION,
+                    FEED_REFERENCE,
+                )
+                stocks_bulk_changed.send(
+                    sender=Stock, store_id=self.store.pk, product_ids=list(rows)
+                )
+        except IntegrityError as error:
+            for product_id, (row_number, _, _) in rows.items():
+                self.report.add(
+                    row_number, product_id, STATUS_ERROR, f"Batch rejected: {error}"
+                )
+            return
+
+        for product_id, (row_number, _, _) in rows.items():
+            status = STATUS_UPDATED if product_id in existing else STATUS_CREATED
+            self.report.add(row_number, product_id, status)
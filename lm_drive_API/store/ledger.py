@@ -0,0 +1,123 @@
+"""
+Stock history.
+
+Every change of Stock.quantity_in_stock is journaled as a StockMovement: by
+Stock.save (restocks, adjustments, corrections), Stock.decrement_batch
+(sales) and the inventory feeds (store.inventory). The journal only grows,
+to hundreds of millions of rows, so past quantities are never summed from its
+beginning: the `snapshot_stock` command periodically stores the quantities
+of each store as StockSnapshot rows, and the quantity at a date is the latest
+snapshot before it plus the movements since.
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import Max, Sum
+from django.utils.timezone import now
+
+from .models import Stock, StockMovement, StockSnapshot
+
+# Snapshots are taken this long in the past, so that the movements of
+# transactions still running when the snapshot is taken are not missed.
+SNAPSHOT_DELAY = timedelta(minutes=5)
+
+
+def latest_snapshot_time(store_id, at):
+    """Return when the last snapshot of a store before `at` was taken, or None."""
+    return StockSnapshot.objects.filter(store_id=store_id, taken_at__lte=at).aggregate(
+        taken_at=Max("taken_at")
+    )["taken_at"]
+
+
+def sum_movements(movements, *fields):
+    """Return the summed quantities of `movements` grouped by `fields`."""
+    return (
+        movements.order_by()
+        .values(*fields)
+        .annotate(total=Sum("quantity"))
+        .values_list(*fields, "total")
+    )
+
+
+def stock_as_of(store_id, at, product_ids=None):
+    """Return {product_id: quantity in stock} of a store at `at`."""
+    quantities = defaultdict(int)
+    movements = StockMovement.objects.filter(store_id=store_id, created_at__lte=at)
+    taken_at = latest_snapshot_time(store_id, at)
+    if taken_at is not None:
+        snapshots = StockSnapshot.objects.filter(store_id=store_id, taken_at=taken_at)
+        if product_ids is not None:
+            snapshots = snapshots.filter(product_id__in=product_ids)
+        quantities.update(snapshots.values_list("product_id", "quantity"))
+        movements = movements.filter(created_at__gt=taken_at)
+    if product_ids is not None:
+        movements = movements.filter(product_id__in=product_ids)
+    for product_id, total in sum_movements(movements, "product_id"):
+        quantities[product_id] += total
+    return {
+        product_id: quantity for product_id, quantity in quantities.items() if quantity
+    }
+
+
+def movement_report(store_id, start, end, product_ids=None):
+    """
+    Return, for each product of a store, its quantity at `start`, the total
+    movements of each kind until `end` and its quantity at `end`.
+    """
+    opening = stock_as_of(store_id, start, product_ids)
+    movements = StockMovement.objects.filter(
+        store_id=store_id, created_at__gt=start, created_at__lte=end
+    )
+    if product_ids is not None:
+        movements = movements.filter(product_id__in=product_ids)
+    by_kind = defaultdict(dict)
+    for product_id, kind, total in sum_movements(movements, "product_id", "kind"):
+        by_kind[product_id][kind] = total
+
+    return [
+        {
+            "product_id": product_id,
+            "opening": opening.get(product_id, 0),
+            "movements": by_kind.get(product_id, {}),
+            "closing": opening.get(product_id, 0)
+            + sum(by_kind.get(product_id, {}).values()),
+        }
+        for product_id in sorted(set(opening) | set(by_kind))
+    ]
+
+
+def take_snapshot(store_id, taken_at=None, batch_size=5000):
+    """
+    Store the quantities of a store at `taken_at` (SNAPSHOT_DELAY ago by
+    default) and return the number of rows written.
+    """
+    taken_at = taken_at or now() - SNAPSHOT_DELAY
+    if StockSnapshot.objects.filter(store_id=store_id, taken_at__lte=taken_at).exists():
+        quantities = stock_as_of(store_id, taken_at)
+    else:
+        # First snapshot: the journal may start after the stocks, so start
+        # from the current quantities, minus the movements made since.
+        quantities = dict(
+            Stock.objects.filter(store_id=store_id).values_list(
+                "product_id", "quantity_in_stock"
+            )
+        )
+        later = StockMovement.objects.filter(store_id=store_id, created_at__gt=taken_at)
+        for product_id, total in sum_movements(later, "product_id"):
+            quantities[product_id] = quantities.get(product_id, 0) - total
+
+    snapshots = StockSnapshot.objects.bulk_create(
+        [
+            StockSnapshot(
+                store_id=store_id,
+                product_id=product_id,
+                taken_at=taken_at,
+                quantity=quantity,
+            )
+            for product_id, quantity in quantities.items()
+            if quantity
+        ],
+        batch_size=batch_size,
+    )
+    return len(snapshots)
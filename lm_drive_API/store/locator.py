@@ -0,0 +1,208 @@
+"""
+Nearest store locator.
+
+Each process keeps the located stores in an in-memory k-d tree, tagged with a
+store version kept in Django's shared cache: saving or deleting a Store bumps
+the version (see store.signals) and the next lookup of every process rebuilds
+the tree, which takes one query. Trees older than REBUILD_INTERVAL are rebuilt
+too, so that a process missing a bump still catches up. Stores are indexed
+as points on the unit sphere, so that the straight-line distance between
+points orders stores like the great-circle distance does, antimeridian and
+poles included.
+
+Postal codes are located at the centroid of the stores sharing them, or
+else of the stores of the same département (first two characters): the
+application has no geocoding data of its own.
+"""
+
+import heapq
+import math
+import threading
+import time
+
+from django.db.models import F
+
+from .cache import bump_version, get_version
+from .models import Stock, Store
+
+STORE_VERSION_KEY = "store:store-version"
+EARTH_RADIUS_KM = 6371.0088
+DEPARTEMENT_LENGTH = 2
+# Seconds after which the tree is rebuilt even without a version bump
+REBUILD_INTERVAL = 5 * 60
+
+
+def bump_store_version():
+    """Make every process rebuild its store index."""
+    return bump_version(STORE_VERSION_KEY)
+
+
+def to_point(latitude, longitude):
+    """Return the point of the unit sphere at the given coordinates."""
+    phi, lam = math.radians(latitude), math.radians(longitude)
+    return (math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi))
+
+
+def chord_to_km(chord):
+    """Turn a straight-line distance on the unit sphere into kilometers."""
+    return 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1.0))
+
+
+class KDTree:
+    """
+    Static k-d tree over 3D points. Nodes are (point, item, axis, left, right)
+    tuples; the median split keeps it balanced.
+    """
+
+    def __init__(self, entries):
+        self.root = self.build(list(entries), 0)
+
+    def build(self, entries, depth):
+        if not entries:
+            return None
+        axis = depth % 3
+        entries.sort(key=lambda entry: entry[0][axis])
+        middle = len(entries) // 2
+        point, item = entries[middle]
+        return (
+            point,
+            item,
+            axis,
+            self.build(entries[:middle], depth + 1),
+            self.build(entries[middle + 1 :], depth + 1),
+        )
+
+    def nearest(self, target, k):
+        """Return the k (distance, item) pairs nearest to `target`, closest first."""
+        best = []  # max-heap of (-squared distance, order, item)
+        counter = 0
+        stack = [(self.root, 0.0)]  # (node, squared distance to its region)
+        while stack:
+            node, bound = stack.pop()
+            if node is None or (len(best) == k and bound >= -best[0][0]):
+                continue
+            point, item, axis, left, right = node
+            distance = sum((a - b) ** 2 for a, b in zip(point, target))
+            counter += 1
+            if len(best) < k:
+                heapq.heappush(best, (-distance, counter, item))
+            elif distance < -best[0][0]:
+                heapq.heapreplace(best, (-distance, counter, item))
+            offset = target[axis] - point[axis]
+            near, far = (left, right) if offset < 0 else (right, left)
+            # The far side is visited after the near one (stack order), and
+            # only while the splitting plane is closer than the k-th store.
+            stack.append((far, max(bound, offset**2)))
+            stack.append((near, bound))
+        return [
+            (math.sqrt(-negative), item)
+            for negative, _, item in sorted(best, key=lambda entry: -entry[0])
+        ]
+
+
+class StoreIndex:
+    def __init__(self, version):
+        self.version = version
+        self.built_at = time.monotonic()
+        stores = list(
+            Store.objects.filter(latitude__isnull=False, longitude__isnull=False)
+        )
+        self.tree = KDTree(
+            (to_point(float(store.latitude), float(store.longitude)), store)
+            for store in stores
+        )
+        self.size = len(stores)
+        # Postal code (and département) -> coordinates of its stores
+        self.postal_codes = {}
+        for store in stores:
+            code = (store.postal_code or "").strip()
+            if code:
+                for key in (code, code[:DEPARTEMENT_LENGTH]):
+                    self.postal_codes.setdefault(key, []).append(
+                        (float(store.latitude), float(store.longitude))
+                    )
+
+    def nearest(self, latitude, longitude, k):
+        """Return the k (distance in km, store) pairs nearest to a location."""
+        return [
+            (chord_to_km(chord), store)
+            for chord, store in self.tree.nearest(to_point(latitude, longitude), k)
+        ]
+
+    def locate_postal_code(self, postal_code):
+        """Return the (latitude, longitude) of a postal code, or None."""
+        code = postal_code.strip()
+        coordinates = self.postal_codes.get(code) or self.postal_codes.get(
+            code[:DEPARTEMENT_LENGTH]
+        )
+        if not coordinates:
+            return None
+        # Centroid on the sphere, back to coordinates
+        x, y, z = (
+            sum(axis) for axis in zip(*(to_point(*pair) for pair in coordinates))
+        )
+        return (
+            math.degrees(math.atan2(z, math.hypot(x, y))),
+            math.degrees(math.atan2(y, x)),
+        )
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_index():
+    """Return the StoreIndex of the current store version."""
+    global _index
+    version = get_version(STORE_VERSION_KEY)
+
+    def is_current(index):
+        return (
+            index is not None
+            and index.version == version
+            and time.monotonic() - index.built_at < REBUILD_INTERVAL
+        )
+
+    index = _index
+    if not is_current(index):
+        with _lock:
+            index = _index
+            if not is_current(index):
+                index = _index = StoreIndex(version)
+    return index
+
+
+def clear():
+    """Drop the store index of this process."""
+    global _index
+    _index = None
+
+
+def basket_availability(store_ids, basket):
+    """
+    Return {store_id: {product_id: missing quantity}} for a basket
+    ({product_id: quantity}), from the available-to-promise stock of the
+    stores, in one query. Stores that can serve the whole basket map to {}.
+    """
+    available = {store_id: {} for store_id in store_ids}
+    stocks = (
+        Stock.objects.available()
+        .filter(
+            store_id__in=store_ids,
+            product_id__in=basket,
+            # Also keeps the unsigned subtraction below from going negative
+            quantity_in_stock__gt=F("reserved_quantity"),
+        )
+        .annotate(quantity=F("quantity_in_stock") - F("reserved_quantity"))
+        .values_list("store_id", "product_id", "quantity")
+    )
+    for store_id, product_id, quantity in stocks:
+        available[store_id][product_id] = quantity
+    return {
+        store_id: {
+            product_id: quantity - quantities.get(product_id, 0)
+            for product_id, quantity in basket.items()
+            if quantities.get(product_id, 0) < quantity
+        }
+        for store_id, quantities in available.items()
+    }
@@ -0,0 +1,118 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from store.models import Category, Product, SubCategory
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the chained-join subcategory filter with the grouped semi-join "
+        "on a synthetic catalog, created in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=50000)
+        parser.add_argument("--subcategories", type=int, default=200)
+        parser.add_argument(
+            "--per-product",
+            type=int,
+            default=4,
+            help="Largest number of subcategories of a product.",
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        with transaction.atomic():
+            subcategories = self.create_catalog(rng, options)
+            # The most used subcategories, so that AND filters match products.
+            names = [subcategory.name for subcategory in subcategories[:4]]
+            ids = [subcategory.pk for subcategory in subcategories[:4]]
+            products = Product.objects.all()
+            for count in range(1, len(names) + 1):
+                self.stdout.write(f"{count} subcategories:")
+                self.measure(
+                    "  chained joins + DISTINCT",
+                    lambda: self.chained(products, names[:count]),
+                    options["repeat"],
+                )
+                self.measure(
+                    "  semi-join, all",
+                    lambda: products.in_subcategories(ids[:count]),
+                    options["repeat"],
+                )
+                self.measure(
+                    "  semi-join, any",
+                    lambda: products.in_subcategories(ids[:count], match_all=False),
+                    options["repeat"],
+                )
+            transaction.set_rollback(True)
+
+    def create_catalog(self, rng, options):
+        category = Category.objects.create(name="bench-category")
+        subcategories = SubCategory.objects.bulk_create(
+            SubCategory(name=f"bench-sub-{index:04d}")
+            for index in range(options["subcategories"])
+        )
+        Product.objects.bulk_create(
+            (
+                Product(
+                    product_id=f"BENCH{index:07d}",
+                    product_name=f"Bench product {index}",
+                    price_ht=Decimal("1.00"),
+                    tva=Decimal("5.50"),
+                    price_ttc=Decimal("1.06"),
+                    category=category,
+                )
+                for index in range(options["products"])
+            ),
+            batch_size=5000,
+        )
+        if any(subcategory.pk is None for subcategory in subcategories):
+            subcategories = list(
+                SubCategory.objects.filter(name__startswith="bench-sub-").order_by("pk")
+            )
+        # Skewed popularity, as in a real catalog
+        weights = [1 / (rank + 1) for rank in range(len(subcategories))]
+        Through = Product.subcategories.through
+        links = []
+        for index in range(options["products"]):
+            chosen = set(
+                rng.choices(
+                    subcategories, weights, k=rng.randint(1, options["per_product"])
+                )
+            )
+            links.extend(
+                Through(product_id=f"BENCH{index:07d}", subcategory_id=subcategory.pk)
+                for subcategory in chosen
+            )
+        Through.objects.bulk_create(links, batch_size=5000)
+        self.stdout.write(
+            f"{options['products']} products, {len(subcategories)} subcategories, "
+            f"{len(links)} links."
+        )
+        return subcategories
+
+    def chained(self, queryset, names):
+        # The previous implementation: one join per subcategory.
+        for name in names:
+            queryset = queryset.filter(subcategories__name__icontains=name)
+        return queryset.distinct()
+
+    def measure(self, label, build, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            queryset = build()
+            count = queryset.count()
+            list(queryset.order_by("pk").values_list("pk", flat=True)[:20])
+            timings.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(
+            f"{label}: {count} products, median {statistics.median(timings):.1f} ms, "
+            f"best {min(timings):.1f} ms"
+        )
@@ -0,0 +1,88 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from store.suggest import SuggestIndex
+
+WORDS = (
+    "buldak ramen carbonara kimchi tteokbokki spicy cheese curry soup jjajang "
+    "shin neoguri chapagetti jin udon miso tonkotsu shoyu beef chicken seafood "
+    "mushroom vegetable black bean sesame garlic onion pork shrimp hot mild"
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the typeahead suggestion latency on a synthetic in-memory "
+        "catalog (no database access)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=100000)
+        parser.add_argument("--queries", type=int, default=10000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        brands = {index: f"{rng.choice(WORDS)} brand {index}" for index in range(500)}
+        categories = {index: f"{rng.choice(WORDS)} {index}" for index in range(50)}
+        start = time.perf_counter()
+        index = SuggestIndex.build(
+            (
+                (
+                    f"P{number:07d}",
+                    " ".join(rng.choices(WORDS, k=rng.randint(2, 5))),
+                    rng.randrange(500),
+                    rng.randrange(50),
+                    int(rng.paretovariate(1.2)),
+                )
+                for number in range(options["products"])
+            ),
+            brands,
+            categories,
+        )
+        self.stdout.write(
+            f"Built {len(index.entries)} entries for {options['products']} products "
+            f"in {time.perf_counter() - start:.2f} s."
+        )
+
+        queries = []
+        for _ in range(options["queries"]):
+            words = rng.choices(WORDS, k=rng.randint(1, 2))
+            words[-1] = words[-1][: rng.randint(1, len(words[-1]))]
+            queries.append(" ".join(words))
+        self.report(
+            "suggest", [lambda query=query: index.suggest(query) for query in queries]
+        )
+
+        product_ids = rng.sample(range(options["products"]), 1000)
+        self.report(
+            "incremental rename",
+            [
+                lambda number=number: index.update_products(
+                    [
+                        (
+                            f"P{number:07d}",
+                            " ".join(rng.choices(WORDS, k=3)),
+                            int(rng.paretovariate(1.2)),
+                        )
+                    ],
+                    [f"P{number:07d}"],
+                )
+                for number in product_ids
+            ],
+        )
+
+    def report(self, label, calls):
+        timings = []
+        for call in calls:
+            start = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        self.stdout.write(
+            f"{label}: p50 {statistics.median(timings):.3f} ms, "
+            f"p99 {timings[int(len(timings) * 0.99)]:.3f} ms, "
+            f"max {timings[-1]:.3f} ms"
+        )
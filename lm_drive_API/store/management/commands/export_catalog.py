@@ -0,0 +1,32 @@
+import os
+
+from django.core.management.base import BaseCommand
+from store.sync import current_version, gzip_chunks, json_lines, snapshot_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Write a gzip-compressed JSON lines snapshot of the catalog, named after "
+        "its version, for offline clients."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--directory", default=".", help="Directory to write the snapshot in."
+        )
+
+    def handle(self, *args, **options):
+        version = current_version()
+        path = os.path.join(options["directory"], f"catalog-{version}.jsonl.gz")
+        # Written next to its final name, so readers never see a partial file
+        partial = f"{path}.part"
+        size = 0
+        with open(partial, "wb") as output:
+            for chunk in gzip_chunks(json_lines(snapshot_rows(version))):
+                output.write(chunk)
+                size += len(chunk)
+        os.replace(partial, path)
+        self.stdout.write(
+            self.style.SUCCESS(f"Catalog version {version} written to {path}.")
+        )
+        self.stdout.write(f"{size} bytes")
@@ -0,0 +1,103 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils.timezone import now
+from store.cache import bump_catalog_version
+from store.images import IMAGE_FIELDS, build_variants, stale_fields
+from store.models import Brand, Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the resized variants of new or replaced product images and brand "
+        "logos in a pool of worker processes. Meant to run every minute or so."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Number of worker processes (default: one per CPU).",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Rebuild every image, not only those without current variants.",
+        )
+        parser.add_argument(
+            "--since",
+            type=int,
+            default=None,
+            help="Only look at the products modified in the last SINCE minutes.",
+        )
+
+    def handle(self, *args, **options):
+        jobs = []  # (instance, field name, image name)
+        for model in (Product, Brand):
+            field_names = IMAGE_FIELDS[model._meta.label_lower]
+            queryset = model.objects.only("pk", "image_variants", *field_names)
+            if model is Product and options["since"] is not None:
+                since = now() - timedelta(minutes=options["since"])
+                queryset = queryset.filter(update_date__gte=since)
+            for instance in queryset.iterator(chunk_size=2000):
+                stale = field_names if options["all"] else stale_fields(instance)
+                for field_name in stale:
+                    jobs.append(
+                        (instance, field_name, getattr(instance, field_name).name)
+                    )
+        if not jobs:
+            self.stdout.write(self.style.SUCCESS("All image variants are up to date."))
+            return
+
+        # Forked workers must not share the parent's database connections.
+        connections.close_all()
+        changed = {}
+        failures = 0
+        names = sorted({name for _, _, name in jobs if name})
+        with ProcessPoolExecutor(
+            max_workers=options["workers"], initializer=django.setup
+        ) as executor:
+            results = dict(
+                zip(names, executor.map(safe_build_variants, names, chunksize=8))
+            )
+
+        for instance, field_name, name in jobs:
+            variants = changed.setdefault(instance, dict(instance.image_variants))
+            if not name:
+                variants.pop(field_name, None)
+                continue
+            entry, error = results[name]
+            if error:
+                failures += 1
+                self.stderr.write(f"{name}: {error}")
+            variants[field_name] = entry
+
+        for instance, variants in changed.items():
+            type(instance).objects.filter(pk=instance.pk).update(
+                image_variants=variants
+            )
+        Product.objects.filter(
+            pk__in=[
+                instance.pk for instance in changed if isinstance(instance, Product)
+            ]
+        ).touch()
+        bump_catalog_version()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Processed {len(names)} images of {len(changed)} records "
+                f"({failures} failures)."
+            )
+        )
+
+
+def safe_build_variants(name):
+    """Run in the workers: return (entry, error message)."""
+    try:
+        return build_variants(name), None
+    except Exception as error:
+        return {"source": name}, str(error)
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from store.importers import READERS, ProductImporter, detect_format
+
+
+class Command(BaseCommand):
+    help = "Import or update products from a CSV or JSON Lines catalog file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Path of the catalog file.")
+        parser.add_argument(
+            "--format",
+            choices=sorted(READERS),
+            help="File format; guessed from the extension by default.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of rows written per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        reader = READERS[options["format"] or detect_format(path)]
+        importer = ProductImporter(batch_size=options["batch_size"])
+        try:
+            with open(path, encoding="utf-8-sig", newline="") as stream:
+                report = importer.run(reader(stream), progress=self.show_progress)
+        except OSError as error:
+            raise CommandError(f"Cannot read '{path}': {error}")
+
+        for line_number, message in report.errors:
+            self.stderr.write(f"Line {line_number}: {message}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{report.rows} rows in {report.elapsed:.1f}s "
+                f"({report.rows_per_second:.0f} rows/s): {report.created} created, "
+                f"{report.updated} updated, {len(report.errors)} errors."
+            )
+        )
+
+    def show_progress(self, report):
+        self.stdout.write(
+            f"{report.rows} rows ({report.rows_per_second:.0f} rows/s), "
+            f"{len(report.errors)} errors"
+        )
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from store.importers import READERS, detect_format
+from store.inventory import STATUS_ERROR, StockUpserter
+from store.models import Store
+
+
+class Command(BaseCommand):
+    help = "Create or update the stocks of a store from a CSV or JSON Lines feed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("store_id", help="Store the inventory belongs to.")
+        parser.add_argument("path", help="Path of the inventory file.")
+        parser.add_argument(
+            "--format",
+            choices=sorted(READERS),
+            help="File format; guessed from the extension by default.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of rows written per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            store = Store.objects.get(store_id=options["store_id"])
+        except Store.DoesNotExist:
+            raise CommandError(f"Store '{options['store_id']}' does not exist.")
+        path = options["path"]
+        reader = READERS[options["format"] or detect_format(path)]
+        upserter = StockUpserter(store, batch_size=options["batch_size"])
+        try:
+            with open(path, encoding="utf-8-sig", newline="") as stream:
+                report = upserter.run(reader(stream))
+        except OSError as error:
+            raise CommandError(f"Cannot read '{path}': {error}")
+
+        for row_number, product_id, status, error in report.results:
+            if status == STATUS_ERROR:
+                self.stderr.write(f"Line {row_number} ({product_id}): {error}")
+        summary = report.as_dict()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{summary['rows']} rows: {summary['created']} created, "
+                f"{summary['updated']} updated, {summary['errors']} errors."
+            )
+        )
@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from store.sync import CHANGE_RETENTION, prune_changes
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the catalog changes older than the retention period. Offline "
+        "clients older than that download a new snapshot. Run it daily."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=CHANGE_RETENTION.days)
+
+    def handle(self, *args, **options):
+        deleted = prune_changes(timedelta(days=options["days"]))
+        self.stdout.write(self.style.SUCCESS(f"{deleted} catalog changes deleted."))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from store.models import Product
+from store.search import index_products
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product search index from the catalog."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of products indexed per batch.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        product_ids = Product.objects.order_by("pk").values_list("pk", flat=True)
+        batch = []
+        indexed = 0
+        for product_id in product_ids.iterator(chunk_size=batch_size):
+            batch.append(product_id)
+            if len(batch) == batch_size:
+                index_products(batch)
+                indexed += len(batch)
+                batch = []
+        if batch:
+            index_products(batch)
+            indexed += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} products."))
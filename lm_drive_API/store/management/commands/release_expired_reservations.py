@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+from store.models import StockReservation
+from store.reservations import release_reservations
+
+
+class Command(BaseCommand):
+    help = "Give the stock held by expired reservations back. Run it every minute."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of reservations released per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        cutoff = now()
+        released = 0
+        while True:
+            batch = list(
+                StockReservation.objects.filter(expires_at__lte=cutoff)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not batch:
+                break
+            released += release_reservations(
+                StockReservation.objects.filter(pk__in=batch, expires_at__lte=cutoff)
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"Released {released} reservations."))
@@ -0,0 +1,91 @@
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from store.repricing import (
+    KEEP,
+    PENDING_ITEM_POLICIES,
+    RULES,
+    Repricing,
+    RepricingError,
+    select_products,
+)
+
+
+def decimal(value):
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValueError(value)
+
+
+class Command(BaseCommand):
+    help = (
+        "Change the prices of the products matching a category, brand, "
+        "subcategory or tva. Only reports the changes unless --apply is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("rule", choices=RULES)
+        parser.add_argument(
+            "value",
+            type=decimal,
+            help="Percentage, amount excluding tax or new TVA rate.",
+        )
+        parser.add_argument("--category", help="Exact category name.")
+        parser.add_argument("--brand", help="Exact brand name.")
+        parser.add_argument("--subcategory", help="Exact subcategory name.")
+        parser.add_argument("--tva", type=decimal, help="Current TVA rate.")
+        parser.add_argument(
+            "--pending-items",
+            choices=PENDING_ITEM_POLICIES,
+            default=KEEP,
+            help="Whether the items of pending orders follow the new prices.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of products written per query.",
+        )
+        parser.add_argument(
+            "--apply", action="store_true", help="Write the new prices."
+        )
+
+    def handle(self, *args, **options):
+        criteria = {
+            name: options[name] for name in ("category", "brand", "subcategory", "tva")
+        }
+        if all(value is None for value in criteria.values()):
+            raise CommandError(
+                "Select the products with --category, --brand, --subcategory or --tva."
+            )
+        try:
+            repricing = Repricing(
+                options["rule"],
+                options["value"],
+                pending_items=options["pending_items"],
+                batch_size=options["batch_size"],
+                max_changes=20,
+            )
+            report = repricing.run(
+                select_products(**criteria), dry_run=not options["apply"]
+            )
+        except RepricingError as error:
+            raise CommandError(str(error))
+
+        for change in report["changes"]:
+            self.stdout.write(
+                f"{change['product_id']}: price_ht {change['price_ht'][0]} -> "
+                f"{change['price_ht'][1]}, tva {change['tva'][0]} -> "
+                f"{change['tva'][1]}, price_ttc {change['price_ttc'][0]} -> "
+                f"{change['price_ttc'][1]}"
+            )
+        verb = "would change" if report["dry_run"] else "changed"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{report['matched']} products matched, {report['changed']} {verb}; "
+                f"total price_ttc {report['price_ttc_before']} -> "
+                f"{report['price_ttc_after']}; "
+                f"{report['pending_items_updated']} pending order items updated."
+            )
+        )
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from store.ledger import take_snapshot
+from store.models import Store
+
+
+class Command(BaseCommand):
+    help = (
+        "Store the current stock quantities of every store (or of the given "
+        "ones) as snapshots of the stock movement journal. Run it daily."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("store_ids", nargs="*", help="Stores to snapshot.")
+
+    def handle(self, *args, **options):
+        stores = Store.objects.order_by("store_id")
+        if options["store_ids"]:
+            stores = stores.filter(store_id__in=options["store_ids"])
+        for store_id in stores.values_list("store_id", flat=True):
+            count = take_snapshot(store_id)
+            self.stdout.write(f"{store_id}: {count} products")
+        self.stdout.write(self.style.SUCCESS("Stock snapshots taken."))
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.4 on 2026-10-16 22:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def add_fulltext_indexes(apps, schema_editor):
+    """FULLTEXT indexes only exist on MySQL; other databases search in-process."""
+    if schema_editor.connection.vendor != "mysql":
+        return
+    schema_editor.execute(
+        "ALTER TABLE store_productsearchdocument "
+        "ADD FULLTEXT INDEX store_search_title_ft (title), "
+        "ADD FULLTEXT INDEX store_search_title_body_ft (title, body)"
+    )
+
+
+def drop_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "mysql":
+        return
+    schema_editor.execute(
+        "ALTER TABLE store_productsearchdocument "
+        "DROP INDEX store_search_title_ft, "
+        "DROP INDEX store_search_title_body_ft"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='store.product')),
+                ('title', models.CharField(max_length=255)),
+                ('body', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Product search documents',
+            },
+        ),
+        migrations.RunPython(add_fulltext_indexes, drop_fulltext_indexes),
+    ]
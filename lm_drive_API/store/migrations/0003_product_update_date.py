@@ -0,0 +1,20 @@
+# Generated by Django 5.1.4 on 2026-10-16 23:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0002_productsearchdocument'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='update_date',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
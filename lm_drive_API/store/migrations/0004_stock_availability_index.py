@@ -0,0 +1,21 @@
+# Generated by Django 5.1.4 on 2026-10-16 23:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_product_update_date'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='stock',
+            name='store_stock_store_i_c9ca72_idx',
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['store', 'product', 'quantity_in_stock', 'expiration_date'], name='stock_store_availability_idx'),
+        ),
+    ]
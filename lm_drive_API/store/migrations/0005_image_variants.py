@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-16 23:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_stock_availability_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='brand',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.4 on 2026-10-17 00:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_alter_order_order_id'),
+        ('store', '0005_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stock',
+            name='reserved_quantity',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='orders.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='store.product')),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='store.store')),
+            ],
+            options={
+                'verbose_name_plural': 'Stock reservations',
+                'unique_together': {('order', 'product')},
+            },
+        ),
+    ]
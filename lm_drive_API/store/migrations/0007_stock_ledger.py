@@ -0,0 +1,45 @@
+# Generated by Django 5.1.4 on 2026-10-17 01:26
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('sale', 'Sale'), ('restock', 'Restock'), ('correction', 'Correction'), ('transfer', 'Transfer'), ('expiry', 'Expiry')], max_length=10)),
+                ('quantity', models.IntegerField()),
+                ('reference', models.CharField(blank=True, default='', max_length=50)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='store.product')),
+                ('store', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='store.store')),
+            ],
+            options={
+                'verbose_name_plural': 'Stock movements',
+                'indexes': [models.Index(fields=['store', 'product', 'created_at'], name='movement_store_product_idx'), models.Index(fields=['store', 'created_at'], name='movement_store_date_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('taken_at', models.DateTimeField()),
+                ('quantity', models.IntegerField()),
+                ('product', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='store.product')),
+                ('store', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='store.store')),
+            ],
+            options={
+                'verbose_name_plural': 'Stock snapshots',
+                'constraints': [models.UniqueConstraint(fields=('store', 'taken_at', 'product'), name='unique_stock_snapshot')],
+            },
+        ),
+    ]
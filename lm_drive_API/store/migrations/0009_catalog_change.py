@@ -0,0 +1,27 @@
+# Generated by Django 5.1.4 on 2026-10-17 03:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_store_coordinates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('category', 'Category'), ('subcategory', 'Subcategory'), ('brand', 'Brand'), ('packaging', 'Packaging'), ('store', 'Store'), ('product', 'Product'), ('stock', 'Stock')], max_length=12)),
+                ('key', models.CharField(max_length=20)),
+                ('store_key', models.CharField(blank=True, default='', max_length=10)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name_plural': 'Catalog changes',
+            },
+        ),
+    ]
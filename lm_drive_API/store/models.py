@@ -1,9 +1,31 @@
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.db.models import Case, Count, F, OuterRef, Prefetch, Q, Subquery, Sum, When
+from django.db.models.functions import Coalesce
 from django.forms import ValidationError
-from django.utils.timezone import now
+from django.utils.timezone import localdate, now
 from django.db import transaction
 
 
+class InsufficientStock(ValidationError):
+    """Raised with the `shortages`, {product_id: (requested, available)}."""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__(
+            [
+                f"Not enough stock for product {product_id}: {requested} requested, "
+                f"{available} available."
+                for product_id, (requested, available) in sorted(shortages.items())
+            ]
+        )
+
+
+def compute_price_ttc(price_ht, tva):
+    """Price including VAT, `tva` being a percentage (e.g. 20 for 20%)."""
+    return round(price_ht * (1 + tva / 100), 2)
+
+
 class Category(models.Model):
     name = models.CharField(max_length=20, unique=True)
 
@@ -28,6 +50,8 @@ class Brand(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True, null=True)
     logo = models.ImageField(upload_to="brands/logos/", blank=True, null=True)
+    # Resized copies of the logo, see store.images
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     class Meta:
         verbose_name_plural = "Brands"
@@ -68,6 +92,86 @@ class Packaging(models.Model):
 from django.db import models
 
 
+class ProductQuerySet(models.QuerySet):
+    def with_stock_summary(self):
+        """
+        Annotate the total stock and prefetch stocks with their stores, so that
+        stock summaries are built from memory instead of per-product queries.
+        """
+        return self.with_total_stock().prefetch_related(
+            Prefetch("stocks", queryset=Stock.objects.select_related("store"))
+        )
+
+    def with_total_stock(self):
+        """Annotate the stock summed over all stores, as `total_stock`."""
+        total_stock = (
+            Stock.objects.filter(product=OuterRef("pk"))
+            .values("product")
+            .annotate(total=Sum("quantity_in_stock"))
+            .values("total")
+        )
+        return self.annotate(
+            total_stock=Coalesce(
+                Subquery(total_stock), 0, output_field=models.IntegerField()
+            )
+        )
+
+    def touch(self):
+        """
+        Mark the products as modified, for changes made outside Product.save
+        that alter their representation (stocks, subcategories, brand...).
+        """
+        return self.update(update_date=now())
+
+    def in_subcategories(self, subcategory_ids, match_all=True):
+        """
+        Filter the products filed under all (or, with match_all=False, any) of
+        `subcategory_ids`, with one semi-join on the through table instead of
+        one join per subcategory, so no DISTINCT is needed.
+        """
+        subcategory_ids = set(subcategory_ids)
+        if not subcategory_ids:
+            return self if match_all else self.none()
+        links = self.model.subcategories.through.objects.filter(
+            subcategory_id__in=subcategory_ids
+        )
+        if match_all and len(subcategory_ids) > 1:
+            links = (
+                links.order_by()
+                .values("product_id")
+                .annotate(matched=Count("subcategory_id"))
+                .filter(matched=len(subcategory_ids))
+            )
+        return self.filter(pk__in=links.values("product_id"))
+
+    def for_catalog(self, fields=None):
+        """
+        Load everything ProductSerializer reads in a constant number of queries.
+        `fields` restricts the loading to the serializer fields that will be
+        rendered (see SparseFieldsetMixin); None means all of them.
+        """
+
+        def wanted(name):
+            return fields is None or name in fields
+
+        queryset = self
+        related = [name for name in ("brand", "category", "packaging") if wanted(name)]
+        if related:
+            queryset = queryset.select_related(*related)
+        if wanted("subcategories"):
+            queryset = queryset.prefetch_related("subcategories")
+        if wanted("stock_summary") or wanted("stocks"):
+            queryset = queryset.with_stock_summary()
+        if fields is not None:
+            columns = {field.name for field in self.model._meta.concrete_fields}
+            columns &= set(fields)
+            # Both are built from the image fields.
+            if "image_urls" in fields or "image_variants" in fields:
+                columns |= {"image1", "image2", "image3"}
+            queryset = queryset.only("product_id", *columns)
+        return queryset
+
+
 class Product(models.Model):
     product_id = models.CharField(max_length=20, unique=True, primary_key=True)
     product_name = models.CharField(max_length=100)
@@ -98,6 +202,8 @@ class Product(models.Model):
     image1 = models.ImageField(upload_to="images/", blank=True, null=True)
     image2 = models.ImageField(upload_to="images/", blank=True, null=True)
     image3 = models.ImageField(upload_to="images/", blank=True, null=True)
+    # Resized copies of the images, see store.images
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     packaging = models.ForeignKey(
         "Packaging",
         related_name="products",
@@ -105,6 +211,9 @@ class Product(models.Model):
         null=True,
         blank=True,
     )
+    update_date = models.DateTimeField(auto_now=True)
+
+    objects = ProductQuerySet.as_manager()
 
     class Meta:
         verbose_name_plural = "Products"
@@ -122,7 +231,7 @@ class Product(models.Model):
                 raise ValueError("Prix HT cannot be negative.")
             if not (0 <= self.tva <= 100):
                 raise ValueError("TVA must be between 0 and 100.")
-            self.price_ttc = round(self.price_ht * (1 + self.tva / 100), 2)
+            self.price_ttc = compute_price_ttc(self.price_ht, self.tva)
         else:
             self.price_ttc = None  # Set to None if required fields are missing
         super().save(*args, **kwargs)
@@ -131,11 +240,16 @@ class Product(models.Model):
         """
         Summarizes the stock across all stores for this product.
         Returns the total quantity in stock and a list of stock by store.
+        Reads prefetched stocks and the `total_stock` annotation when present
+        (see ProductQuerySet.with_stock_summary).
         """
-        stocks = self.stocks.all()
-        total_stock = (
-            stocks.aggregate(total=models.Sum("quantity_in_stock"))["total"] or 0
-        )
+        if "stocks" in getattr(self, "_prefetched_objects_cache", {}):
+            stocks = self.stocks.all()
+        else:
+            stocks = list(self.stocks.select_related("store"))
+        total_stock = getattr(self, "total_stock", None)
+        if total_stock is None:
+            total_stock = sum(stock.quantity_in_stock for stock in stocks)
         stock_details = [
             {
                 "store": stock.store.name,
@@ -150,6 +264,28 @@ class Product(models.Model):
         }
 
 
+class ProductSearchDocument(models.Model):
+    """
+    Accent-folded text of a product, maintained by signals (see store.search).
+    The title holds the product name, the body everything else searchable.
+    """
+
+    product = models.OneToOneField(
+        Product,
+        primary_key=True,
+        related_name="search_document",
+        on_delete=models.CASCADE,
+    )
+    title = models.CharField(max_length=255)
+    body = models.TextField(blank=True)
+
+    class Meta:
+        verbose_name_plural = "Product search documents"
+
+    def __str__(self):
+        return self.title
+
+
 class Store(models.Model):
     store_id = models.CharField(max_length=10, primary_key=True)
     name = models.CharField(max_length=50, unique=True)
@@ -157,6 +293,21 @@ class Store(models.Model):
     city = models.CharField(max_length=100, blank=True, null=True)
     postal_code = models.CharField(max_length=10, blank=True, null=True)
     phone_number = models.CharField(max_length=15, blank=True, null=True)
+    # WGS84 coordinates, used by the nearest store locator (store.locator)
+    latitude = models.DecimalField(
+        max_digits=9,
+        decimal_places=6,
+        blank=True,
+        null=True,
+        validators=[MinValueValidator(-90), MaxValueValidator(90)],
+    )
+    longitude = models.DecimalField(
+        max_digits=9,
+        decimal_places=6,
+        blank=True,
+        null=True,
+        validators=[MinValueValidator(-180), MaxValueValidator(180)],
+    )
 
     class Meta:
         verbose_name_plural = "Stores"
@@ -165,38 +316,129 @@ class Store(models.Model):
         return self.name
 
 
+class StockQuerySet(models.QuerySet):
+    def available(self):
+        """Stocks that can be sold today: in stock and not expired."""
+        return self.filter(quantity_in_stock__gt=0, expiration_date__gte=localdate())
+
+
 class Stock(models.Model):
     store = models.ForeignKey(Store, related_name="stocks", on_delete=models.CASCADE)
     product = models.ForeignKey(
         Product, related_name="stocks", on_delete=models.CASCADE
     )
     quantity_in_stock = models.PositiveIntegerField(default=0)
+    # Sum of the active StockReservation quantities, kept up to date by
+    # store.reservations with conditional updates.
+    reserved_quantity = models.PositiveIntegerField(default=0, editable=False)
     expiration_date = models.DateField(default=now)
 
+    objects = StockQuerySet.as_manager()
+
     class Meta:
         unique_together = ("store", "product")
         verbose_name_plural = "Stocks"
         indexes = [
-            models.Index(fields=["store", "product"]),
+            # Covers StockQuerySet.available() per store: the product ids
+            # available at a store are read from the index alone.
+            models.Index(
+                fields=["store", "product", "quantity_in_stock", "expiration_date"],
+                name="stock_store_availability_idx",
+            ),
         ]
 
     def __str__(self):
         return f"{self.store.name} - {self.product.product_name}"
 
+    @property
+    def available_to_promise(self):
+        """Quantity that can still be reserved: on hand minus reserved."""
+        return max(self.quantity_in_stock - self.reserved_quantity, 0)
+
     def clean(self):
         if self.quantity_in_stock < 0:
             raise ValidationError("Quantity in stock cannot be negative.")
         if self.expiration_date < now().date():
             raise ValidationError("Expiration date must be in the future.")
 
-    def save(self, *args, **kwargs):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered to journal the change made by the next save()
+        instance._saved_quantity = instance.__dict__.get("quantity_in_stock")
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._saved_quantity = self.__dict__.get("quantity_in_stock")
+
+    def save(self, *args, movement_kind=None, movement_reference="", **kwargs):
+        """
+        Save the stock and journal the change of quantity as a StockMovement,
+        of `movement_kind` (by default a restock for a new stock and a
+        correction otherwise).
+
+        An existing row is locked and the change made to quantity_in_stock
+        since it was loaded is applied to its current quantity, so sales,
+        imports and reservations committed in between are kept; the reserved
+        quantity is never written back (see store.reservations).
+        """
         self.full_clean()  # Calls clean method for validations
-        super().save(*args, **kwargs)
+        if self._state.adding:
+            super().save(*args, **kwargs)
+            StockMovement.record(
+                self.store_id,
+                {self.product_id: self.quantity_in_stock},
+                movement_kind or StockMovement.Kind.RESTOCK,
+                movement_reference,
+            )
+            self._saved_quantity = self.quantity_in_stock
+            return
+
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None:
+            # Reservations change the reserved quantity with conditional
+            # updates: writing it back from memory could undo them.
+            update_fields = kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != "reserved_quantity"
+            ]
+        with transaction.atomic():
+            stored, reserved = (
+                Stock.objects.select_for_update()
+                .filter(pk=self.pk)
+                .values_list("quantity_in_stock", "reserved_quantity")
+                .get()
+            )
+            change = 0
+            if "quantity_in_stock" in update_fields:
+                loaded = getattr(self, "_saved_quantity", None)
+                change = self.quantity_in_stock - (stored if loaded is None else loaded)
+                if stored + change < 0:
+                    raise ValidationError(
+                        f"Not enough stock: {stored} left, {-change} requested."
+                    )
+            self.quantity_in_stock = stored + change
+            self.reserved_quantity = reserved
+            super().save(*args, **kwargs)
+            StockMovement.record(
+                self.store_id,
+                {self.product_id: change},
+                movement_kind or StockMovement.Kind.CORRECTION,
+                movement_reference,
+            )
+        self._saved_quantity = self.quantity_in_stock
 
     def delete(self, *args, **kwargs):
         super().delete(*args, **kwargs)
+        StockMovement.record(
+            self.store_id,
+            {self.product_id: -self.quantity_in_stock},
+            StockMovement.Kind.CORRECTION,
+        )
 
-    def adjust_stock(self, quantity):
+    def adjust_stock(self, quantity, kind=None, reference=""):
         if quantity < 0:
             raise ValidationError("Quantity to adjust cannot be negative.")
         if quantity > self.quantity_in_stock:
@@ -204,13 +446,99 @@ class Stock(models.Model):
                 f"Not enough stock for {self.product.product_name} in {self.store.name}."
             )
         self.quantity_in_stock -= quantity
-        self.save()
+        self.save(
+            movement_kind=kind or StockMovement.Kind.SALE, movement_reference=reference
+        )
 
-    def restock(self, quantity):
+    def restock(self, quantity, kind=None, reference=""):
         if quantity < 0:
             raise ValidationError("Restocking quantity cannot be negative.")
         self.quantity_in_stock += quantity
-        self.save()
+        self.save(
+            movement_kind=kind or StockMovement.Kind.RESTOCK,
+            movement_reference=reference,
+        )
+
+    @classmethod
+    def decrement_batch(
+        cls, store_id, quantities, released=None, kind=None, reference=""
+    ):
+        """
+        Decrement the stock of several products of a store at once, all or
+        nothing. `quantities` maps product ids to the quantity to take;
+        `released` maps product ids to reserved quantities that are consumed
+        by the decrement (see store.reservations). The decrements are
+        journaled as movements of `kind` (sales by default).
+
+        The rows are locked with a single SELECT ... FOR UPDATE ordered by
+        product, so concurrent batches always lock them in the same order and
+        cannot deadlock. Every shortage is collected before raising
+        InsufficientStock; otherwise one UPDATE applies all the decrements.
+        """
+        released = released or {}
+        with transaction.atomic():
+            stocks = {
+                stock.product_id: stock
+                for stock in cls.objects.select_for_update()
+                .filter(store_id=store_id, product_id__in=quantities)
+                .order_by("product_id")
+                .only("pk", "product_id", "quantity_in_stock", "reserved_quantity")
+            }
+            shortages = {}
+            for product_id, quantity in quantities.items():
+                stock = stocks.get(product_id)
+                available = 0
+                if stock is not None:
+                    held_elsewhere = stock.reserved_quantity - released.get(
+                        product_id, 0
+                    )
+                    available = stock.quantity_in_stock - max(held_elsewhere, 0)
+                if quantity > available:
+                    shortages[product_id] = (quantity, max(available, 0))
+            if shortages:
+                raise InsufficientStock(shortages)
+
+            condition = Q()
+            for product_id, quantity in quantities.items():
+                # Conditional on the quantity, although the rows are locked
+                condition |= Q(product_id=product_id, quantity_in_stock__gte=quantity)
+            reserved_cases = []
+            for product_id, quantity in released.items():
+                if quantity and product_id in quantities:
+                    reserved_cases += [
+                        When(
+                            product_id=product_id,
+                            reserved_quantity__gte=quantity,
+                            then=F("reserved_quantity") - quantity,
+                        ),
+                        When(product_id=product_id, then=0),
+                    ]
+            updates = {
+                "quantity_in_stock": Case(
+                    *[
+                        When(
+                            product_id=product_id,
+                            then=F("quantity_in_stock") - quantity,
+                        )
+                        for product_id, quantity in quantities.items()
+                    ],
+                    default=F("quantity_in_stock"),
+                    output_field=models.PositiveIntegerField(),
+                )
+            }
+            if reserved_cases:
+                updates["reserved_quantity"] = Case(
+                    *reserved_cases,
+                    default=F("reserved_quantity"),
+                    output_field=models.PositiveIntegerField(),
+                )
+            cls.objects.filter(condition, store_id=store_id).update(**updates)
+            StockMovement.record(
+                store_id,
+                {product_id: -quantity for product_id, quantity in quantities.items()},
+                kind or StockMovement.Kind.SALE,
+                reference,
+            )
 
     @classmethod
     def handle_payment_success(cls, store_id, product_id, quantity):
@@ -219,10 +547,166 @@ class Stock(models.Model):
                 stock = cls.objects.select_for_update().get(
                     store_id=store_id, product_id=product_id
                 )
-                stock.adjust_stock(quantity)
+                stock.adjust_stock(quantity, StockMovement.Kind.SALE)
         except Stock.DoesNotExist:
             raise ValidationError(
                 f"Stock not found for store {store_id} and product {product_id}."
             )
         except ValidationError as e:
             raise e
+
+
+class StockReservation(models.Model):
+    """
+    Quantity of a product set aside in a store for a pending order until
+    `expires_at`. See store.reservations.
+    """
+
+    store = models.ForeignKey(
+        Store, related_name="reservations", on_delete=models.CASCADE
+    )
+    product = models.ForeignKey(
+        Product, related_name="reservations", on_delete=models.CASCADE
+    )
+    order = models.ForeignKey(
+        "orders.Order", related_name="reservations", on_delete=models.CASCADE
+    )
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("order", "product")
+        verbose_name_plural = "Stock reservations"
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} for order {self.order_id}"
+
+
+class StockMovement(models.Model):
+    """
+    Append-only journal of the changes of stock quantities, see store.ledger.
+
+    Rows are never updated or deleted, and outlive their stores and products:
+    the foreign keys have no database constraint, which also keeps inserts
+    cheap. Both indexes start with the store and end with the date, so the
+    reports of a store over a period read one contiguous index range.
+    """
+
+    class Kind(models.TextChoices):
+        SALE = "sale", "Sale"
+        RESTOCK = "restock", "Restock"
+        CORRECTION = "correction", "Correction"
+        TRANSFER = "transfer", "Transfer"
+        EXPIRY = "expiry", "Expiry"
+
+    id = models.BigAutoField(primary_key=True)
+    store = models.ForeignKey(
+        Store, related_name="+", on_delete=models.DO_NOTHING, db_constraint=False
+    )
+    product = models.ForeignKey(
+        Product, related_name="+", on_delete=models.DO_NOTHING, db_constraint=False
+    )
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    # Signed change of quantity_in_stock
+    quantity = models.IntegerField()
+    # Order id, feed name... the movement comes from
+    reference = models.CharField(max_length=50, blank=True, default="")
+    created_at = models.DateTimeField(default=now)
+
+    class Meta:
+        verbose_name_plural = "Stock movements"
+        indexes = [
+            models.Index(
+                fields=["store", "product", "created_at"],
+                name="movement_store_product_idx",
+            ),
+            models.Index(
+                fields=["store", "created_at"], name="movement_store_date_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.quantity:+d} {self.product_id} at {self.store_id}"
+
+    @classmethod
+    def record(cls, store_id, deltas, kind, reference=""):
+        """Journal the non-zero `deltas` ({product_id: change}) of a store."""
+        created_at = now()
+        movements = [
+            cls(
+                store_id=store_id,
+                product_id=product_id,
+                kind=kind,
+                quantity=delta,
+                reference=reference or "",
+                created_at=created_at,
+            )
+            for product_id, delta in deltas.items()
+            if delta
+        ]
+        if movements:
+            cls.objects.bulk_create(movements)
+        return movements
+
+
+class StockSnapshot(models.Model):
+    """
+    Quantity in stock of a product at a store at `taken_at`, as computed from
+    the journal (see store.ledger). Products without a row had no stock.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    store = models.ForeignKey(
+        Store, related_name="+", on_delete=models.DO_NOTHING, db_constraint=False
+    )
+    product = models.ForeignKey(
+        Product, related_name="+", on_delete=models.DO_NOTHING, db_constraint=False
+    )
+    taken_at = models.DateTimeField()
+    quantity = models.IntegerField()
+
+    class Meta:
+        verbose_name_plural = "Stock snapshots"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["store", "taken_at", "product"], name="unique_stock_snapshot"
+            )
+        ]
+
+    def __str__(self):
+        return (
+            f"{self.product_id} at {self.store_id} on {self.taken_at}: {self.quantity}"
+        )
+
+
+class CatalogChange(models.Model):
+    """
+    Log of the writes to the catalog rows synced by offline clients, see
+    store.sync. Its ids are the catalog versions. A change only names the
+    row: the row is read in its current state when the change is served.
+    """
+
+    class Kind(models.TextChoices):
+        CATEGORY = "category", "Category"
+        SUBCATEGORY = "subcategory", "Subcategory"
+        BRAND = "brand", "Brand"
+        PACKAGING = "packaging", "Packaging"
+        STORE = "store", "Store"
+        PRODUCT = "product", "Product"
+        STOCK = "stock", "Stock"
+
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=12, choices=Kind.choices)
+    # Primary key of the row, product id of a stock
+    key = models.CharField(max_length=20)
+    # Store id of a stock
+    store_key = models.CharField(max_length=10, blank=True, default="")
+    created_at = models.DateTimeField(default=now)
+
+    class Meta:
+        verbose_name_plural = "Catalog changes"
+
+    def __str__(self):
+        key = f"{self.store_key}/{self.key}" if self.store_key else self.key
+        return f"{self.id}: {self.kind} {key}"
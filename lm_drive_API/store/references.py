@@ -0,0 +1,156 @@
+"""
+Process-local cache of the reference tables: categories, subcategories,
+brands and packagings.
+
+These tables hold a few hundred rows that nearly every product write and
+filter looks up. Each process keeps them in memory as plain maps (lowercased
+name -> id, id -> name, packaging triple -> id) tagged with a reference
+version kept in Django's shared cache. Committed writes to the tables bump the
+version (see store.signals), and every lookup compares the tagged version
+with the shared one, a single cache read, reloading the maps in four queries
+when they differ. Rows created in bulk here bump the version themselves. The
+maps are also reloaded every REFERENCE_TTL seconds, so that a process missing
+a bump (lost or evicted cache key) still catches up.
+"""
+
+import threading
+import time
+
+from django.db import transaction
+
+from . import sync
+from .cache import bump_version, get_version
+from .models import Brand, Category, Packaging, SubCategory
+
+REFERENCE_VERSION_KEY = "store:reference-version"
+NAMED_MODELS = (Category, SubCategory, Brand)
+PACKAGING_FIELDS = ["packaging_quantity", "packaging_value", "packaging_type"]
+# Seconds after which the tables are reloaded even without a version bump
+REFERENCE_TTL = 60
+
+
+def bump_reference_version():
+    """Make every process reload its reference tables."""
+    return bump_version(REFERENCE_VERSION_KEY)
+
+
+class ReferenceTables:
+    def __init__(self, version):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.ids = {}  # model -> {lowercased name: id}
+        self.names = {}  # model -> {id: name}
+        for model in NAMED_MODELS:
+            rows = list(model.objects.values_list("id", "name"))
+            self.ids[model] = {name.lower(): pk for pk, name in rows}
+            self.names[model] = dict(rows)
+        self.packagings = {
+            tuple(values[:3]): values[3]
+            for values in Packaging.objects.values_list(*PACKAGING_FIELDS, "id")
+        }
+
+
+_tables = None
+_lock = threading.Lock()
+
+
+def get_tables():
+    """Return the ReferenceTables of the current reference version."""
+    global _tables
+    version = get_version(REFERENCE_VERSION_KEY)
+
+    def is_current(tables):
+        return (
+            tables is not None
+            and tables.version == version
+            and time.monotonic() - tables.loaded_at < REFERENCE_TTL
+        )
+
+    tables = _tables
+    if not is_current(tables):
+        with _lock:
+            tables = _tables
+            if not is_current(tables):
+                tables = _tables = ReferenceTables(version)
+    return tables
+
+
+def clear():
+    """Drop the reference tables of this process."""
+    global _tables
+    _tables = None
+
+
+def reference_name(model, pk):
+    """Return the name of the category, subcategory or brand `pk`, or None."""
+    return get_tables().names[model].get(pk)
+
+
+def reference_ids_containing(model, text):
+    """
+    Return the ids of the categories, subcategories or brands whose name
+    contains `text`, ignoring case.
+    """
+    text = text.lower()
+    return [pk for name, pk in get_tables().ids[model].items() if text in name]
+
+
+def reference_ids(model, names, create=False):
+    """
+    Return {name: id} of categories, subcategories or brands (names are
+    matched ignoring case), None for unknown names unless `create` is true.
+    """
+    ids = get_tables().ids[model]
+    result = {name: ids.get(name.lower()) for name in names}
+    missing = [name for name, pk in result.items() if pk is None]
+    if missing and create:
+        model.objects.bulk_create(
+            [model(name=name) for name in missing], ignore_conflicts=True
+        )
+        found = {
+            name.lower(): pk
+            for pk, name in model.objects.filter(name__in=missing).values_list(
+                "id", "name"
+            )
+        }
+        for name in missing:
+            result[name] = found.get(name.lower())
+        # Bulk created rows get no signals.
+        sync.log_changes(sync.KINDS[model], [result[name] for name in missing])
+        transaction.on_commit(bump_reference_version)
+    return result
+
+
+def reference_id(model, name, create=False):
+    """Return the id of one category, subcategory or brand, see reference_ids."""
+    return reference_ids(model, [name], create)[name]
+
+
+def packaging_ids(keys, create=False):
+    """
+    Return {(quantity, value, type): id} of packagings, None for unknown ones
+    unless `create` is true.
+    """
+    packagings = get_tables().packagings
+    result = {key: packagings.get(key) for key in keys}
+    missing = [key for key, pk in result.items() if pk is None]
+    if missing and create:
+        Packaging.objects.bulk_create(
+            [Packaging(**dict(zip(PACKAGING_FIELDS, key))) for key in missing],
+            ignore_conflicts=True,
+        )
+        for key in missing:
+            result[key] = (
+                Packaging.objects.filter(**dict(zip(PACKAGING_FIELDS, key)))
+                .values_list("id", flat=True)
+                .first()
+            )
+        sync.log_changes(sync.Kind.PACKAGING, [result[key] for key in missing])
+        transaction.on_commit(bump_reference_version)
+    return result
+
+
+def packaging_id(data, create=False):
+    """Return the id of the packaging described by the `data` mapping."""
+    key = tuple(data[name] for name in PACKAGING_FIELDS)
+    return packaging_ids([key], create)[key]
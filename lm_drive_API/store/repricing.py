@@ -0,0 +1,234 @@
+"""
+Mass repricing of products.
+
+A rule is applied to every product matching a selection (category, brand,
+subcategory, current TVA): a percentage or an absolute change of the price
+excluding tax, or a new TVA rate. Products are read as plain tuples, chunk by
+chunk; new prices are computed in Decimal with the rounding of Product.save
+(compute_price_ttc), so that a later save never changes them. Every new price
+is checked before the first write; each chunk is then written back with one
+bulk_update, in its own transaction, so a large selection never keeps all its
+rows locked at once. A repricing interrupted halfway (by a database error)
+leaves the chunks already committed repriced: rerun a relative rule only on
+the products it did not reach.
+
+Items of pending orders either keep the price they were added at (KEEP) or
+follow the new prices (UPDATE), their orders' totals being recomputed.
+"""
+
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils.timezone import now
+
+from orders.models import OrderItem, recompute_order_totals
+
+from .models import Product, compute_price_ttc
+from .signals import products_bulk_changed
+
+PERCENT = "percent"
+ABSOLUTE = "absolute"
+NEW_TVA = "new_tva"
+RULES = (PERCENT, ABSOLUTE, NEW_TVA)
+
+KEEP = "keep"
+UPDATE = "update"
+PENDING_ITEM_POLICIES = (KEEP, UPDATE)
+
+PRICE_FIELDS = ["product_id", "price_ht", "tva", "price_ttc"]
+UPDATED_FIELDS = ["price_ht", "tva", "price_ttc", "update_date"]
+# Largest value of the price columns (max_digits=10, decimal_places=2)
+MAX_PRICE = Decimal("99999999.99")
+
+
+class RepricingError(ValueError):
+    pass
+
+
+def select_products(category=None, brand=None, subcategory=None, tva=None):
+    """Return the products matching every given criterion (names are exact)."""
+    queryset = Product.objects.all()
+    if category:
+        queryset = queryset.filter(category__name__iexact=category)
+    if brand:
+        queryset = queryset.filter(brand__name__iexact=brand)
+    if subcategory:
+        queryset = queryset.filter(
+            pk__in=Product.subcategories.through.objects.filter(
+                subcategory__name__iexact=subcategory
+            ).values("product_id")
+        )
+    if tva is not None:
+        queryset = queryset.filter(tva=tva)
+    return queryset
+
+
+def apply_rule(rule, value, price_ht, tva):
+    """Return the new (price_ht, tva, price_ttc) of a product."""
+    if rule == PERCENT:
+        price_ht = round(price_ht * (1 + value / 100), 2)
+    elif rule == ABSOLUTE:
+        price_ht = price_ht + value
+    elif rule == NEW_TVA:
+        tva = value
+    else:
+        raise RepricingError(f"Unknown rule '{rule}'.")
+    return price_ht, tva, compute_price_ttc(price_ht, tva)
+
+
+class Repricing:
+    def __init__(
+        self, rule, value, pending_items=KEEP, batch_size=1000, max_changes=100
+    ):
+        if rule not in RULES:
+            raise RepricingError(f"Rule must be one of {', '.join(RULES)}.")
+        if pending_items not in PENDING_ITEM_POLICIES:
+            raise RepricingError(
+                f"Pending items policy must be one of {', '.join(PENDING_ITEM_POLICIES)}."
+            )
+        if rule == NEW_TVA and not (0 <= value <= 100):
+            raise RepricingError("TVA must be between 0 and 100.")
+        self.rule = rule
+        self.value = Decimal(value)
+        self.pending_items = pending_items
+        self.batch_size = batch_size
+        self.max_changes = max_changes
+
+    def reprice(self, rows):
+        """
+        Return the (product_id, old prices, new prices) of the `rows` whose
+        prices change. Raises RepricingError when a new price is invalid.
+        """
+        changes = []
+        for product_id, price_ht, tva, price_ttc in rows:
+            new = apply_rule(self.rule, self.value, price_ht, tva)
+            if not (0 <= new[0] <= MAX_PRICE and 0 <= new[2] <= MAX_PRICE):
+                raise RepricingError(
+                    f"Product {product_id} would cost {new[0]} excluding tax."
+                )
+            if new != (price_ht, tva, price_ttc):
+                changes.append((product_id, (price_ht, tva, price_ttc), new))
+        return changes
+
+    def compute(self, queryset):
+        """
+        Yield lists of (product_id, old prices, new prices) of the products
+        whose prices change, chunk by chunk. Raises RepricingError when a new
+        price is invalid.
+        """
+        rows = (
+            queryset.order_by("pk")
+            .values_list(*PRICE_FIELDS)
+            .iterator(chunk_size=self.batch_size)
+        )
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= self.batch_size:
+                yield self.reprice(chunk)
+                chunk = []
+        if chunk:
+            yield self.reprice(chunk)
+
+    def run(self, queryset, dry_run=False):
+        """
+        Reprice the products of `queryset`, or only report what would change,
+        and return a summary.
+
+        Every new price is computed and checked before anything is written,
+        then each chunk is written in its own transaction, so that rows are
+        only locked while their chunk is written. The chunk's products are
+        read again under lock and repriced from their current prices.
+        """
+        report = {
+            "dry_run": dry_run,
+            "rule": self.rule,
+            "value": self.value,
+            "pending_items": self.pending_items,
+            "matched": queryset.count(),
+            "changed": 0,
+            "price_ttc_before": Decimal("0.00"),
+            "price_ttc_after": Decimal("0.00"),
+            "pending_items_updated": 0,
+            "orders_updated": 0,
+            "changes": [],
+        }
+        product_ids = []
+        for chunk in self.compute(queryset):
+            report["changed"] += len(chunk)
+            for product_id, old, new in chunk:
+                product_ids.append(product_id)
+                report["price_ttc_before"] += old[2]
+                report["price_ttc_after"] += new[2]
+                if len(report["changes"]) < self.max_changes:
+                    report["changes"].append(
+                        {
+                            "product_id": product_id,
+                            "price_ht": [old[0], new[0]],
+                            "tva": [old[1], new[1]],
+                            "price_ttc": [old[2], new[2]],
+                        }
+                    )
+        if dry_run:
+            return report
+
+        order_ids = set()
+        for start in range(0, len(product_ids), self.batch_size):
+            with transaction.atomic():
+                rows = (
+                    Product.objects.select_for_update()
+                    .filter(pk__in=product_ids[start : start + self.batch_size])
+                    .order_by("pk")
+                    .values_list(*PRICE_FIELDS)
+                )
+                chunk = self.reprice(rows)
+                if chunk:
+                    chunk_order_ids = self.write_chunk(chunk, report)
+                    recompute_order_totals(chunk_order_ids)
+                    order_ids |= chunk_order_ids
+        report["orders_updated"] = len(order_ids)
+        return report
+
+    def write_chunk(self, chunk, report):
+        """
+        Write the new prices of `chunk`, and those of the pending items
+        following them, and return the ids of the orders of these items.
+        """
+        update_date = now()
+        order_ids = set()
+        Product.objects.bulk_update(
+            [
+                Product(
+                    product_id=product_id,
+                    price_ht=price_ht,
+                    tva=tva,
+                    price_ttc=price_ttc,
+                    update_date=update_date,
+                )
+                for product_id, _, (price_ht, tva, price_ttc) in chunk
+            ],
+            UPDATED_FIELDS,
+        )
+        products_bulk_changed.send(
+            sender=Product,
+            product_ids=[product_id for product_id, _, _ in chunk],
+            fields=UPDATED_FIELDS,
+        )
+        if self.pending_items == UPDATE:
+            new_prices = {product_id: new for product_id, _, new in chunk}
+            items = list(
+                OrderItem.objects.filter(
+                    order__status="pending", product_id__in=new_prices
+                ).only("id", "order_id", "product_id", "quantity")
+            )
+            for item in items:
+                item.price_ht, item.tva, item.price_ttc = new_prices[item.product_id]
+                # Same rounding as OrderItem.save
+                item.total_ht = round(item.price_ht * item.quantity, 2)
+                item.total_ttc = round(item.price_ttc * item.quantity, 2)
+                order_ids.add(item.order_id)
+            OrderItem.objects.bulk_update(
+                items, ["price_ht", "tva", "price_ttc", "total_ht", "total_ttc"]
+            )
+            report["pending_items_updated"] += len(items)
+        return order_ids
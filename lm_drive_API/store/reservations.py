@@ -0,0 +1,194 @@
+"""
+Stock reservations for pending orders.
+
+Adding products to a pending order sets their quantity aside in the order's
+store for a limited time (settings.STOCK_RESERVATION_TTL_MINUTES, 30 by
+default). Each Stock row keeps the sum of its active reservations in
+`reserved_quantity`, so the available-to-promise quantity is read from the
+row alone: quantity_in_stock - reserved_quantity.
+
+Reserving is a single conditional UPDATE that only succeeds while enough
+stock is left: the check and the increment happen atomically in the
+database, without locking rows beforehand. Expired reservations are given
+back in bulk by the `release_expired_reservations` command (and on demand
+when a reservation would otherwise fail), and a successful payment turns the
+reservations of the order into a stock decrement.
+
+Only pending orders reserve: confirming an order restarts the time to live
+of its reservations, which are no longer changed, to leave time for the
+payment. A confirmed order left unpaid longer loses its hold like any other,
+and its payment then takes what is still available (commit_order_stock).
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, When
+from django.utils.timezone import now
+
+from .models import InsufficientStock, Stock, StockReservation
+from .signals import stocks_bulk_changed
+from .utils import bulk_upsert
+
+DEFAULT_RESERVATION_TTL_MINUTES = 30
+
+
+def get_reservation_ttl():
+    return timedelta(
+        minutes=getattr(
+            settings, "STOCK_RESERVATION_TTL_MINUTES", DEFAULT_RESERVATION_TTL_MINUTES
+        )
+    )
+
+
+def available_to_promise(store_id, product_ids):
+    """Return {product_id: quantity that can still be reserved}, without locks."""
+    stocks = Stock.objects.filter(store_id=store_id, product_id__in=product_ids)
+    return {
+        product_id: max(quantity_in_stock - reserved_quantity, 0)
+        for product_id, quantity_in_stock, reserved_quantity in stocks.values_list(
+            "product_id", "quantity_in_stock", "reserved_quantity"
+        )
+    }
+
+
+def reserve_stock(store_id, product_id, quantity):
+    """Add `quantity` to the reserved stock if enough is left; return success."""
+    return bool(
+        Stock.objects.filter(
+            store_id=store_id,
+            product_id=product_id,
+            quantity_in_stock__gte=F("reserved_quantity") + quantity,
+        ).update(reserved_quantity=F("reserved_quantity") + quantity)
+    )
+
+
+def unreserve_stock(store_id, product_id, quantity):
+    """Give `quantity` of reserved stock back."""
+    Stock.objects.filter(store_id=store_id, product_id=product_id).update(
+        # Never below zero, even if the counter drifted.
+        reserved_quantity=Case(
+            When(
+                reserved_quantity__gte=quantity,
+                then=F("reserved_quantity") - quantity,
+            ),
+            default=0,
+        )
+    )
+
+
+def reserve_order(order, quantities):
+    """
+    Make the reservations of `order` match `quantities` ({product_id:
+    quantity}) by reserving or giving back the differences, and restart their
+    time to live. Raises InsufficientStock, changing nothing, when a quantity
+    cannot be reserved.
+    """
+    quantities = {
+        product_id: quantity for product_id, quantity in quantities.items() if quantity
+    }
+    with transaction.atomic():
+        current = dict(order.reservations.values_list("product_id", "quantity"))
+        missing = {}
+        # Sorted, so that concurrent orders update stock rows in the same order.
+        for product_id in sorted(quantities):
+            delta = quantities[product_id] - current.get(product_id, 0)
+            if delta > 0 and not reserve_stock(order.store_id, product_id, delta):
+                missing[product_id] = delta
+        if missing:
+            # Expired reservations of other orders may still hold the stock:
+            # free them and retry once.
+            release_reservations(
+                StockReservation.objects.filter(
+                    store_id=order.store_id,
+                    product_id__in=missing,
+                    expires_at__lte=now(),
+                ).exclude(order=order)
+            )
+            for product_id in sorted(missing):
+                if reserve_stock(order.store_id, product_id, missing[product_id]):
+                    del missing[product_id]
+        if missing:
+            available = available_to_promise(order.store_id, missing)
+            raise InsufficientStock(
+                {
+                    product_id: (
+                        quantities[product_id],
+                        available.get(product_id, 0) + current.get(product_id, 0),
+                    )
+                    for product_id in missing
+                }
+            )
+
+        for product_id, quantity in current.items():
+            delta = quantity - quantities.get(product_id, 0)
+            if delta > 0:
+                unreserve_stock(order.store_id, product_id, delta)
+        order.reservations.exclude(product_id__in=quantities).delete()
+        if quantities:
+            expires_at = now() + get_reservation_ttl()
+            bulk_upsert(
+                StockReservation,
+                [
+                    StockReservation(
+                        store_id=order.store_id,
+                        product_id=product_id,
+                        order=order,
+                        quantity=quantity,
+                        expires_at=expires_at,
+                    )
+                    for product_id, quantity in quantities.items()
+                ],
+                unique_fields=["order", "product"],
+                update_fields=["quantity", "expires_at"],
+            )
+
+
+def extend_reservations(order):
+    """Restart the time to live of the reservations of `order`."""
+    return order.reservations.update(expires_at=now() + get_reservation_ttl())
+
+
+def release_reservations(queryset):
+    """
+    Give the quantities of the reservations in `queryset` back to their stocks
+    and delete them. Returns the number of released reservations.
+    """
+    with transaction.atomic():
+        reservations = list(
+            queryset.select_for_update().values_list(
+                "pk", "store_id", "product_id", "quantity"
+            )
+        )
+        totals = defaultdict(int)
+        for _, store_id, product_id, quantity in reservations:
+            totals[store_id, product_id] += quantity
+        for store_id, product_id in sorted(totals):
+            unreserve_stock(store_id, product_id, totals[store_id, product_id])
+        StockReservation.objects.filter(
+            pk__in=[reservation[0] for reservation in reservations]
+        ).delete()
+    return len(reservations)
+
+
+def commit_order_stock(order):
+    """
+    Turn the reservations of a paid order into a decrement of its items'
+    stock, with Stock.decrement_batch. Items whose reservation expired are
+    taken from the available-to-promise stock. All or nothing: raises
+    InsufficientStock with every shortage when an item cannot be served.
+    """
+    quantities = dict(order.items.values_list("product_id", "quantity"))
+    with transaction.atomic():
+        reserved = dict(
+            order.reservations.select_for_update().values_list("product_id", "quantity")
+        )
+        Stock.decrement_batch(
+            order.store_id, quantities, released=reserved, reference=order.order_id
+        )
+        order.reservations.all().delete()
+        stocks_bulk_changed.send(
+            sender=Stock, store_id=order.store_id, product_ids=list(quantities)
+        )
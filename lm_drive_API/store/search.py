@@ -0,0 +1,271 @@
+"""
+Product search.
+
+Each product is indexed into a ProductSearchDocument row holding its
+accent-folded name (title) and the rest of its searchable text (body):
+description, UPC, brand, category and subcategories. Rows are refreshed by
+the signals in store.signals and rebuilt by the `rebuild_search_index`
+command.
+
+On MySQL the rows are matched through FULLTEXT indexes. Other databases
+(SQLite in tests and development) use an in-process inverted index built
+from the same rows, which only sees writes made by its own process and
+returns the best MAX_MATCHES matches. Either way the backend annotates the
+relevance of the matches on the product queryset, so results are paged by
+the database like any other listing.
+"""
+
+import bisect
+import re
+import threading
+import unicodedata
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, FloatField, OuterRef, Subquery, Value, When
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import Product, ProductSearchDocument
+from .utils import bulk_upsert
+
+TOKEN_RE = re.compile(r"\w+")
+
+# Relative weight of a match in the product name versus the other fields.
+TITLE_WEIGHT = 3.0
+BODY_WEIGHT = 1.0
+# A term matching only as the prefix of a word scores less than a full word.
+PREFIX_FACTOR = 0.5
+# Matches returned by the in-process backend, best first. Their ids are bound
+# a few times in the paged query, which must stay within SQLite's limit.
+MAX_MATCHES = 1000
+# Product fields read by build_document
+INDEXED_FIELDS = {
+    "product_name",
+    "description",
+    "upc",
+    "brand",
+    "category",
+    "subcategories",
+}
+
+
+def fold(text):
+    """Lowercase text and strip its accents ("Crème Brûlée" -> "creme brulee")."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(
+        char for char in decomposed if not unicodedata.combining(char)
+    ).lower()
+
+
+def tokenize(text):
+    """Split text into folded word tokens."""
+    return TOKEN_RE.findall(fold(text))
+
+
+def build_document(product):
+    """Return an unsaved ProductSearchDocument for a product."""
+    parts = [product.description, product.upc]
+    if product.brand_id:
+        parts.append(product.brand.name)
+    parts.append(product.category.name)
+    parts.extend(subcategory.name for subcategory in product.subcategories.all())
+    return ProductSearchDocument(
+        product=product,
+        title=" ".join(tokenize(product.product_name))[:255],
+        body=" ".join(tokenize(" ".join(part for part in parts if part))),
+    )
+
+
+class InMemorySearchBackend:
+    """
+    Inverted index mapping each token to the products containing it, with a
+    sorted token list for prefix lookups. Loaded lazily from the
+    ProductSearchDocument table and updated incrementally afterwards.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = None  # token -> {product_id: weight}
+        self._product_tokens = {}  # product_id -> tokens, to unindex it
+        self._tokens = []
+
+    def _ensure_loaded(self):
+        if self._postings is None:
+            self._postings = {}
+            for document in ProductSearchDocument.objects.iterator(chunk_size=2000):
+                self._add(document)
+
+    def _add(self, document):
+        weights = {}
+        for token in document.title.split():
+            weights[token] = weights.get(token, 0) + TITLE_WEIGHT
+        for token in document.body.split():
+            weights[token] = weights.get(token, 0) + BODY_WEIGHT
+        for token, weight in weights.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                bisect.insort(self._tokens, token)
+            postings[document.product_id] = weight
+        self._product_tokens[document.product_id] = list(weights)
+
+    def _remove(self, product_id):
+        for token in self._product_tokens.pop(product_id, ()):
+            postings = self._postings[token]
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[token]
+                del self._tokens[bisect.bisect_left(self._tokens, token)]
+
+    def update(self, documents, removed_ids):
+        with self._lock:
+            if self._postings is None:
+                return  # Loaded from the table on first search.
+            for document in documents:
+                self._remove(document.product_id)
+                self._add(document)
+            for product_id in removed_ids:
+                self._remove(product_id)
+
+    def _score_term(self, term):
+        """Score products for one query term, matched as a word or a prefix."""
+        scores = dict(self._postings.get(term, {}))
+        start = bisect.bisect_right(self._tokens, term)
+        for token in self._tokens[start:]:
+            if not token.startswith(term):
+                break
+            for product_id, weight in self._postings[token].items():
+                scores[product_id] = max(
+                    scores.get(product_id, 0), weight * PREFIX_FACTOR
+                )
+        return scores
+
+    def rank(self, terms):
+        with self._lock:
+            self._ensure_loaded()
+            scores = None
+            for term in terms:
+                term_scores = self._score_term(term)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    # Every term must match.
+                    scores = {
+                        product_id: score + term_scores[product_id]
+                        for product_id, score in scores.items()
+                        if product_id in term_scores
+                    }
+                if not scores:
+                    return []
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def search(self, queryset, terms):
+        # Only the best matches are kept, as each one is a bound parameter of
+        # the listing query; the rank has one CASE branch per distinct score.
+        ranked = self.rank(terms)[:MAX_MATCHES]
+        if not ranked:
+            return queryset.none()
+        ids_by_score = {}
+        for product_id, score in ranked:
+            ids_by_score.setdefault(score, []).append(product_id)
+        return queryset.filter(
+            pk__in=[product_id for product_id, _ in ranked]
+        ).annotate(
+            search_rank=Case(
+                *[
+                    When(pk__in=product_ids, then=Value(score))
+                    for score, product_ids in ids_by_score.items()
+                ],
+                output_field=FloatField(),
+            )
+        )
+
+
+class MySQLFullTextSearchBackend:
+    """
+    Boolean-mode MATCH ... AGAINST over the FULLTEXT indexes added by the
+    0002_productsearchdocument migration. InnoDB maintains the indexes itself.
+    """
+
+    # Words shorter than innodb_ft_min_token_size are not indexed, so they
+    # cannot be required.
+    min_token_size = 3
+
+    def update(self, documents, removed_ids):
+        pass
+
+    def search(self, queryset, terms):
+        # The rank is computed by the database for every match, so the
+        # pagination cursor can seek past any number of results.
+        boolean_query = " ".join(
+            f"+{term}*" if len(term) >= self.min_token_size else f"{term}*"
+            for term in terms
+        )
+        score = RawSQL(
+            f"{TITLE_WEIGHT} * MATCH (title) AGAINST (%s IN BOOLEAN MODE)"
+            " + MATCH (title, body) AGAINST (%s IN BOOLEAN MODE)",
+            (boolean_query, boolean_query),
+            output_field=FloatField(),
+        )
+        documents = ProductSearchDocument.objects.annotate(score=score).filter(
+            score__gt=0
+        )
+        return queryset.filter(pk__in=documents.values("product_id")).annotate(
+            search_rank=Subquery(
+                documents.filter(product_id=OuterRef("pk")).values("score")
+            )
+        )
+
+
+_backend = None
+
+
+def get_search_backend():
+    """
+    Return the configured backend (settings.PRODUCT_SEARCH_BACKEND), or the
+    FULLTEXT backend on MySQL and the in-process one elsewhere.
+    """
+    global _backend
+    if _backend is None:
+        backend_path = getattr(settings, "PRODUCT_SEARCH_BACKEND", None)
+        if backend_path:
+            _backend = import_string(backend_path)()
+        elif connection.vendor == "mysql":
+            _backend = MySQLFullTextSearchBackend()
+        else:
+            _backend = InMemorySearchBackend()
+    return _backend
+
+
+def index_products(product_ids):
+    """(Re)index the given products, dropping those that no longer exist."""
+    product_ids = set(product_ids)
+    products = (
+        Product.objects.filter(pk__in=product_ids)
+        .select_related("brand", "category")
+        .prefetch_related("subcategories")
+    )
+    documents = [build_document(product) for product in products]
+    removed_ids = product_ids - {document.product_id for document in documents}
+    if documents:
+        bulk_upsert(
+            ProductSearchDocument,
+            documents,
+            unique_fields=["product"],
+            update_fields=["title", "body"],
+        )
+    if removed_ids:
+        ProductSearchDocument.objects.filter(pk__in=removed_ids).delete()
+    get_search_backend().update(documents, removed_ids)
+
+
+def search_products(queryset, query):
+    """
+    Restrict a product queryset to the products matching `query` and annotate
+    their relevance as `search_rank`.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return queryset
+    return get_search_backend().search(queryset, terms)
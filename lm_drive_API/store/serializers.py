@@ -1,7 +1,66 @@
 import datetime
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
-from .models import Product, Category, SubCategory, Stock, Packaging, Brand
+from rest_framework.permissions import SAFE_METHODS
+from .images import IMAGE_FIELDS, current_variants, variant_urls
+from .models import Product, Category, SubCategory, Stock, Packaging, Brand, Store
+from .references import packaging_id, reference_id, reference_name
+from .repricing import KEEP, NEW_TVA, PENDING_ITEM_POLICIES, RULES
+
+
+def split_field_names(value):
+    return {name.strip() for name in value.split(",") if name.strip()}
+
+
+class SparseFieldsetMixin:
+    """
+    Let read requests choose the fields to render with `?fields=a,b` or
+    leave some out with `?omit=a,b`. Excluded fields are dropped before
+    serialization, so their methods and relations are never evaluated.
+    Only applies to the top-level serializer, not to nested ones.
+    """
+
+    # Keys added by to_representation rather than declared as fields
+    extra_field_names = ()
+
+    @classmethod
+    def get_requested_fields(cls, request):
+        """Return the names of the fields a request selects, or None for all."""
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        fields = request.query_params.get("fields", "")
+        omit = request.query_params.get("omit", "")
+        if not (fields or omit):
+            return None
+        available = set(cls.Meta.fields) | set(cls.extra_field_names)
+        if fields:
+            available &= split_field_names(fields)
+        return available - split_field_names(omit)
+
+    def is_top_level(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None
+
+    @property
+    def requested_fields(self):
+        if not self.is_top_level():
+            return None
+        return self.get_requested_fields(self.context.get("request"))
+
+    def is_field_requested(self, name):
+        requested = self.requested_fields
+        return requested is None or name in requested
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = self.requested_fields
+        if requested is not None:
+            for name in list(fields):
+                if name not in requested:
+                    fields.pop(name)
+        return fields
 
 
 class BaseCategorySerializer(serializers.ModelSerializer):
@@ -9,13 +68,16 @@ class BaseCategorySerializer(serializers.ModelSerializer):
         # Try handling category by id or name.
         category = self._get_category(data)
         if category:
-            return {"id": category.id, "name": category.name}
+            return category
         raise ValidationError(
             f"{self.Meta.model.__name__} must have either an 'id' or 'name'."
         )
 
     def _get_category(self, data):
-        """Helper method to fetch the category by either 'id' or 'name'."""
+        """
+        Helper method to resolve the category by either 'id' or 'name', from
+        the reference cache (see store.references).
+        """
         category_id = data.get("id")
         category_name = data.get("name")
 
@@ -26,22 +88,24 @@ class BaseCategorySerializer(serializers.ModelSerializer):
         return None
 
     def _get_category_by_id(self, category_id):
-        """Helper method to fetch category by ID."""
+        """Helper method to resolve category by ID."""
         try:
-            return self.Meta.model.objects.get(id=category_id)
-        except self.Meta.model.DoesNotExist:
+            name = reference_name(self.Meta.model, int(category_id))
+        except (TypeError, ValueError):
+            name = None
+        if name is None:
             raise ValidationError(
                 f"{self.Meta.model.__name__} with ID '{category_id}' does not exist."
             )
+        return {"id": int(category_id), "name": name}
 
     def _get_category_by_name(self, category_name):
-        """Helper method to fetch category by name."""
-        try:
-            return self.Meta.model.objects.get(name=category_name)
-        except self.Meta.model.DoesNotExist:
-            return super().to_internal_value(
-                {"name": category_name}
-            )  # Let base method handle it
+        """Helper method to resolve category by name."""
+        category_id = reference_id(self.Meta.model, category_name)
+        if category_id is None:
+            # Let base method validate the new name; it is created on save.
+            return {"id": None, **super().to_internal_value({"name": category_name})}
+        return {"id": category_id, "name": reference_name(self.Meta.model, category_id)}
 
 
 class CategorySerializer(BaseCategorySerializer):
@@ -57,9 +121,36 @@ class SubCategorySerializer(BaseCategorySerializer):
 
 
 class BrandSerializer(serializers.ModelSerializer):
+    logo_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Brand
-        fields = ["id", "name"]  # Fields you want to include in the API response
+        fields = [
+            "id",
+            "name",
+            "logo_variants",
+        ]  # Fields you want to include in the API response
+
+    def get_logo_variants(self, obj):
+        """URLs of the resized logos, by size then format."""
+        request = self.context.get("request")
+        return variant_urls(
+            current_variants(obj, "logo"),
+            request.build_absolute_uri if request else None,
+        )
+
+
+class BrandNameField(serializers.SlugRelatedField):
+    """Brand given by name, resolved from the reference cache."""
+
+    def __init__(self, **kwargs):
+        super().__init__(slug_field="name", queryset=Brand.objects.all(), **kwargs)
+
+    def to_internal_value(self, data):
+        brand_id = reference_id(Brand, str(data)) if data else None
+        if brand_id is None:
+            self.fail("does_not_exist", slug_name=self.slug_field, value=str(data))
+        return Brand(id=brand_id, name=reference_name(Brand, brand_id))
 
 
 class PackagingSerializer(serializers.ModelSerializer):
@@ -72,11 +163,8 @@ class PackagingSerializer(serializers.ModelSerializer):
         ]
 
 
-class ProductSerializer(serializers.ModelSerializer):
-    brand = serializers.SlugRelatedField(
-        queryset=Brand.objects.all(),
-        slug_field="name",
-    )
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    brand = BrandNameField()
     category = CategorySerializer()
     subcategories = SubCategorySerializer(many=True)
     stock_summary = serializers.SerializerMethodField()
@@ -85,6 +173,7 @@ class ProductSerializer(serializers.ModelSerializer):
     price_ttc = serializers.DecimalField(
         max_digits=10, decimal_places=2, read_only=True
     )
+    extra_field_names = ["image_urls", "image_variants"]
 
     class Meta:
         model = Product
@@ -122,28 +211,33 @@ class ProductSerializer(serializers.ModelSerializer):
             representation.pop("price_ttc", None)
 
         # Add absolute URLs for images
-        representation["image_urls"] = self.get_image_urls(instance)
+        if self.is_field_requested("image_urls"):
+            representation["image_urls"] = self.get_image_urls(instance)
+        if self.is_field_requested("image_variants"):
+            representation["image_variants"] = self.get_image_variants(instance)
 
         return representation
 
     def get_stock_summary(self, obj):
         """
         Retrieve the stock summary for a product.
+        Relies on the queryset from Product.objects.for_catalog() to avoid
+        per-product queries.
         """
         return obj.get_stock_summary()
 
     def get_stocks(self, obj):
         """
         Fetch stock information for the product in a simplified format.
+        Uses the prefetched stocks when available.
         """
-        stock_queryset = obj.stocks.select_related("store")
         return [
             {
-                "store": stock.store.store_id,
+                "store": stock.store_id,
                 "quantity": stock.quantity_in_stock,
                 "expiration_date": stock.expiration_date,
             }
-            for stock in stock_queryset
+            for stock in obj.stocks.all()
         ]
 
     def get_image_urls(self, obj):
@@ -161,6 +255,24 @@ class ProductSerializer(serializers.ModelSerializer):
                 image_urls["image3"] = request.build_absolute_uri(obj.image3.url)
         return image_urls
 
+    def get_image_variants(self, obj):
+        """
+        Generate absolute URLs for the resized product images, by image field,
+        size and format (see store.images).
+        """
+        request = self.context.get("request")
+        build_uri = request.build_absolute_uri if request else None
+        # Images replaced since their variants were built are left out.
+        variants = {
+            field_name: current_variants(obj, field_name)
+            for field_name in IMAGE_FIELDS["store.product"]
+        }
+        return {
+            field_name: variant_urls(entry, build_uri)
+            for field_name, entry in variants.items()
+            if entry is not None
+        }
+
     def create(self, validated_data):
         """
         Create a new product with nested relationships.
@@ -169,29 +281,18 @@ class ProductSerializer(serializers.ModelSerializer):
         category_data = validated_data.pop("category")
         subcategories_data = validated_data.pop("subcategories", [])
 
-        # Handle category
-        category, _ = Category.objects.get_or_create(name=category_data["name"])
-
-        # Handle subcategories
-        subcategory_objs = [
-            SubCategory.objects.get_or_create(name=data["name"])[0]
-            for data in subcategories_data
+        # Handle category, subcategories and packaging
+        category_id = self.resolve_category(Category, category_data)
+        subcategory_ids = [
+            self.resolve_category(SubCategory, data) for data in subcategories_data
         ]
-
-        # Handle packaging
-        packaging = None
-        if packaging_data:
-            packaging, _ = Packaging.objects.get_or_create(
-                packaging_quantity=packaging_data["packaging_quantity"],
-                packaging_value=packaging_data["packaging_value"],
-                packaging_type=packaging_data["packaging_type"],
-            )
+        packaging_id = self.resolve_packaging(packaging_data)
 
         # Create product
         product = Product.objects.create(
-            category=category, packaging=packaging, **validated_data
+            category_id=category_id, packaging_id=packaging_id, **validated_data
         )
-        product.subcategories.set(subcategory_objs)
+        product.subcategories.set(subcategory_ids)
 
         return product
 
@@ -205,25 +306,20 @@ class ProductSerializer(serializers.ModelSerializer):
 
         # Handle packaging
         if packaging_data:
-            packaging, _ = Packaging.objects.get_or_create(
-                packaging_quantity=packaging_data["packaging_quantity"],
-                packaging_value=packaging_data["packaging_value"],
-                packaging_type=packaging_data["packaging_type"],
-            )
-            instance.packaging = packaging
+            instance.packaging_id = self.resolve_packaging(packaging_data)
 
         # Handle category
         if category_data:
-            category, _ = Category.objects.get_or_create(name=category_data["name"])
-            instance.category = category
+            instance.category_id = self.resolve_category(Category, category_data)
 
         # Handle subcategories
         if subcategories_data:
-            subcategory_objs = [
-                SubCategory.objects.get_or_create(name=data["name"])[0]
-                for data in subcategories_data
-            ]
-            instance.subcategories.set(subcategory_objs)
+            instance.subcategories.set(
+                [
+                    self.resolve_category(SubCategory, data)
+                    for data in subcategories_data
+                ]
+            )
 
         # Update fields
         for key, value in validated_data.items():
@@ -232,6 +328,31 @@ class ProductSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
 
+    def resolve_category(self, model, data):
+        """Return the id of a validated category or subcategory, creating it."""
+        return data.get("id") or reference_id(model, data["name"], create=True)
+
+    def resolve_packaging(self, packaging):
+        """Return the id of the packaging, creating it; None without one."""
+        if not packaging:
+            return None
+        return packaging_id(packaging, create=True)
+
+
+class StoreSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Store
+        fields = [
+            "store_id",
+            "name",
+            "address",
+            "city",
+            "postal_code",
+            "phone_number",
+            "latitude",
+            "longitude",
+        ]
+
 
 class StockSerializer(serializers.ModelSerializer):
     store_name = serializers.CharField(source="store.name", read_only=True)
@@ -245,8 +366,11 @@ class StockSerializer(serializers.ModelSerializer):
             "product",
             "product_name",
             "quantity_in_stock",
+            "reserved_quantity",
+            "available_to_promise",
             "expiration_date",
         ]
+        read_only_fields = ["reserved_quantity", "available_to_promise"]
 
     def create(self, validated_data):
         """Create a new Stock instance."""
@@ -290,3 +414,30 @@ class StockSerializer(serializers.ModelSerializer):
         if value < 0:
             raise serializers.ValidationError("Quantity in stock cannot be negative.")
         return value
+
+
+class RepricingSerializer(serializers.Serializer):
+    """Input of a mass repricing, see store.repricing."""
+
+    rule = serializers.ChoiceField(choices=RULES)
+    value = serializers.DecimalField(max_digits=10, decimal_places=2)
+    category = serializers.CharField(required=False)
+    brand = serializers.CharField(required=False)
+    subcategory = serializers.CharField(required=False)
+    tva = serializers.DecimalField(max_digits=5, decimal_places=2, required=False)
+    pending_items = serializers.ChoiceField(choices=PENDING_ITEM_POLICIES, default=KEEP)
+    dry_run = serializers.BooleanField(default=True)
+
+    def validate(self, attrs):
+        if not any(
+            attrs.get(name) is not None
+            for name in ("category", "brand", "subcategory", "tva")
+        ):
+            raise serializers.ValidationError(
+                "Select the products by category, brand, subcategory or tva."
+            )
+        if attrs["rule"] == NEW_TVA and not (0 <= attrs["value"] <= 100):
+            raise serializers.ValidationError(
+                {"value": "TVA must be between 0 and 100."}
+            )
+        return attrs
@@ -0,0 +1,216 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+from . import search, suggest, sync
+from .cache import bump_catalog_version
+from .locator import bump_store_version
+from .references import bump_reference_version
+from .models import Brand, Category, Packaging, Product, Stock, Store, SubCategory
+
+# Sent with `product_ids` by code writing products in bulk (bulk_create,
+# update()), which bypasses the model signals handled below. An optional
+# `fields` lists the changed fields, when only some of them are written.
+products_bulk_changed = Signal()
+# Sent with `store_id` and `product_ids` by code writing the stocks of a store
+# in bulk.
+stocks_bulk_changed = Signal()
+
+# Product fields read by the typeahead suggestions (store.suggest)
+SUGGESTED_FIELDS = {"product_name", "is_for_sale", "brand", "category"}
+
+
+def reindex_on_commit(product_ids):
+    """Refresh the search index once the current transaction commits."""
+    product_ids = list(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: search.index_products(product_ids))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def reindex_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        reindex_on_commit([instance.pk])
+
+
+@receiver(m2m_changed, sender=Product.subcategories.through)
+def reindex_product_subcategories(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        reindex_on_commit([instance.pk])
+    elif pk_set:
+        reindex_on_commit(pk_set)
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=SubCategory)
+def reindex_related_products(sender, instance, created, raw=False, **kwargs):
+    """A renamed brand or category changes the text of all its products."""
+    if not (created or raw):
+        reindex_on_commit(instance.products.values_list("pk", flat=True))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=SubCategory)
+@receiver(post_delete, sender=SubCategory)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Packaging)
+@receiver(post_delete, sender=Packaging)
+@receiver(post_save, sender=Stock)
+@receiver(post_delete, sender=Stock)
+@receiver(post_save, sender=Store)
+@receiver(post_delete, sender=Store)
+@receiver(m2m_changed, sender=Product.subcategories.through)
+def bump_catalog_version_on_change(sender, raw=False, action=None, **kwargs):
+    """Invalidate cached catalog reads once the change is committed."""
+    if raw or (action is not None and not action.startswith("post_")):
+        return
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=SubCategory)
+@receiver(post_delete, sender=SubCategory)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Packaging)
+@receiver(post_delete, sender=Packaging)
+def bump_reference_version_on_change(sender, raw=False, **kwargs):
+    """Make every process reload its reference tables (see store.references)."""
+    if not raw:
+        transaction.on_commit(bump_reference_version)
+
+
+@receiver(post_save, sender=Store)
+@receiver(post_delete, sender=Store)
+def bump_store_version_on_change(sender, raw=False, **kwargs):
+    """Make every process rebuild its store index (see store.locator)."""
+    if not raw:
+        transaction.on_commit(bump_store_version)
+
+
+@receiver(post_save, sender=Stock)
+@receiver(post_delete, sender=Stock)
+def touch_stocked_product(sender, instance, raw=False, **kwargs):
+    """Stocks are part of the product representation (and its ETag)."""
+    if not raw:
+        Product.objects.filter(pk=instance.product_id).touch()
+
+
+@receiver(post_save, sender=Store)
+def touch_store_products(sender, instance, created, raw=False, **kwargs):
+    """
+    Products list the stores stocking them by name. A deleted store takes its
+    stocks along, which touches their products (touch_stocked_product).
+    """
+    if not (created or raw):
+        Product.objects.filter(
+            pk__in=Stock.objects.filter(store=instance).values("product_id")
+        ).touch()
+
+
+@receiver(m2m_changed, sender=Product.subcategories.through)
+def touch_product_subcategories(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        Product.objects.filter(pk=instance.pk).touch()
+    elif pk_set:
+        Product.objects.filter(pk__in=pk_set).touch()
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=SubCategory)
+@receiver(post_save, sender=Packaging)
+def touch_related_products(sender, instance, created, raw=False, **kwargs):
+    if not (created or raw):
+        instance.products.touch()
+
+
+@receiver(products_bulk_changed)
+def refresh_bulk_changed_products(sender, product_ids, fields=None, **kwargs):
+    if fields is None or set(fields) & search.INDEXED_FIELDS:
+        reindex_on_commit(product_ids)
+    if fields is None or set(fields) & SUGGESTED_FIELDS:
+        product_ids = list(product_ids)
+        transaction.on_commit(lambda: suggest.record_change(product_ids))
+    sync.log_changes(sync.Kind.PRODUCT, product_ids)
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def refresh_product_suggestions(sender, instance, raw=False, **kwargs):
+    if not raw:
+        product_ids = [instance.pk]
+        transaction.on_commit(lambda: suggest.record_change(product_ids))
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def rebuild_suggestions(sender, raw=False, **kwargs):
+    """Brand and category names are suggested, with their products' popularity."""
+    if not raw:
+        transaction.on_commit(suggest.record_change)
+
+
+@receiver(stocks_bulk_changed)
+def refresh_bulk_changed_stocks(sender, store_id, product_ids, **kwargs):
+    Product.objects.filter(pk__in=product_ids).touch()
+    sync.log_stocks(store_id, product_ids)
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=SubCategory)
+@receiver(post_delete, sender=SubCategory)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Packaging)
+@receiver(post_delete, sender=Packaging)
+@receiver(post_save, sender=Store)
+@receiver(post_delete, sender=Store)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Stock)
+@receiver(post_delete, sender=Stock)
+def log_catalog_change(sender, instance, raw=False, **kwargs):
+    """Feed the delta sync of offline clients (see store.sync)."""
+    if not raw:
+        sync.log_instance(instance)
+
+
+@receiver(m2m_changed, sender=Product.subcategories.through)
+def log_product_subcategories(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        sync.log_changes(sync.Kind.PRODUCT, [instance.pk])
+    elif pk_set:
+        sync.log_changes(sync.Kind.PRODUCT, pk_set)
+
+
+@receiver(pre_delete, sender=Brand)
+@receiver(pre_delete, sender=SubCategory)
+def log_unlinked_products(sender, instance, **kwargs):
+    """Deleting a brand or subcategory unlinks its products without signals."""
+    sync.log_changes(sync.Kind.PRODUCT, instance.products.values_list("pk", flat=True))
+
+
+@receiver(pre_delete, sender="orders.Order")
+def release_order_reservations(sender, instance, **kwargs):
+    """Give the stock reserved by a deleted order back before the cascade."""
+    from .reservations import release_reservations
+
+    release_reservations(instance.reservations.all())
@@ -0,0 +1,347 @@
+"""
+Typeahead suggestions.
+
+Each process keeps a sorted array of (key, kind, id) entries, where the keys
+are the accent-folded names of the products for sale, brands and categories,
+starting at each of their words ("buldak carbonara", "carbonara"), so that a
+prefix is answered by bisecting the array. Matches are ranked by popularity:
+quantities ordered for products, summed over their products for brands and
+categories. The few prefixes matching too many entries to rank on each
+keystroke ("b", "ra") keep their answer precomputed.
+
+The array is kept current through a suggest version in Django's shared cache.
+Committed product changes bump it and record the changed ids under the new
+version (see store.signals). The other processes replay those changes, reloading
+only the changed products, on their next lookup. Brand and category renames,
+missing change records and popularity drift (REBUILD_INTERVAL) trigger a full
+rebuild. Either way a new index replaces the old one, which is never modified,
+so lookups need no lock.
+"""
+
+import bisect
+import heapq
+import threading
+import time
+from operator import itemgetter
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db.models import Sum
+
+from .cache import bump_version, get_version
+from .models import Brand, Category, Product
+from .search import tokenize
+
+SUGGEST_VERSION_KEY = "store:suggest-version"
+CHANGE_KEY = "store:suggest-change:{}"
+CHANGE_TIMEOUT = 24 * 60 * 60
+# Larger gaps between the local and shared versions are rebuilt instead.
+MAX_REPLAYED_CHANGES = 100
+# Seconds after which popularity is refreshed by a full rebuild
+REBUILD_INTERVAL = 60 * 60
+MAX_SUGGESTIONS = 20
+# Prefixes matching more entries than this have their answer precomputed.
+PINNED_RANGE = 1000
+
+PRODUCT = "product"
+BRAND = "brand"
+CATEGORY = "category"
+
+
+def record_change(product_ids=None):
+    """
+    Publish changed products (None for a change needing a full rebuild, such
+    as a renamed brand) to every process. Call once the change is committed.
+    """
+    version = bump_version(SUGGEST_VERSION_KEY)
+    cache.set(
+        CHANGE_KEY.format(version),
+        None if product_ids is None else list(product_ids),
+        CHANGE_TIMEOUT,
+    )
+
+
+def entry_keys(name):
+    """Folded name starting at each of its words."""
+    words = tokenize(name)
+    return {" ".join(words[index:]) for index in range(len(words))}
+
+
+def replace_entries(entries, removed, added):
+    """
+    Return a sorted copy of `entries` without `removed` and with `added`,
+    copying the runs of unchanged entries between them as slices.
+    """
+    edits = [(bisect.bisect_left(entries, entry), 0, entry) for entry in added]
+    for entry in removed:
+        position = bisect.bisect_left(entries, entry)
+        if position < len(entries) and entries[position] == entry:
+            edits.append((position, 1, entry))
+    edits.sort()
+    result, start = [], 0
+    for position, remove, entry in edits:
+        result += entries[start:position]
+        if remove:
+            start = position + 1
+        else:
+            result.append(entry)
+            start = position
+    result += entries[start:]
+    return result
+
+
+def rank_key(kind, pk, name, popularity):
+    """Sort key of a suggestion: most popular first, then by name."""
+    return -popularity, name.casefold(), kind, pk
+
+
+class SuggestIndex:
+    def __init__(self, version=None, pinned_range=PINNED_RANGE):
+        self.version = version
+        self.pinned_range = pinned_range
+        self.built_at = time.monotonic()
+        self.entries = []  # sorted (key, kind, id)
+        self.labels = {}  # (kind, id) -> label
+        self.ranks = {}  # (kind, id) -> sort key, most popular first
+        self.pinned = {}  # prefix matching many entries -> its ranked answer
+
+    @classmethod
+    def build(cls, products, brands, categories, version=None, **kwargs):
+        """
+        Build an index from (product_id, name, brand_id, category_id,
+        popularity) rows for the products and {id: name} maps for the brands
+        and categories.
+        """
+        index = cls(version, **kwargs)
+        totals = {}
+        for product_id, name, brand_id, category_id, popularity in products:
+            index.labels[PRODUCT, product_id] = name
+            index.ranks[PRODUCT, product_id] = rank_key(
+                PRODUCT, product_id, name, popularity
+            )
+            for entry in ((BRAND, brand_id), (CATEGORY, category_id)):
+                totals[entry] = totals.get(entry, 0) + popularity
+            index.entries.extend((key, PRODUCT, product_id) for key in entry_keys(name))
+        for kind, names in ((BRAND, brands), (CATEGORY, categories)):
+            for pk, name in names.items():
+                index.labels[kind, pk] = name
+                index.ranks[kind, pk] = rank_key(
+                    kind, pk, name, totals.get((kind, pk), 0)
+                )
+                index.entries.extend((key, kind, pk) for key in entry_keys(name))
+        index.entries.sort()
+        index.pin()
+        return index
+
+    def span(self, prefix, low=0, high=None):
+        """Return the slice bounds of the entries whose key starts with `prefix`."""
+        high = len(self.entries) if high is None else high
+        start = bisect.bisect_left(self.entries, (prefix,), low, high)
+        # Every key starting with `prefix` sorts before prefix + U+10FFFF.
+        return start, bisect.bisect_left(
+            self.entries, (prefix + "\U0010ffff",), start, high
+        )
+
+    def rank(self, start, end):
+        """Return the MAX_SUGGESTIONS best (kind, id) of entries[start:end]."""
+        found = set(map(itemgetter(1, 2), self.entries[start:end]))
+        return heapq.nsmallest(MAX_SUGGESTIONS, found, key=self.ranks.__getitem__)
+
+    def pin(self):
+        """
+        Precompute the answers of the prefixes matching more than
+        `pinned_range` entries, so that no lookup ranks more than that. A
+        prefix can only be that broad if its own prefixes are, hence the walk
+        by length.
+        """
+        self.pinned = {}
+        spans, length = [(0, len(self.entries), None)], 1
+        while spans:
+            broad = []
+            for low, high, shorter in spans:
+                position = low
+                while position < high:
+                    key = self.entries[position][0]
+                    if len(key) < length:
+                        position += 1
+                        continue
+                    start, end = self.span(key[:length], position, high)
+                    if end - start > self.pinned_range:
+                        # Same entries as the shorter prefix: same answer
+                        answer = shorter if (start, end) == (low, high) else None
+                        if answer is None:
+                            answer = self.rank(start, end)
+                        self.pinned[key[:length]] = answer
+                        broad.append((start, end, answer))
+                    position = end
+            spans, length = broad, length + 1
+
+    def pinned_prefixes(self, name):
+        if name is None:
+            return set()
+        return {
+            key[:length]
+            for key in entry_keys(name)
+            for length in range(1, len(key) + 1)
+            if key[:length] in self.pinned
+        }
+
+    def update_products(self, rows, product_ids):
+        """
+        Return a copy of the index where the products `product_ids` are
+        replaced by `rows`, (product_id, name, popularity) of those still for
+        sale, with their pinned answers updated. The index itself is left
+        untouched for the lookups running meanwhile.
+        """
+        index = type(self)(self.version, self.pinned_range)
+        index.built_at = self.built_at
+        index.labels = dict(self.labels)
+        index.ranks = dict(self.ranks)
+        index.pinned = dict(self.pinned)
+        affected, removed, added = set(), [], []
+        for product_id in product_ids:
+            name = index.labels.pop((PRODUCT, product_id), None)
+            index.ranks.pop((PRODUCT, product_id), None)
+            if name is not None:
+                affected |= self.pinned_prefixes(name)
+                removed.extend((key, PRODUCT, product_id) for key in entry_keys(name))
+        for product_id, name, popularity in rows:
+            affected |= self.pinned_prefixes(name)
+            index.labels[PRODUCT, product_id] = name
+            index.ranks[PRODUCT, product_id] = rank_key(
+                PRODUCT, product_id, name, popularity
+            )
+            added.extend((key, PRODUCT, product_id) for key in entry_keys(name))
+        index.entries = replace_entries(self.entries, removed, added)
+        changed = {(PRODUCT, product_id) for product_id in product_ids}
+        for prefix in affected:
+            answer = index.pinned[prefix]
+            if changed.isdisjoint(answer):
+                # The unchanged answer still beats every other unchanged entry.
+                candidates = set(answer) | {
+                    entry
+                    for entry in changed
+                    if entry in index.labels
+                    and any(
+                        key.startswith(prefix)
+                        for key in entry_keys(index.labels[entry])
+                    )
+                }
+                index.pinned[prefix] = heapq.nsmallest(
+                    MAX_SUGGESTIONS, candidates, key=index.ranks.__getitem__
+                )
+            else:
+                index.pinned[prefix] = index.rank(*index.span(prefix))
+        return index
+
+    def suggest(self, query, limit=10):
+        """Return the `limit` most popular (kind, id, label) matching `query`."""
+        prefix = " ".join(tokenize(query))
+        if not prefix:
+            return []
+        if query[-1:].isspace():
+            # "buldak " only matches names with a word after "buldak".
+            prefix += " "
+        matches = self.pinned.get(prefix)
+        if matches is None:
+            matches = self.rank(*self.span(prefix))
+        return [
+            (kind, pk, self.labels.get((kind, pk), "")) for kind, pk in matches[:limit]
+        ]
+
+
+def product_popularity(product_ids=None):
+    """Return {product_id: quantity ordered}, optionally for some products."""
+    items = apps.get_model("orders", "OrderItem").objects.all()
+    if product_ids is not None:
+        items = items.filter(product_id__in=product_ids)
+    return dict(
+        items.order_by()
+        .values("product_id")
+        .annotate(total=Sum("quantity"))
+        .values_list("product_id", "total")
+    )
+
+
+def load_index(version):
+    popularity = product_popularity()
+    products = Product.objects.filter(is_for_sale=True).values_list(
+        "product_id", "product_name", "brand_id", "category_id"
+    )
+    return SuggestIndex.build(
+        (
+            (product_id, name, brand_id, category_id, popularity.get(product_id, 0))
+            for product_id, name, brand_id, category_id in products.iterator()
+        ),
+        dict(Brand.objects.values_list("id", "name")),
+        dict(Category.objects.values_list("id", "name")),
+        version,
+    )
+
+
+def replay_changes(index, version):
+    """
+    Return a copy of `index` with the changes published since it was built
+    applied, up to `version`, or None when they cannot be replayed and a
+    rebuild is needed.
+    """
+    if not (0 < version - index.version <= MAX_REPLAYED_CHANGES):
+        return None
+    keys = [
+        CHANGE_KEY.format(number) for number in range(index.version + 1, version + 1)
+    ]
+    changes = cache.get_many(keys)
+    if len(changes) != len(keys) or any(ids is None for ids in changes.values()):
+        return None
+    product_ids = {product_id for ids in changes.values() for product_id in ids}
+    popularity = product_popularity(product_ids)
+    rows = Product.objects.filter(pk__in=product_ids, is_for_sale=True).values_list(
+        "product_id", "product_name"
+    )
+    index = index.update_products(
+        [
+            (product_id, name, popularity.get(product_id, 0))
+            for product_id, name in rows
+        ],
+        product_ids,
+    )
+    index.version = version
+    return index
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_index():
+    """Return the SuggestIndex, brought up to the current suggest version."""
+    global _index
+    version = get_version(SUGGEST_VERSION_KEY)
+    index = _index
+    if (
+        index is not None
+        and index.version == version
+        and time.monotonic() - index.built_at < REBUILD_INTERVAL
+    ):
+        return index
+    with _lock:
+        index = _index
+        if index is None or time.monotonic() - index.built_at >= REBUILD_INTERVAL:
+            index = _index = load_index(version)
+        elif index.version != version:
+            index = _index = replay_changes(index, version) or load_index(version)
+    return index
+
+
+def clear():
+    """Drop the suggest index of this process."""
+    global _index
+    _index = None
+
+
+def suggest(query, limit=10):
+    """Return suggestions for `query` as dicts, most popular first."""
+    return [
+        {"type": kind, "id": pk, "label": label}
+        for kind, pk, label in get_index().suggest(query, limit)
+    ]
@@ -0,0 +1,276 @@
+"""
+Catalog snapshots and delta sync for offline clients (mobile app, in-store
+terminals).
+
+Every write to a synced row appends a CatalogChange naming it, in the same
+transaction (see store.signals), and the id of the latest change is the
+catalog version. Clients download a gzip-compressed JSONL snapshot tagged
+with the version it includes, then ask for the changes since their version:
+the rows named by the newer changes are read in their current state and sent
+as upserts, or as deletes when they no longer exist, so a row is sent once
+however often it changed in between.
+
+Change ids are allocated when a row is written but only become visible when
+its transaction commits, possibly after larger ids. The versions handed to
+clients therefore lag by VERSION_DELAY, like the stock snapshots of
+store.ledger, and the changes after them are sent again: applying a row
+twice is harmless. Snapshot rows are read after the version for the same
+reason, so no transaction spans the (long) export.
+"""
+
+import json
+import zlib
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Min
+from django.utils.timezone import now
+
+from .models import (
+    Brand,
+    CatalogChange,
+    Category,
+    Packaging,
+    Product,
+    Stock,
+    Store,
+    SubCategory,
+)
+
+# Transactions still running this long after writing a change may be missed.
+VERSION_DELAY = timedelta(seconds=5)
+CHANGES_PER_PAGE = 5000
+CHUNK_SIZE = 2000
+# Changes older than this are pruned, see prune_changes.
+CHANGE_RETENTION = timedelta(days=30)
+
+Kind = CatalogChange.Kind
+
+# Synced rows: model and fields of each kind, in dependency order
+MODELS = {
+    Kind.CATEGORY: Category,
+    Kind.SUBCATEGORY: SubCategory,
+    Kind.BRAND: Brand,
+    Kind.PACKAGING: Packaging,
+    Kind.STORE: Store,
+    Kind.PRODUCT: Product,
+    Kind.STOCK: Stock,
+}
+FIELDS = {
+    Kind.CATEGORY: ["id", "name"],
+    Kind.SUBCATEGORY: ["id", "name"],
+    Kind.BRAND: ["id", "name", "description", "logo"],
+    Kind.PACKAGING: ["id", "packaging_quantity", "packaging_value", "packaging_type"],
+    Kind.STORE: [
+        "store_id",
+        "name",
+        "address",
+        "city",
+        "postal_code",
+        "phone_number",
+        "latitude",
+        "longitude",
+    ],
+    Kind.PRODUCT: [
+        "product_id",
+        "product_name",
+        "upc",
+        "description",
+        "price_ht",
+        "tva",
+        "price_ttc",
+        "is_for_sale",
+        "brand_id",
+        "category_id",
+        "packaging_id",
+        "image1",
+        "image2",
+        "image3",
+        "update_date",
+    ],
+    # reserved_quantity is left out: reservations change it too often.
+    Kind.STOCK: ["store_id", "product_id", "quantity_in_stock", "expiration_date"],
+}
+KINDS = {model: kind for kind, model in MODELS.items()}
+
+
+class VersionExpired(Exception):
+    """The changes since a version are no longer (or not yet) available."""
+
+
+def log_instance(instance):
+    """Log a change of a synced model instance."""
+    if isinstance(instance, Stock):
+        log_stocks(instance.store_id, [instance.product_id])
+    else:
+        log_changes(KINDS[type(instance)], [instance.pk])
+
+
+def log_changes(kind, keys):
+    """Log changes of the rows of `kind` with the primary keys `keys`."""
+    CatalogChange.objects.bulk_create(
+        [CatalogChange(kind=kind, key=key) for key in keys], batch_size=CHUNK_SIZE
+    )
+
+
+def log_stocks(store_id, product_ids):
+    """Log changes of the stocks of some products of a store."""
+    CatalogChange.objects.bulk_create(
+        [
+            CatalogChange(kind=Kind.STOCK, key=product_id, store_key=store_id)
+            for product_id in product_ids
+        ],
+        batch_size=CHUNK_SIZE,
+    )
+
+
+def current_version():
+    """Return the catalog version handed to clients (see VERSION_DELAY)."""
+    return (
+        CatalogChange.objects.filter(created_at__lte=now() - VERSION_DELAY)
+        .order_by("-id")
+        .values_list("id", flat=True)
+        .first()
+        or 0
+    )
+
+
+def row_key(kind, row):
+    if kind == Kind.STOCK:
+        return row["store_id"], row["product_id"]
+    return str(row[FIELDS[kind][0]])
+
+
+def key_fields(kind, key):
+    """Return the fields identifying a deleted row."""
+    if kind == Kind.STOCK:
+        return {"store_id": key[0], "product_id": key[1]}
+    return {FIELDS[kind][0]: key}
+
+
+def read_rows(kind, keys=None):
+    """
+    Yield the rows of `kind` as dicts, all of them or those of `keys`
+    (primary keys, or (store_id, product_id) pairs for stocks).
+    """
+    model = MODELS[kind]
+    pk_name = model._meta.pk.name
+    if keys is None:
+        querysets = [model.objects.all()]
+    elif kind == Kind.STOCK:
+        by_store = defaultdict(list)
+        for store_id, product_id in keys:
+            by_store[store_id].append(product_id)
+        querysets = [
+            Stock.objects.filter(store_id=store_id, product_id__in=product_ids)
+            for store_id, product_ids in sorted(by_store.items())
+        ]
+    else:
+        querysets = [model.objects.filter(pk__in=keys)]
+    for queryset in querysets:
+        rows = queryset.order_by(pk_name).values(*FIELDS[kind])
+        if kind != Kind.PRODUCT:
+            for row in rows.iterator(chunk_size=CHUNK_SIZE):
+                yield {"type": kind, **row}
+            continue
+        # Products in chunks, each with the subcategory ids of its products
+        last = None
+        while True:
+            chunk = rows if last is None else rows.filter(pk__gt=last)
+            chunk = list(chunk[:CHUNK_SIZE])
+            if not chunk:
+                break
+            last = chunk[-1]["product_id"]
+            subcategories = defaultdict(list)
+            links = Product.subcategories.through.objects.filter(
+                product_id__in=[row["product_id"] for row in chunk]
+            ).order_by("subcategory_id")
+            for product_id, subcategory_id in links.values_list(
+                "product_id", "subcategory_id"
+            ):
+                subcategories[product_id].append(subcategory_id)
+            for row in chunk:
+                yield {
+                    "type": kind,
+                    **row,
+                    "subcategories": subcategories[row["product_id"]],
+                }
+
+
+def snapshot_rows(version):
+    """Yield a snapshot of the catalog at `version` (or later), header first."""
+    yield {"type": "snapshot", "version": version, "created_at": now()}
+    for kind in MODELS:
+        yield from read_rows(kind)
+
+
+def changes_since(since, limit=CHANGES_PER_PAGE):
+    """
+    Return the rows changed after version `since`, as a dict with the new
+    `version` of the client, the `upserts` and `deletes` rows, and whether
+    `more` changes remain. Raises VersionExpired when the changes since that
+    version were pruned, or when the version is unknown.
+    """
+    bounds = CatalogChange.objects.aggregate(first=Min("id"), last=Max("id"))
+    if since > (bounds["last"] or 0) or (
+        bounds["first"] is not None and since < bounds["first"] - 1
+    ):
+        raise VersionExpired(since)
+    changes = list(
+        CatalogChange.objects.filter(id__gt=since)
+        .order_by("id")
+        .values_list("id", "kind", "key", "store_key")[: limit + 1]
+    )
+    more = len(changes) > limit
+    changes = changes[:limit]
+    version = max(since, current_version())
+    if more:
+        version = min(version, changes[-1][0])
+        if version <= since:
+            version = changes[-1][0]
+
+    keys = defaultdict(set)
+    for _, kind, key, store_key in changes:
+        keys[kind].add((store_key, key) if kind == Kind.STOCK else key)
+    upserts, deletes = [], []
+    for kind in MODELS:
+        if kind not in keys:
+            continue
+        rows = list(read_rows(kind, keys[kind]))
+        upserts += rows
+        missing = keys[kind] - {row_key(kind, row) for row in rows}
+        deletes += [{"type": kind, **key_fields(kind, key)} for key in sorted(missing)]
+    # Dependent rows are deleted first.
+    deletes.reverse()
+    return {"version": version, "more": more, "upserts": upserts, "deletes": deletes}
+
+
+def prune_changes(retention=CHANGE_RETENTION):
+    """
+    Delete the changes older than `retention`, keeping the latest one so that
+    the current version stays known. Returns the number of deleted changes.
+    """
+    latest = CatalogChange.objects.aggregate(last=Max("id"))["last"]
+    if latest is None:
+        return 0
+    deleted, _ = CatalogChange.objects.filter(
+        id__lt=latest, created_at__lt=now() - retention
+    ).delete()
+    return deleted
+
+
+def json_lines(rows):
+    """Encode rows as JSON lines."""
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder, separators=(",", ":")) + "\n"
+
+
+def gzip_chunks(lines, level=6):
+    """Compress a stream of text lines into a stream of gzip bytes."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for line in lines:
+        chunk = compressor.compress(line.encode())
+        if chunk:
+            yield chunk
+    yield compressor.flush()
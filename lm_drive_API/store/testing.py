@@ -0,0 +1,52 @@
+"""
+Helpers shared by the tests of the store and orders apps.
+"""
+
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+
+from authentication.models import Customer
+
+from .models import Category, Product, Store
+
+
+class StoreTestMixin:
+    """
+    For TestCase classes: the customer, store and products most tests start
+    from, and the query budget of admin changelists.
+    """
+
+    def create_customer(self, username="johan"):
+        user = User.objects.create_user(username=username, password="azer1234")
+        return Customer.objects.create(user=user, email=f"{username}@gmail.com")
+
+    def create_store(self, store_id="S0"):
+        return Store.objects.create(store_id=store_id, name=f"Store {store_id[1:]}")
+
+    def create_product(
+        self,
+        product_id="P1",
+        product_name="Buldak",
+        price_ht=Decimal("2.00"),
+        tva=Decimal("5.50"),
+    ):
+        """Create a product of the "Ramen" category."""
+        category, _ = Category.objects.get_or_create(name="Ramen")
+        return Product.objects.create(
+            product_id=product_id,
+            product_name=product_name,
+            price_ht=price_ht,
+            tva=tva,
+            category=category,
+        )
+
+    def assertChangelistQueries(self, url, expected, create_rows):
+        """
+        The changelist runs `expected` queries, whatever its row count;
+        `create_rows(count)` brings it to `count` rows.
+        """
+        for rows in (2, 8):
+            create_rows(rows)
+            with self.assertNumQueries(expected):
+                self.assertEqual(self.client.get(url).status_code, 200)
@@ -1,3 +1,1422 @@
-from django.test import TestCase
+import datetime
+import gzip
+import io
+import json
+import math
+import random
+import shutil
+import tempfile
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from PIL import Image
+from rest_framework.test import APIClient
+from orders.models import Order, OrderItem
+from . import images, locator, references, search, suggest, sync
+from .importers import ProductImporter, read_csv, read_jsonl
+from .inventory import StockUpserter
+from .ledger import stock_as_of, take_snapshot
+from .serializers import ProductSerializer
+from .testing import StoreTestMixin
+from .utils import EstimatedCountPaginator
+from .views import ProductFilter
+from .repricing import (
+    ABSOLUTE,
+    KEEP,
+    NEW_TVA,
+    PERCENT,
+    UPDATE,
+    Repricing,
+    RepricingError,
+    select_products,
+)
+from .reservations import (
+    InsufficientStock,
+    commit_order_stock,
+    reserve_order,
+)
+from .models import (
+    Brand,
+    CatalogChange,
+    Category,
+    Packaging,
+    Product,
+    Stock,
+    StockMovement,
+    StockSnapshot,
+    Store,
+    SubCategory,
+)
 
-# Create your tests here.
+
+def create_catalog(count, stores):
+    """Create `count` products, each stocked in every store."""
+    category, _ = Category.objects.get_or_create(name="Ramen")
+    brand, _ = Brand.objects.get_or_create(name="Samyang")
+    subcategory, _ = SubCategory.objects.get_or_create(name="Spicy")
+    packaging, _ = Packaging.objects.get_or_create(
+        packaging_quantity=5, packaging_value="140g", packaging_type="weight"
+    )
+    start = Product.objects.count()
+    expiration_date = datetime.date.today() + datetime.timedelta(days=30)
+    for index in range(start, start + count):
+        product = Product.objects.create(
+            product_id=f"P{index:04d}",
+            product_name=f"Buldak {index}",
+            price_ht=Decimal("2.50"),
+            tva=Decimal("5.50"),
+            brand=brand,
+            category=category,
+            packaging=packaging,
+        )
+        product.subcategories.add(subcategory)
+        for store in stores:
+            Stock.objects.create(
+                store=store,
+                product=product,
+                quantity_in_stock=index + 1,
+                expiration_date=expiration_date,
+            )
+
+
+class ProductListQueryCountTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        self.stores = [self.create_store(f"S{index}") for index in range(3)]
+        self.client = APIClient()
+
+    def count_list_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/store/products/")
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_list_query_count_is_constant(self):
+        create_catalog(2, self.stores)
+        small_count, _ = self.count_list_queries()
+
+        create_catalog(8, self.stores)
+        large_count, response = self.count_list_queries()
+
+        self.assertEqual(small_count, large_count)
+        # ETag validators, products, prefetched subcategories and prefetched
+        # stocks with their stores
+        self.assertEqual(large_count, 4)
+        self.assertEqual(len(response.data["results"]), 10)
+
+    def test_stock_summary_uses_prefetched_stocks(self):
+        create_catalog(1, self.stores)
+        _, response = self.count_list_queries()
+        product = response.data["results"][0]
+        self.assertEqual(product["stock_summary"]["total_stock"], 3)
+        self.assertEqual(
+            sorted(detail["store"] for detail in product["stock_summary"]["details"]),
+            ["Store 0", "Store 1", "Store 2"],
+        )
+        self.assertEqual(len(product["stocks"]), 3)
+
+
+class ProductPaginationTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        create_catalog(5, [self.create_store()])
+        self.client = APIClient()
+
+    def test_cursor_pages_walk_the_catalog_in_order(self):
+        product_ids = []
+        url = "/api/store/products/?page_size=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            product_ids += [
+                product["product_id"] for product in response.data["results"]
+            ]
+            url = response.data["next"]
+        self.assertEqual(product_ids, [f"P{index:04d}" for index in range(5)])
+
+    def test_stream_is_reserved_to_staff(self):
+        response = self.client.get("/api/store/products/?stream=1")
+        self.assertEqual(response.status_code, 403)
+
+    def test_stream_returns_the_whole_catalog(self):
+        staff = User.objects.create_user(username="staff", password="x", is_staff=True)
+        self.client.force_authenticate(user=staff)
+        response = self.client.get("/api/store/products/?stream=1")
+        self.assertEqual(response.status_code, 200)
+        products = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(len(products), 5)
+        self.assertEqual(products[0]["stock_summary"]["total_stock"], 1)
+
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        search._backend = None  # Drop the in-process index of earlier tests
+        self.client = APIClient()
+        category = Category.objects.create(name="Desserts")
+        brand = Brand.objects.create(name="Bonne Maman")
+        with self.captureOnCommitCallbacks(execute=True):
+            for product_id, name, description in [
+                ("P1", "Crème brûlée", "Dessert à la vanille"),
+                ("P2", "Crêpes", "Crêpes au beurre, parfum crème"),
+                ("P3", "Madeleines", "Pur beurre"),
+            ]:
+                Product.objects.create(
+                    product_id=product_id,
+                    product_name=name,
+                    description=description,
+                    price_ht=Decimal("3.00"),
+                    tva=Decimal("5.50"),
+                    brand=brand,
+                    category=category,
+                )
+
+    def search(self, query):
+        response = self.client.get("/api/store/products/", {"q": query})
+        self.assertEqual(response.status_code, 200)
+        return [product["product_id"] for product in response.data["results"]]
+
+    def test_accents_are_folded_and_name_matches_rank_first(self):
+        self.assertEqual(self.search("creme"), ["P1", "P2"])
+
+    def test_prefix_and_all_terms_must_match(self):
+        self.assertEqual(self.search("beur"), ["P2", "P3"])
+        self.assertEqual(self.search("beurre madel"), ["P3"])
+        self.assertEqual(self.search("bonne maman vanille"), ["P1"])
+
+    def test_index_follows_product_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get(pk="P3").delete()
+            product = Product.objects.get(pk="P2")
+            product.product_name = "Gaufres"
+            product.save()
+        self.assertEqual(self.search("beurre"), ["P2"])
+        self.assertEqual(self.search("gaufre"), ["P2"])
+
+    def test_pagination_reaches_every_match(self):
+        category = Category.objects.get(name="Desserts")
+        Product.objects.bulk_create(
+            Product(
+                product_id=f"R{index:04d}",
+                product_name=f"Riz {index}" if index % 2 else f"Tarte {index}",
+                description="" if index % 2 else "au riz",
+                price_ht=Decimal("1.00"),
+                tva=Decimal("5.50"),
+                price_ttc=Decimal("1.06"),
+                category=category,
+            )
+            for index in range(600)
+        )
+        search.index_products(f"R{index:04d}" for index in range(600))
+
+        found = []
+        url = "/api/store/products/?q=riz&page_size=100"
+        while url:
+            response = self.client.get(url)
+            found += [product["product_id"] for product in response.data["results"]]
+            url = response.data["next"]
+        # Name matches first, each group by product_id
+        self.assertEqual(
+            found,
+            [f"R{index:04d}" for index in range(1, 600, 2)]
+            + [f"R{index:04d}" for index in range(0, 600, 2)],
+        )
+
+    def test_only_the_best_matches_are_ranked(self):
+        category = Category.objects.get(name="Desserts")
+        count = search.MAX_MATCHES + 200
+        Product.objects.bulk_create(
+            Product(
+                product_id=f"R{index:04d}",
+                product_name="Riz" if index % 2 else "Tarte",
+                description="" if index % 2 else "au riz",
+                price_ht=Decimal("1.00"),
+                tva=Decimal("5.50"),
+                price_ttc=Decimal("1.06"),
+                category=category,
+            )
+            for index in range(count)
+        )
+        search.index_products(f"R{index:04d}" for index in range(count))
+
+        products = search.search_products(Product.objects.all(), "riz")
+        # One branch per score, not per match
+        self.assertEqual(str(products.query).count(" WHEN "), 2)
+        ranks = list(products.values_list("search_rank", flat=True))
+        self.assertEqual(len(ranks), search.MAX_MATCHES)
+        self.assertEqual(ranks.count(search.TITLE_WEIGHT), count // 2)
+
+
+class ProductFacetsTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.store = self.create_store()
+        create_catalog(3, [self.store])
+        self.client = APIClient()
+
+    def test_facet_counts_and_cache_invalidation(self):
+        with self.assertNumQueries(5):
+            response = self.client.get("/api/store/products/facets/?brand=samyang")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["category"][0]["count"], 3)
+        self.assertEqual(response.data["subcategory"][0]["name"], "Spicy")
+        self.assertEqual(response.data["packaging_type"][0]["value"], "weight")
+        self.assertEqual(response.data["store"][0]["count"], 3)
+
+        # Equivalent filters are answered from the cache.
+        with self.assertNumQueries(0):
+            self.client.get("/api/store/products/facets/?brand=%20Samyang")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Stock.objects.filter(product_id="P0000").update(quantity_in_stock=0)
+            Product.objects.get(pk="P0001").save()
+        response = self.client.get("/api/store/products/facets/?brand=samyang")
+        self.assertEqual(response.data["store"][0]["count"], 2)
+
+
+class CatalogCacheTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        create_catalog(1, [self.create_store()])
+        self.client = APIClient()
+
+    def test_reads_are_cached_until_the_catalog_changes(self):
+        self.client.get("/api/store/products/P0000/")
+        # Only the ETag validators are read from the database.
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/store/products/P0000/")
+        self.assertEqual(response.data["product_name"], "Buldak 0")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Stock.objects.get(product_id="P0000").restock(4)
+        response = self.client.get("/api/store/products/P0000/")
+        self.assertEqual(response.data["stock_summary"]["total_stock"], 5)
+
+    def test_store_renames_reach_cached_products(self):
+        response = self.client.get("/api/store/products/P0000/")
+        etag = response.headers["ETag"]
+        store = Store.objects.get(pk="S0")
+        store.name = "Lille"
+        with self.captureOnCommitCallbacks(execute=True):
+            store.save()
+        response = self.client.get(
+            "/api/store/products/P0000/", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["stock_summary"]["details"][0]["store"], "Lille")
+
+    def test_anonymous_and_authenticated_users_do_not_share_entries(self):
+        response = self.client.get("/api/store/products/")
+        self.assertNotIn("price_ttc", response.data["results"][0])
+        user = User.objects.create_user(username="customer", password="x")
+        self.client.force_authenticate(user=user)
+        response = self.client.get("/api/store/products/")
+        self.assertIn("price_ttc", response.data["results"][0])
+
+
+class ProductConditionalGetTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        create_catalog(1, [self.create_store()])
+        self.client = APIClient()
+
+    def test_unchanged_product_is_answered_with_304(self):
+        response = self.client.get("/api/store/products/P0000/")
+        self.assertIn("Last-Modified", response.headers)
+        etag = response.headers["ETag"]
+
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                "/api/store/products/P0000/", HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+
+    def test_stock_change_modifies_the_product(self):
+        etag = self.client.get("/api/store/products/P0000/").headers["ETag"]
+        Stock.objects.get(product_id="P0000").restock(2)
+        response = self.client.get(
+            "/api/store/products/P0000/", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+
+class ProductSparseFieldsetTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        create_catalog(3, [self.create_store()])
+        self.client = APIClient()
+
+    def test_fields_selects_the_rendered_fields_and_skips_their_queries(self):
+        # ETag validators and products only: no stock or subcategory prefetch
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                "/api/store/products/", {"fields": "product_id,product_name,brand"}
+            )
+        self.assertEqual(
+            set(response.data["results"][0]), {"product_id", "product_name", "brand"}
+        )
+        self.assertEqual(response.data["results"][0]["brand"], "Samyang")
+
+    def test_image_variants_alone_load_the_images_with_the_products(self):
+        Product.objects.update(
+            image1="images/buldak.png",
+            image_variants={
+                "image1": {
+                    "source": "images/buldak.png",
+                    "thumb": {"webp": "variants/buldak.webp"},
+                }
+            },
+        )
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                "/api/store/products/", {"fields": "product_id,image_variants"}
+            )
+        self.assertEqual(len(response.data["results"]), 3)
+        self.assertTrue(
+            response.data["results"][0]["image_variants"]["image1"]["thumb"][
+                "webp"
+            ].endswith("/media/variants/buldak.webp")
+        )
+
+    def test_omit_leaves_fields_out(self):
+        response = self.client.get(
+            "/api/store/products/P0000/", {"omit": "stocks,stock_summary,image_urls"}
+        )
+        self.assertNotIn("stocks", response.data)
+        self.assertNotIn("image_urls", response.data)
+        self.assertEqual(response.data["category"], {"name": "Ramen"})
+
+
+class ProductStoreFilterTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.stores = [self.create_store(f"S{index}") for index in range(2)]
+        create_catalog(3, self.stores)
+        self.client = APIClient()
+
+    def test_store_filter_keeps_products_available_at_the_store(self):
+        Stock.objects.filter(store_id="S0", product_id="P0000").update(
+            quantity_in_stock=0
+        )
+        Stock.objects.filter(store_id="S0", product_id="P0001").update(
+            expiration_date=datetime.date.today() - datetime.timedelta(days=1)
+        )
+        response = self.client.get("/api/store/products/", {"store": "S0"})
+        self.assertEqual(
+            [product["product_id"] for product in response.data["results"]],
+            ["P0002"],
+        )
+        response = self.client.get("/api/store/products/", {"store": "S1"})
+        self.assertEqual(len(response.data["results"]), 3)
+
+
+IMPORT_CSV = """product_id,product_name,upc,price_ht,tva,brand,category,subcategories,packaging_quantity,packaging_value,packaging_type
+P0000,Buldak carbonara,111,3.00,20,Samyang,Ramen,Spicy|Creamy,5,140g,weight
+N0001,Shin ramyun,222,1.80,5.5,Nongshim,Ramen,Spicy,,,
+N0002,Bad price,333,-1,5.5,,Ramen,,,,
+N0003,Duplicated UPC,222,1.00,5.5,,Ramen,,,,
+"""
+
+
+class ProductImportTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        search._backend = None
+        create_catalog(1, [])
+        self.client = APIClient()
+
+    def test_csv_import_upserts_products_and_reports_errors(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            report = ProductImporter(batch_size=2).run(
+                read_csv(io.StringIO(IMPORT_CSV))
+            )
+
+        self.assertEqual((report.rows, report.created, report.updated), (4, 1, 1))
+        self.assertEqual([line for line, _ in report.errors], [4, 5])
+        product = Product.objects.get(pk="P0000")
+        self.assertEqual(product.product_name, "Buldak carbonara")
+        self.assertEqual(product.price_ttc, Decimal("3.60"))
+        self.assertEqual(
+            sorted(product.subcategories.values_list("name", flat=True)),
+            ["Creamy", "Spicy"],
+        )
+        shin = Product.objects.get(pk="N0001")
+        self.assertEqual(shin.brand.name, "Nongshim")
+        self.assertIsNone(shin.packaging)
+        # Imported products are searchable.
+        response = self.client.get("/api/store/products/", {"q": "carbonara"})
+        self.assertEqual(response.data["results"][0]["product_id"], "P0000")
+
+    def test_jsonl_import_reports_invalid_lines(self):
+        rows = read_jsonl(
+            io.StringIO(
+                '{"product_id": "J1", "product_name": "Kimchi", "price_ht": "4",'
+                ' "tva": "5.5", "category": "Ramen", "subcategories": ["Spicy"]}\n'
+                "not json\n"
+            )
+        )
+        report = ProductImporter().run(rows)
+        self.assertEqual(report.created, 1)
+        self.assertEqual(report.errors[0][0], 2)
+
+    def test_import_endpoint_is_reserved_to_staff(self):
+        upload = SimpleUploadedFile("catalog.csv", IMPORT_CSV.encode())
+        response = self.client.post("/api/store/products/import/", {"file": upload})
+        self.assertIn(response.status_code, (401, 403))
+
+        staff = User.objects.create_user(username="staff", password="x", is_staff=True)
+        self.client.force_authenticate(user=staff)
+        upload = SimpleUploadedFile("catalog.csv", IMPORT_CSV.encode())
+        response = self.client.post("/api/store/products/import/", {"file": upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["created"], 1)
+        self.assertEqual(response.data["error_count"], 2)
+
+
+class StockBulkUpsertTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.store = self.create_store()
+        create_catalog(3, [])
+        Stock.objects.create(store=self.store, product_id="P0000", quantity_in_stock=1)
+        self.client = APIClient()
+        staff = User.objects.create_user(username="staff", password="x", is_staff=True)
+        self.client.force_authenticate(user=staff)
+
+    def test_bulk_upsert_reports_each_row(self):
+        expiration_date = (
+            datetime.date.today() + datetime.timedelta(days=10)
+        ).isoformat()
+        rows = [
+            {"product_id": "P0000", "quantity_in_stock": 7},
+            {
+                "product_id": "P0001",
+                "quantity_in_stock": 3,
+                "expiration_date": expiration_date,
+            },
+            {"product_id": "P0002", "quantity_in_stock": -1},
+            {"product_id": "UNKNOWN", "quantity_in_stock": 1},
+            {
+                "product_id": "P0002",
+                "expiration_date": "2000-01-01",
+                "quantity_in_stock": 1,
+            },
+        ]
+        etag = self.client.get("/api/store/products/P0001/").headers["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/store/S0/stocks/bulk/", rows, format="json"
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            (
+                response.data["created"],
+                response.data["updated"],
+                response.data["errors"],
+            ),
+            (1, 1, 3),
+        )
+        self.assertEqual(response.data["results"][0], [1, "P0000", "updated"])
+        self.assertEqual(
+            response.data["results"][3][2:], ["error", "Product does not exist."]
+        )
+        self.assertEqual(Stock.objects.get(product_id="P0000").quantity_in_stock, 7)
+        self.assertEqual(
+            str(Stock.objects.get(product_id="P0001").expiration_date), expiration_date
+        )
+        # Bulk writes touch the products and invalidate the cached catalog.
+        response = self.client.get(
+            "/api/store/products/P0001/", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["stock_summary"]["total_stock"], 3)
+
+    def test_chunks_are_written_with_a_constant_number_of_queries(self):
+        rows = [
+            (index, {"product_id": f"P{index:04d}", "quantity_in_stock": index})
+            for index in range(3)
+        ]
+        # Products lookup, savepoint, locked existing stocks, upsert, journal,
+        # touch, catalog change log, savepoint release
+        with self.assertNumQueries(8):
+            report = StockUpserter(self.store).run(rows)
+        self.assertEqual(report.count("created"), 2)
+
+
+def make_image(size=(1600, 900), file_format="PNG", name="photo.png"):
+    content = io.BytesIO()
+    Image.new("RGBA", size, (200, 30, 30, 128)).save(content, file_format)
+    return SimpleUploadedFile(name, content.getvalue())
+
+
+class ImageVariantsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        create_catalog(1, [])
+        self.client = APIClient()
+
+    def test_variants_are_built_outside_the_request(self):
+        product = Product.objects.get(pk="P0000")
+        with self.captureOnCommitCallbacks(execute=True):
+            product.image1 = make_image()
+            product.save()
+        # Nothing is built on save, and no stale variant is listed meanwhile.
+        response = self.client.get("/api/store/products/P0000/")
+        self.assertEqual(response.data["image_variants"], {})
+        self.assertEqual(images.stale_fields(product), ["image1"])
+
+        call_command("generate_image_variants", "--since", "5", stdout=io.StringIO())
+        product.refresh_from_db()
+        variants = product.image_variants["image1"]
+        self.assertEqual(variants["source"], product.image1.name)
+        with default_storage.open(variants["card"]["webp"]) as variant:
+            self.assertEqual(Image.open(variant).size, (400, 225))
+        with default_storage.open(variants["thumb"]["jpeg"]) as variant:
+            self.assertEqual(Image.open(variant).mode, "RGB")
+
+        response = self.client.get("/api/store/products/P0000/")
+        self.assertTrue(
+            response.data["image_variants"]["image1"]["zoom"]["webp"].endswith(
+                "-zoom.webp"
+            )
+        )
+
+        # The variants now match the image: running again rebuilds nothing.
+        self.assertEqual(images.stale_fields(product), [])
+        output = io.StringIO()
+        call_command("generate_image_variants", stdout=output)
+        self.assertIn("up to date", output.getvalue())
+
+    def test_identical_images_share_their_variants(self):
+        first = images.build_variants(default_storage.save("a.png", make_image()))
+        second = images.build_variants(default_storage.save("b.png", make_image()))
+        self.assertEqual(first["thumb"], second["thumb"])
+        self.assertNotEqual(first["source"], second["source"])
+
+    def test_brand_logo_variants_are_exposed(self):
+        brand = Brand.objects.get(name="Samyang")
+        brand.logo = make_image((300, 300))
+        brand.save()
+        call_command("generate_image_variants", stdout=io.StringIO())
+        response = self.client.get("/api/store/brands/")
+        logo_variants = response.data[0]["logo_variants"]
+        self.assertEqual(set(logo_variants), {"thumb", "card", "zoom"})
+        self.assertEqual(set(logo_variants["thumb"]), {"webp", "jpeg"})
+
+
+class StockReservationTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        self.store = self.create_store()
+        create_catalog(2, [self.store])  # P0000: 1 in stock, P0001: 2
+        self.orders = [
+            Order.objects.create(
+                customer=self.create_customer(f"user{index}"), store=self.store
+            )
+            for index in range(2)
+        ]
+
+    def stock(self, product_id):
+        return Stock.objects.get(store=self.store, product_id=product_id)
+
+    def test_reservations_hold_stock_until_released(self):
+        first, second = self.orders
+        reserve_order(first, {"P0000": 1, "P0001": 1})
+        self.assertEqual(self.stock("P0001").available_to_promise, 1)
+
+        with self.assertRaises(InsufficientStock) as context:
+            reserve_order(second, {"P0000": 1, "P0001": 1})
+        self.assertEqual(context.exception.shortages, {"P0000": (1, 0)})
+        # All or nothing: P0001 was not reserved for the second order.
+        self.assertEqual(self.stock("P0001").reserved_quantity, 1)
+
+        # Lowering a quantity gives the difference back.
+        reserve_order(first, {"P0001": 1})
+        self.assertEqual(self.stock("P0000").reserved_quantity, 0)
+        reserve_order(second, {"P0000": 1})
+
+        second.delete()
+        self.assertEqual(self.stock("P0000").reserved_quantity, 0)
+
+    def test_stock_edits_keep_reservations_made_meanwhile(self):
+        stock = self.stock("P0001")
+        reserve_order(self.orders[0], {"P0001": 1})
+        stock.expiration_date += datetime.timedelta(days=1)
+        stock.save()
+        self.assertEqual(self.stock("P0001").reserved_quantity, 1)
+
+    def test_sweeper_releases_expired_reservations(self):
+        reserve_order(self.orders[0], {"P0001": 2})
+        self.orders[0].reservations.update(
+            expires_at=datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+        )
+        call_command("release_expired_reservations", stdout=io.StringIO())
+        self.assertEqual(self.stock("P0001").reserved_quantity, 0)
+        self.assertFalse(self.orders[0].reservations.exists())
+
+    def test_payment_turns_reservations_into_a_decrement(self):
+        from orders.models import OrderItem
+
+        order = self.orders[0]
+        OrderItem.objects.create(order=order, product_id="P0001", quantity=2)
+        reserve_order(order, {"P0001": 2})
+        commit_order_stock(order)
+        stock = self.stock("P0001")
+        self.assertEqual((stock.quantity_in_stock, stock.reserved_quantity), (0, 0))
+        self.assertFalse(order.reservations.exists())
+
+
+class StockDecrementBatchTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        self.store = self.create_store()
+        create_catalog(3, [self.store])  # 1, 2 and 3 in stock
+
+    def quantities(self):
+        return dict(
+            Stock.objects.order_by("product_id").values_list(
+                "product_id", "quantity_in_stock"
+            )
+        )
+
+    def test_every_shortage_is_reported_and_nothing_is_applied(self):
+        Stock.objects.filter(product_id="P0001").update(reserved_quantity=1)
+        with self.assertRaises(InsufficientStock) as context:
+            Stock.decrement_batch("S0", {"P0000": 2, "P0001": 2, "P0002": 1})
+        self.assertEqual(
+            context.exception.shortages, {"P0000": (2, 1), "P0001": (2, 1)}
+        )
+        self.assertEqual(self.quantities(), {"P0000": 1, "P0001": 2, "P0002": 3})
+
+    def test_batch_is_applied_with_one_lock_and_one_update(self):
+        Stock.objects.filter(product_id="P0001").update(reserved_quantity=2)
+        # Savepoint, ordered SELECT ... FOR UPDATE, UPDATE, journal, savepoint
+        # release
+        with self.assertNumQueries(5):
+            Stock.decrement_batch(
+                "S0", {"P0002": 3, "P0000": 1, "P0001": 2}, released={"P0001": 2}
+            )
+        self.assertEqual(self.quantities(), {"P0000": 0, "P0001": 0, "P0002": 0})
+        self.assertEqual(Stock.objects.get(product_id="P0001").reserved_quantity, 0)
+
+
+class StockLedgerTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        self.store = self.create_store()
+        create_catalog(2, [self.store])  # P0000: 1 in stock, P0001: 2
+        self.stock = Stock.objects.get(product_id="P0000")
+
+    def at(self, days):
+        return datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc) + (
+            datetime.timedelta(days=days)
+        )
+
+    def test_every_stock_change_is_journaled(self):
+        self.stock.restock(5, reference="delivery 42")
+        self.stock.adjust_stock(2)
+        Stock.decrement_batch("S0", {"P0000": 1, "P0001": 1}, reference="order 1")
+        self.stock.refresh_from_db()
+        self.stock.quantity_in_stock = 10
+        self.stock.save()
+
+        movements = StockMovement.objects.filter(product_id="P0000").order_by("id")
+        self.assertEqual(
+            list(movements.values_list("kind", "quantity", "reference")),
+            [
+                ("restock", 1, ""),
+                ("restock", 5, "delivery 42"),
+                ("sale", -2, ""),
+                ("sale", -1, "order 1"),
+                ("correction", 7, ""),
+            ],
+        )
+        self.assertEqual(stock_as_of("S0", now()), {"P0000": 10, "P0001": 1})
+
+    def test_saving_a_loaded_stock_keeps_the_changes_made_since(self):
+        stock = Stock.objects.get(product_id="P0001")  # 2 in stock
+        Stock.decrement_batch("S0", {"P0001": 1})
+        StockUpserter(self.store).run(
+            [(1, {"product_id": "P0001", "quantity_in_stock": 4})]
+        )
+        stock.restock(3)
+
+        stock = Stock.objects.get(product_id="P0001")
+        self.assertEqual(stock.quantity_in_stock, 7)
+        self.assertEqual(stock_as_of("S0", now())["P0001"], 7)
+        self.assertEqual(
+            list(
+                StockMovement.objects.filter(product_id="P0001")
+                .order_by("id")
+                .values_list("quantity", flat=True)
+            ),
+            [2, -1, 3, 3],
+        )
+
+    def test_as_of_and_report_start_from_the_latest_snapshot(self):
+        StockMovement.objects.all().delete()
+        StockMovement.objects.bulk_create(
+            [
+                StockMovement(
+                    store=self.store,
+                    product_id="P0000",
+                    kind=kind,
+                    quantity=quantity,
+                    created_at=self.at(day),
+                )
+                for day, kind, quantity in [
+                    (0, "restock", 10),
+                    (2, "sale", -3),
+                    (4, "restock", 5),
+                    (6, "expiry", -2),
+                ]
+            ]
+        )
+        Stock.objects.filter(product_id="P0000").update(quantity_in_stock=10)
+        # The first snapshot starts from the stocks minus the later movements.
+        take_snapshot("S0", taken_at=self.at(3))
+        self.assertEqual(StockSnapshot.objects.get(product_id="P0000").quantity, 7)
+        # Rows before the snapshot are not read any more.
+        StockMovement.objects.filter(created_at__lte=self.at(3)).delete()
+
+        self.assertEqual(stock_as_of("S0", self.at(5)), {"P0000": 12, "P0001": 2})
+        staff = User.objects.create_user(username="staff", is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(user=staff)
+        response = self.client.get(
+            "/api/store/S0/stocks/report/",
+            {"start": "2026-01-04T00:00Z", "end": "2026-01-10", "product": "P0000"},
+        )
+        self.assertEqual(
+            response.data["products"],
+            [
+                {
+                    "product_id": "P0000",
+                    "opening": 7,
+                    "movements": {"restock": 5, "expiry": -2},
+                    "closing": 10,
+                }
+            ],
+        )
+
+
+class ProductRepricingTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        search._backend = None
+        create_catalog(3, [])
+        Product.objects.filter(pk="P0002").update(tva=Decimal("20.00"))
+        self.client = APIClient()
+
+    def test_dry_run_reports_without_writing(self):
+        report = Repricing(PERCENT, Decimal("10")).run(
+            select_products(category="ramen"), dry_run=True
+        )
+        self.assertEqual((report["matched"], report["changed"]), (3, 3))
+        self.assertEqual(
+            report["changes"][0]["price_ht"], [Decimal("2.50"), Decimal("2.75")]
+        )
+        self.assertEqual(
+            report["price_ttc_after"], Decimal("2.90") * 2 + Decimal("3.30")
+        )
+        self.assertEqual(Product.objects.get(pk="P0000").price_ht, Decimal("2.50"))
+
+    def test_apply_matches_product_save_rounding(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            report = Repricing(NEW_TVA, Decimal("5.5")).run(
+                select_products(subcategory="SPICY", tva=Decimal("20.00"))
+            )
+        self.assertEqual(report["changed"], 1)
+        product = Product.objects.get(pk="P0002")
+        self.assertEqual(
+            (product.tva, product.price_ttc), (Decimal("5.50"), Decimal("2.64"))
+        )
+        # Saving the product recomputes the same price.
+        product.save()
+        product.refresh_from_db()
+        self.assertEqual(product.price_ttc, Decimal("2.64"))
+
+    def test_negative_price_rejects_the_whole_repricing(self):
+        with self.assertRaises(RepricingError):
+            Repricing(ABSOLUTE, Decimal("-3")).run(select_products(brand="samyang"))
+        self.assertEqual(Product.objects.filter(price_ht=Decimal("2.50")).count(), 3)
+
+    def test_invalid_price_in_a_later_chunk_rejects_the_earlier_ones(self):
+        Product.objects.exclude(pk="P0002").update(price_ht=Decimal("5.00"))
+        with self.assertRaises(RepricingError):
+            Repricing(ABSOLUTE, Decimal("-3"), batch_size=1).run(
+                select_products(brand="samyang")
+            )
+        self.assertEqual(Product.objects.filter(price_ht=Decimal("5.00")).count(), 2)
+
+    def test_pending_order_items_follow_the_new_prices(self):
+        customer = self.create_customer()
+        store = self.create_store()
+        pending = Order.objects.create(customer=customer, store=store)
+        confirmed = Order.objects.create(customer=customer, store=store)
+        for order in (pending, confirmed):
+            OrderItem.objects.create(
+                order=order, product=Product.objects.get(pk="P0000"), quantity=2
+            )
+        Order.objects.filter(pk=confirmed.pk).update(status="confirmed")
+
+        report = Repricing(ABSOLUTE, Decimal("0.50"), pending_items=UPDATE).run(
+            select_products(category="Ramen", tva=Decimal("5.50"))
+        )
+
+        self.assertEqual(report["pending_items_updated"], 1)
+        pending.refresh_from_db()
+        confirmed.refresh_from_db()
+        self.assertEqual(
+            (pending.total_ht, pending.total_ttc), (Decimal("6.00"), Decimal("6.32"))
+        )
+        self.assertEqual(confirmed.total_ht, Decimal("5.00"))
+
+    def test_kept_pending_items_keep_their_price_when_edited(self):
+        customer = self.create_customer()
+        store = self.create_store()
+        order = Order.objects.create(customer=customer, store=store)
+        item = OrderItem.objects.create(order=order, product_id="P0000", quantity=2)
+
+        Repricing(ABSOLUTE, Decimal("0.50"), pending_items=KEEP).run(
+            select_products(category="Ramen")
+        )
+        item = OrderItem.objects.get(pk=item.pk)
+        item.quantity = 3
+        item.save()
+
+        item.refresh_from_db()
+        self.assertEqual(
+            (item.price_ht, item.total_ht), (Decimal("2.50"), Decimal("7.50"))
+        )
+        self.assertEqual(Order.objects.get(pk=order.pk).total_ht, Decimal("7.50"))
+        # Another product is priced anew.
+        item.product_id = "P0001"
+        item.save()
+        self.assertEqual(item.price_ht, Decimal("3.00"))
+
+    def test_reprice_endpoint_is_reserved_to_staff(self):
+        data = {"rule": "percent", "value": "10", "brand": "Samyang"}
+        response = self.client.post("/api/store/products/reprice/", data, format="json")
+        self.assertIn(response.status_code, (401, 403))
+
+        staff = User.objects.create_user(username="staff", password="x", is_staff=True)
+        self.client.force_authenticate(user=staff)
+        response = self.client.post(
+            "/api/store/products/reprice/",
+            {"rule": "percent", "value": "10"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            "/api/store/products/reprice/", dict(data, dry_run=False), format="json"
+        )
+        self.assertEqual(response.data["changed"], 3)
+        self.assertEqual(Product.objects.get(pk="P0001").price_ht, Decimal("2.75"))
+
+
+class ProductSubcategoryFilterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        search._backend = None
+        create_catalog(3, [])
+        creamy = SubCategory.objects.create(name="Creamy")
+        soup = SubCategory.objects.create(name="Soup")
+        for pk in ("P0000", "P0001"):
+            Product.objects.get(pk=pk).subcategories.add(creamy)
+        Product.objects.get(pk="P0002").subcategories.add(soup)
+        self.client = APIClient()
+
+    def product_ids(self, **params):
+        response = self.client.get("/api/store/products/", params)
+        self.assertEqual(response.status_code, 200)
+        return [product["product_id"] for product in response.data["results"]]
+
+    def test_products_must_have_every_subcategory(self):
+        self.assertEqual(
+            self.product_ids(subcategories="spicy, CREAMY"), ["P0000", "P0001"]
+        )
+        self.assertEqual(self.product_ids(subcategories="Creamy,Unknown"), [])
+        # Names are matched exactly.
+        self.assertEqual(self.product_ids(subcategories="Cream"), [])
+
+    def test_products_may_have_any_subcategory(self):
+        self.assertEqual(
+            self.product_ids(
+                subcategories="soup,creamy,unknown", subcategories_match="any"
+            ),
+            ["P0000", "P0001", "P0002"],
+        )
+        self.assertEqual(
+            self.product_ids(subcategories="unknown", subcategories_match="any"), []
+        )
+
+    def test_filter_is_a_single_semi_join(self):
+        ids = SubCategory.objects.values_list("pk", flat=True)
+        queryset = Product.objects.in_subcategories(ids)
+        self.assertEqual(list(queryset), [])
+        sql = str(queryset.query)
+        self.assertNotIn("DISTINCT", sql)
+        self.assertEqual(sql.count("JOIN"), 0)
+
+    def test_subcategory_lookup_follows_renames(self):
+        self.assertEqual(self.product_ids(subcategories="soup"), ["P0002"])
+        with self.captureOnCommitCallbacks(execute=True):
+            soup = SubCategory.objects.get(name="Soup")
+            soup.name = "Broth"
+            soup.save()
+        self.assertEqual(self.product_ids(subcategories="broth"), ["P0002"])
+
+    def test_former_subcategory_parameter_matches_part_of_the_name(self):
+        self.assertEqual(self.product_ids(subcategory="REAM"), ["P0000", "P0001"])
+        self.assertEqual(self.product_ids(subcategory="unknown"), [])
+        queryset = ProductFilter(
+            {"subcategory": "ou"}, queryset=Product.objects.all()
+        ).qs
+        self.assertEqual([product.pk for product in queryset], ["P0002"])
+        self.assertNotIn("DISTINCT", str(queryset.query))
+
+
+class ReferenceCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        search._backend = None
+        references.clear()
+        create_catalog(1, [])
+
+    def test_lookups_are_served_from_memory(self):
+        spicy = SubCategory.objects.get(name="Spicy")
+        self.assertEqual(references.reference_id(SubCategory, "SPICY"), spicy.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(references.reference_name(SubCategory, spicy.pk), "Spicy")
+            self.assertIsNone(references.reference_id(Brand, "Nongshim"))
+            self.assertIsNotNone(
+                references.packaging_id(
+                    {
+                        "packaging_quantity": 5,
+                        "packaging_value": "140g",
+                        "packaging_type": "weight",
+                    }
+                )
+            )
+
+    def test_committed_writes_invalidate_every_process(self):
+        self.assertIsNone(references.reference_id(Category, "Soup"))
+        with self.captureOnCommitCallbacks(execute=True):
+            soup = Category.objects.create(name="Soup")
+        self.assertEqual(references.reference_id(Category, "soup"), soup.pk)
+        # A write made by another process only bumps the shared version.
+        Category.objects.filter(pk=soup.pk).update(name="Broth")
+        references.bump_reference_version()
+        self.assertIsNone(references.reference_id(Category, "Soup"))
+        self.assertEqual(references.reference_id(Category, "Broth"), soup.pk)
+
+    def test_tables_missing_a_bump_are_reloaded_after_their_ttl(self):
+        self.assertIsNone(references.reference_id(Category, "Soup"))
+        # Created by a process whose bump never reached the shared cache
+        soup = Category.objects.create(name="Soup")
+        self.assertIsNone(references.reference_id(Category, "Soup"))
+        references.get_tables().loaded_at -= references.REFERENCE_TTL
+        self.assertEqual(references.reference_name(Category, soup.pk), "Soup")
+
+    def test_product_writes_create_missing_references_once(self):
+        data = {
+            "product_id": "N0001",
+            "product_name": "Shin ramyun",
+            "price_ht": "1.50",
+            "tva": "5.50",
+            "brand": "Samyang",
+            "category": {"name": "Ramen"},
+            "subcategories": [{"name": "spicy"}, {"name": "Soup"}],
+            "packaging": {
+                "packaging_quantity": 5,
+                "packaging_value": "120g",
+                "packaging_type": "weight",
+            },
+        }
+        serializer = ProductSerializer(data=data)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with self.captureOnCommitCallbacks(execute=True):
+            product = serializer.save()
+        self.assertEqual(product.category.name, "Ramen")
+        self.assertEqual(
+            sorted(product.subcategories.values_list("name", flat=True)),
+            ["Soup", "Spicy"],
+        )
+        self.assertEqual(product.packaging.packaging_value, "120g")
+        self.assertEqual(
+            references.reference_id(SubCategory, "soup"),
+            SubCategory.objects.get(name="Soup").pk,
+        )
+
+        serializer = ProductSerializer(data=dict(data, brand="Unknown"))
+        self.assertFalse(serializer.is_valid())
+        self.assertIn("brand", serializer.errors)
+
+
+class AdminQueryBudgetTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        search._backend = None
+        self.stores = [self.create_store(f"S{index}") for index in range(2)]
+        admin = User.objects.create_superuser(username="admin", password="x")
+        self.client.force_login(admin)
+
+    def create_rows(self, count):
+        create_catalog(count - Product.objects.count(), self.stores)
+
+    def test_product_changelist(self):
+        # Session, user, count, products with their stock totals, then the
+        # brand, category and subcategory filters
+        self.assertChangelistQueries("/admin/store/product/", 7, self.create_rows)
+
+    def test_stock_changelist(self):
+        # Session, user, count, stocks, then the store, brand, category and
+        # subcategory filters
+        self.assertChangelistQueries("/admin/store/stock/", 8, self.create_rows)
+
+    def test_filtered_count_is_capped(self):
+        create_catalog(5, [])
+        queryset = Product.objects.filter(product_name__startswith="Buldak")
+        paginator = EstimatedCountPaginator(queryset.order_by("pk"), 2)
+        paginator.count_limit = 3
+        self.assertEqual(paginator.count, 3)
+        self.assertEqual(
+            EstimatedCountPaginator(Product.objects.order_by("pk"), 2).count, 5
+        )
+
+
+class NearestStoreTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        search._backend = None
+        locator.clear()
+        self.paris = Store.objects.create(
+            store_id="PAR",
+            name="Paris",
+            postal_code="75001",
+            latitude=Decimal("48.8566"),
+            longitude=Decimal("2.3522"),
+        )
+        self.lyon = Store.objects.create(
+            store_id="LYO",
+            name="Lyon",
+            postal_code="69001",
+            latitude=Decimal("45.7640"),
+            longitude=Decimal("4.8357"),
+        )
+        Store.objects.create(
+            store_id="MRS",
+            name="Marseille",
+            postal_code="13001",
+            latitude=Decimal("43.2965"),
+            longitude=Decimal("5.3698"),
+        )
+        Store.objects.create(store_id="NOW", name="Nowhere")
+        self.client = APIClient()
+
+    def nearest(self, **params):
+        response = self.client.get("/api/store/stores/nearest/", params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data["results"]
+
+    def test_kd_tree_matches_brute_force(self):
+        rng = random.Random(0)
+        points = [
+            (locator.to_point(rng.uniform(-90, 90), rng.uniform(-180, 180)), index)
+            for index in range(300)
+        ]
+        tree = locator.KDTree(points)
+        for _ in range(20):
+            target = locator.to_point(rng.uniform(-90, 90), rng.uniform(-180, 180))
+            expected = sorted(points, key=lambda entry: math.dist(entry[0], target))
+            self.assertEqual(
+                [item for _, item in tree.nearest(target, 7)],
+                [item for _, item in expected[:7]],
+            )
+
+    def test_nearest_to_coordinates_and_postal_code(self):
+        results = self.nearest(lat="45.75", lon="4.85", k="2")
+        self.assertEqual([store["store_id"] for store in results], ["LYO", "MRS"])
+        self.assertAlmostEqual(results[0]["distance_km"], 1.9, delta=0.5)
+        # Located from the stores of the same département
+        results = self.nearest(postal_code="75011", k="1")
+        self.assertEqual(results[0]["store_id"], "PAR")
+        response = self.client.get(
+            "/api/store/stores/nearest/", {"lat": "91", "lon": "0"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_basket_availability(self):
+        create_catalog(2, [self.lyon])
+        Stock.objects.create(store=self.paris, product_id="P0000", quantity_in_stock=1)
+        results = self.nearest(lat="48.85", lon="2.35", k="2", basket="P0000,P0001:2")
+        self.assertEqual(
+            [(store["store_id"], store["basket"]) for store in results],
+            [
+                ("PAR", {"complete": False, "missing": {"P0001": 2}}),
+                ("LYO", {"complete": True, "missing": {}}),
+            ],
+        )
+        results = self.nearest(
+            lat="48.85", lon="2.35", k="1", basket="P0001:2", available_only="true"
+        )
+        self.assertEqual([store["store_id"] for store in results], ["LYO"])
+
+    def test_index_follows_store_changes(self):
+        self.assertEqual(
+            self.nearest(lat="50.63", lon="3.06", k="1")[0]["store_id"], "PAR"
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            Store.objects.create(
+                store_id="LIL",
+                name="Lille",
+                latitude=Decimal("50.6292"),
+                longitude=Decimal("3.0573"),
+            )
+        self.assertEqual(
+            self.nearest(lat="50.63", lon="3.06", k="1")[0]["store_id"], "LIL"
+        )
+
+    def test_index_missing_a_bump_is_rebuilt_after_its_interval(self):
+        self.nearest(lat="50.63", lon="3.06", k="1")
+        # Created by a process whose bump never reached the shared cache
+        Store.objects.create(
+            store_id="LIL",
+            name="Lille",
+            latitude=Decimal("50.6292"),
+            longitude=Decimal("3.0573"),
+        )
+        self.assertEqual(
+            self.nearest(lat="50.63", lon="3.06", k="1")[0]["store_id"], "PAR"
+        )
+        locator.get_index().built_at -= locator.REBUILD_INTERVAL
+        self.assertEqual(
+            self.nearest(lat="50.63", lon="3.06", k="1")[0]["store_id"], "LIL"
+        )
+
+
+class ProductSuggestTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        search._backend = None
+        suggest.clear()
+        create_catalog(3, [])
+        order = Order.objects.create(
+            customer=self.create_customer(), store=self.create_store()
+        )
+        OrderItem.objects.create(order=order, product_id="P0002", quantity=5)
+        OrderItem.objects.create(order=order, product_id="P0001", quantity=1)
+        self.client = APIClient()
+
+    def suggestions(self, query, **params):
+        response = self.client.get(
+            "/api/store/products/suggest/", {"q": query, **params}
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        return [(entry["type"], entry["id"]) for entry in response.data["suggestions"]]
+
+    def test_prefix_matches_ranked_by_popularity(self):
+        self.assertEqual(
+            self.suggestions("BUL"),
+            [("product", "P0002"), ("product", "P0001"), ("product", "P0000")],
+        )
+        self.assertEqual(self.suggestions("bul", limit="1"), [("product", "P0002")])
+        # Any word of the name, brands and categories included
+        self.assertEqual(self.suggestions("1"), [("product", "P0001")])
+        brand = Brand.objects.get(name="Samyang")
+        self.assertEqual(self.suggestions("samy"), [("brand", brand.pk)])
+        self.assertEqual(self.suggestions("ramen")[0][0], "category")
+        self.assertEqual(self.suggestions("buldak "), self.suggestions("bul")[:3])
+        self.assertEqual(self.suggestions("buldak 1 "), [])
+        self.assertEqual(self.suggestions(""), [])
+
+    def test_pinned_answers_follow_updates(self):
+        rng = random.Random(0)
+        words = ["buldak", "bulgogi", "carbonara", "cheese", "curry", "kimchi"]
+
+        def row(number):
+            return (
+                f"P{number:03d}",
+                " ".join(rng.choices(words, k=3)),
+                rng.randrange(20),
+            )
+
+        rows = [row(number) for number in range(200)]
+        index = suggest.SuggestIndex.build(
+            ((pk, name, 1, 1, popularity) for pk, name, popularity in rows),
+            {1: "Samyang"},
+            {1: "Ramen"},
+            pinned_range=20,
+        )
+        self.assertTrue(index.pinned)
+        original = index
+        entries, pinned = list(index.entries), dict(index.pinned)
+        for _ in range(30):
+            numbers = rng.sample(range(200), 3)
+            # One of them leaves the catalog.
+            index = index.update_products(
+                [row(number) for number in numbers[1:]],
+                [f"P{number:03d}" for number in numbers],
+            )
+        # Lookups running during an update keep a consistent index.
+        self.assertEqual((original.entries, original.pinned), (entries, pinned))
+        self.assertEqual(
+            [entry for entry in index.entries if entry[1] == "product"],
+            sorted(
+                (key, "product", pk)
+                for (kind, pk), name in index.labels.items()
+                if kind == "product"
+                for key in suggest.entry_keys(name)
+            ),
+        )
+        for prefix, answer in index.pinned.items():
+            self.assertEqual(answer, index.rank(*index.span(prefix)), prefix)
+
+    def test_index_replays_product_changes(self):
+        self.assertEqual(len(self.suggestions("bul")), 3)
+        index = suggest.get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk="P0001").update(product_name="Carbonara 1")
+            Product.objects.get(pk="P0001").save()
+            product = Product.objects.get(pk="P0000")
+            product.is_for_sale = False
+            product.save()
+        self.assertEqual(self.suggestions("bul"), [("product", "P0002")])
+        self.assertEqual(self.suggestions("carbo"), [("product", "P0001")])
+        # Replayed into a copy of the index rather than rebuilt
+        self.assertIsNot(suggest.get_index(), index)
+        self.assertEqual(suggest.get_index().built_at, index.built_at)
+
+    def test_brand_rename_rebuilds_the_index(self):
+        brand = Brand.objects.get(name="Samyang")
+        self.assertEqual(self.suggestions("samy"), [("brand", brand.pk)])
+        index = suggest.get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            brand.name = "Nongshim"
+            brand.save()
+        self.assertEqual(self.suggestions("samy"), [])
+        self.assertEqual(self.suggestions("nong"), [("brand", brand.pk)])
+        self.assertIsNot(suggest.get_index(), index)
+
+
+class CatalogSyncTest(StoreTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        search._backend = None
+        self.store = self.create_store()
+        create_catalog(2, [self.store])
+        self.client = APIClient()
+        user = User.objects.create_user(username="terminal", password="x")
+        self.client.force_authenticate(user=user)
+
+    def settle(self):
+        """Age the logged changes past the version delay."""
+        CatalogChange.objects.update(
+            created_at=now() - sync.VERSION_DELAY - datetime.timedelta(seconds=1)
+        )
+        return CatalogChange.objects.latest("id").id
+
+    def changes(self, since):
+        response = self.client.get("/api/store/catalog/changes/", {"since": since})
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_snapshot_holds_every_row(self):
+        version = self.settle()
+        response = self.client.get("/api/store/catalog/snapshot/")
+        self.assertEqual(response.status_code, 200)
+        lines = gzip.decompress(b"".join(response.streaming_content)).splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(rows[0]["type"], "snapshot")
+        self.assertEqual(rows[0]["version"], version)
+        kinds = [row["type"] for row in rows[1:]]
+        self.assertEqual(
+            kinds,
+            ["category", "subcategory", "brand", "packaging", "store"]
+            + ["product"] * 2
+            + ["stock"] * 2,
+        )
+        product = rows[6]
+        self.assertEqual(product["product_id"], "P0000")
+        self.assertEqual(product["price_ttc"], "2.64")
+        self.assertEqual(product["subcategories"], [rows[2]["id"]])
+
+        response = self.client.get(
+            "/api/store/catalog/snapshot/", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes_since_a_version(self):
+        version = self.settle()
+        product = Product.objects.get(pk="P0000")
+        product.product_name = "Carbonara"
+        product.save()
+        product.save()
+        Product.objects.get(pk="P0001").delete()
+
+        data = self.changes(version)
+        self.assertEqual(
+            [(row["type"], row.get("product_name")) for row in data["upserts"]],
+            [("product", "Carbonara")],
+        )
+        # Dependent rows first
+        self.assertEqual(
+            data["deletes"],
+            [
+                {"type": "stock", "store_id": "S0", "product_id": "P0001"},
+                {"type": "product", "product_id": "P0001"},
+            ],
+        )
+        # The changes are too recent to move the client's version yet.
+        self.assertEqual((data["version"], data["more"]), (version, False))
+        latest = self.settle()
+        self.assertEqual(self.changes(version)["version"], latest)
+        self.assertEqual(self.changes(latest)["upserts"], [])
+
+        page = sync.changes_since(version, limit=1)
+        self.assertTrue(page["more"])
+        self.assertEqual(page["version"], version + 1)
+
+    def test_bulk_writes_are_logged(self):
+        version = self.settle()
+        StockUpserter(self.store).run(
+            [(0, {"product_id": "P0001", "quantity_in_stock": 9})]
+        )
+        Repricing(PERCENT, Decimal("10")).run(select_products(brand="samyang"))
+        data = self.changes(version)
+        self.assertEqual(
+            [
+                (row["type"], row["product_id"], row.get("quantity_in_stock"))
+                for row in data["upserts"]
+            ],
+            [
+                ("product", "P0000", None),
+                ("product", "P0001", None),
+                ("stock", "P0001", 9),
+            ],
+        )
+
+    def test_expired_or_unknown_versions_need_a_new_snapshot(self):
+        latest = self.settle()
+        self.assertEqual(sync.prune_changes(datetime.timedelta(0)), latest - 1)
+        response = self.client.get("/api/store/catalog/changes/", {"since": 1})
+        self.assertEqual(response.status_code, 410)
+        response = self.client.get("/api/store/catalog/changes/", {"since": latest + 1})
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(self.changes(latest - 1)["version"], latest)
+        response = self.client.get("/api/store/catalog/changes/", {"since": "x"})
+        self.assertEqual(response.status_code, 400)
+        self.client.force_authenticate(user=None)
+        response = self.client.get("/api/store/catalog/changes/", {"since": latest})
+        self.assertIn(response.status_code, (401, 403))
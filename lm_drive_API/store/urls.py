@@ -1,18 +1,33 @@
 from django.urls import path
 from .views import (
     BrandListView,
+    CatalogChangesAPIView,
+    CatalogSnapshotAPIView,
+    ProductFacetsAPIView,
+    ProductImportAPIView,
     ProductListCreateAPIView,
+    ProductRepricingAPIView,
+    ProductSuggestAPIView,
+    NearestStoresAPIView,
     ProductRetrieveUpdateDestroyAPIView,
     CategoryListCreateAPIView,
     CategoryRetrieveUpdateDestroyAPIView,
     SubCategoryListCreateAPIView,
     SubCategoryRetrieveUpdateDestroyAPIView,
+    StockBulkUpsertAPIView,
     StockListCreateAPIView,
+    StockMovementReportAPIView,
     StockRetrieveUpdateDestroyAPIView,
 )
 
 urlpatterns = [
     path("products/", ProductListCreateAPIView.as_view(), name="product-list-create"),
+    path("products/facets/", ProductFacetsAPIView.as_view(), name="product-facets"),
+    path("products/import/", ProductImportAPIView.as_view(), name="product-import"),
+    path("products/suggest/", ProductSuggestAPIView.as_view(), name="product-suggest"),
+    path(
+        "products/reprice/", ProductRepricingAPIView.as_view(), name="product-reprice"
+    ),
     path(
         "products/<str:pk>/",
         ProductRetrieveUpdateDestroyAPIView.as_view(),
@@ -36,12 +51,31 @@ urlpatterns = [
         SubCategoryRetrieveUpdateDestroyAPIView.as_view(),
         name="subcategory-detail",
     ),
+    # Offline copies of the catalog: full snapshot, then changes since a version
+    path(
+        "catalog/snapshot/", CatalogSnapshotAPIView.as_view(), name="catalog-snapshot"
+    ),
+    path("catalog/changes/", CatalogChangesAPIView.as_view(), name="catalog-changes"),
+    # Stores nearest to a location, optionally with a basket's availability
+    path("stores/nearest/", NearestStoresAPIView.as_view(), name="store-nearest"),
     # List and create stock records for a specific store
     path(
         "<str:store_id>/stocks/",
         StockListCreateAPIView.as_view(),
         name="store-stock-list-create",
     ),
+    # Create or update many stock records of a store from an inventory feed
+    path(
+        "<str:store_id>/stocks/bulk/",
+        StockBulkUpsertAPIView.as_view(),
+        name="store-stock-bulk-upsert",
+    ),
+    # Stock history of a store over a period
+    path(
+        "<str:store_id>/stocks/report/",
+        StockMovementReportAPIView.as_view(),
+        name="store-stock-report",
+    ),
     # Retrieve, update, and delete a specific stock record for a store (using stock ID and store ID)
     path(
         "<str:store_id>/stocks/<str:product_id>/",  # Ensure store_id and product_id match exactly
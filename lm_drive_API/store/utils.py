@@ -0,0 +1,72 @@
+from django.core.paginator import Paginator
+from django.db import connections, router
+from django.utils.functional import cached_property
+
+
+def bulk_upsert(model, objs, unique_fields, update_fields, batch_size=None):
+    """
+    Insert `objs`, updating `update_fields` on rows that already exist.
+
+    MySQL's ON DUPLICATE KEY UPDATE cannot name the conflicting columns, so
+    `unique_fields` is only passed to databases that accept a conflict target.
+    """
+    connection = connections[router.db_for_write(model)]
+    kwargs = {}
+    if connection.features.supports_update_conflicts_with_target:
+        kwargs["unique_fields"] = unique_fields
+    return model.objects.bulk_create(
+        objs,
+        batch_size=batch_size,
+        update_conflicts=True,
+        update_fields=update_fields,
+        **kwargs,
+    )
+
+
+def estimated_row_count(model):
+    """
+    Return the number of rows of the model's table according to the database
+    statistics, without scanning it, or None where they are not available.
+    """
+    connection = connections[router.db_for_read(model)]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "mysql":
+            cursor.execute(
+                "SELECT TABLE_ROWS FROM information_schema.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                [table],
+            )
+        elif connection.vendor == "postgresql":
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [connection.ops.quote_name(table)],
+            )
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for the admin changelists of large tables. Unfiltered lists are
+    counted from the database statistics and filtered ones only up to
+    `count_limit` rows (later pages are not linked), instead of an exact
+    COUNT(*) over the whole table. Small tables are counted exactly.
+    """
+
+    exact_count_threshold = 10000
+    count_limit = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model)
+            if estimate is not None and estimate > self.exact_count_threshold:
+                return estimate
+            return queryset.count()
+        return queryset[: self.count_limit].count()
@@ -1,23 +1,55 @@
-from django.http import Http404
-from requests import Response
-from rest_framework import generics
-from rest_framework.permissions import IsAuthenticated
-from rest_framework.exceptions import ValidationError as DRFValidationError
-from rest_framework.pagination import PageNumberPagination
+import datetime
+import json
+from django.db.models import Count
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_naive, make_aware, now
+from django.http import Http404, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework import generics, status
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.exceptions import (
+    PermissionDenied,
+    ValidationError as DRFValidationError,
+)
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 from django_filters import rest_framework as filters
-from .models import Brand, Product, Category, SubCategory, Stock, Store, Packaging
+from .models import Brand, Product, Category, SubCategory, Stock, Store
 from .serializers import (
     BrandSerializer,
     ProductSerializer,
     CategorySerializer,
+    RepricingSerializer,
     SubCategorySerializer,
     StockSerializer,
+    StoreSerializer,
+)
+from .cache import CatalogCacheMixin, catalog_cache_key, get_or_compute
+from .conditional import ConditionalGetMixin
+from .importers import READERS, ProductImporter, detect_format, open_upload
+from .inventory import StockUpserter
+from .ledger import movement_report
+from .locator import basket_availability, get_index
+from .references import reference_ids, reference_ids_containing
+from .repricing import Repricing, RepricingError, select_products
+from .search import search_products
+from .suggest import MAX_SUGGESTIONS, suggest
+from .sync import (
+    VersionExpired,
+    changes_since,
+    current_version,
+    gzip_chunks,
+    json_lines,
+    snapshot_rows,
 )
 from authentication.permissions import IsStaffOrReadOnly
 from rest_framework.generics import get_object_or_404
 
 
-class CategoryListCreateAPIView(generics.ListCreateAPIView):
+class CategoryListCreateAPIView(CatalogCacheMixin, generics.ListCreateAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsStaffOrReadOnly]
@@ -31,7 +63,9 @@ class CategoryListCreateAPIView(generics.ListCreateAPIView):
         serializer.save()
 
 
-class CategoryRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
+class CategoryRetrieveUpdateDestroyAPIView(
+    CatalogCacheMixin, generics.RetrieveUpdateDestroyAPIView
+):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsStaffOrReadOnly]
@@ -50,7 +84,7 @@ class CategoryRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView
         serializer.save()
 
 
-class SubCategoryListCreateAPIView(generics.ListCreateAPIView):
+class SubCategoryListCreateAPIView(CatalogCacheMixin, generics.ListCreateAPIView):
     queryset = SubCategory.objects.all()
     serializer_class = SubCategorySerializer
     permission_classes = [IsStaffOrReadOnly]
@@ -64,7 +98,9 @@ class SubCategoryListCreateAPIView(generics.ListCreateAPIView):
         serializer.save()
 
 
-class SubCategoryRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
+class SubCategoryRetrieveUpdateDestroyAPIView(
+    CatalogCacheMixin, generics.RetrieveUpdateDestroyAPIView
+):
     queryset = SubCategory.objects.all()
     serializer_class = SubCategorySerializer
     permission_classes = [IsStaffOrReadOnly]
@@ -84,64 +120,104 @@ class SubCategoryRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIV
 
 
 class ProductFilter(filters.FilterSet):
+    q = filters.CharFilter(method="filter_by_search")
     category = filters.CharFilter(field_name="category__name", lookup_expr="icontains")
+    subcategory = filters.CharFilter(method="filter_by_subcategory")
     subcategories = filters.CharFilter(method="filter_by_subcategories")
+    subcategories_match = filters.ChoiceFilter(
+        choices=[("all", "All"), ("any", "Any")],
+        method="filter_by_subcategories_match",
+    )
     brand = filters.CharFilter(
         field_name="brand__name", lookup_expr="icontains"
     )  # Correct filter for brand
+    store = filters.CharFilter(method="filter_by_store")
 
     class Meta:
         model = Product
-        fields = ["category", "subcategories", "brand"]
+        fields = [
+            "q",
+            "category",
+            "subcategory",
+            "subcategories",
+            "subcategories_match",
+            "brand",
+            "store",
+        ]
+
+    def filter_by_search(self, queryset, name, value):
+        # Full-text search, ranked by relevance (see store.search)
+        return search_products(queryset, value)
+
+    def filter_by_store(self, queryset, name, value):
+        # Products that can be bought today at the store, as a semi-join
+        # answered from the stock availability index
+        available = Stock.objects.available().filter(store_id=value)
+        return queryset.filter(pk__in=available.values("product_id"))
+
+    def filter_by_subcategory(self, queryset, name, value):
+        # Former parameter: products in any subcategory whose name contains
+        # the value, resolved to ids from the reference cache
+        ids = reference_ids_containing(SubCategory, value.strip())
+        return queryset.in_subcategories(ids, match_all=False)
 
     def filter_by_subcategories(self, queryset, name, value):
-        # Split the incoming value by commas and filter by each subcategory
-        subcategory_names = value.split(",")
-        for subcategory_name in subcategory_names:
-            queryset = queryset.filter(subcategories__name__icontains=subcategory_name)
-        return queryset.distinct()
+        # Comma-separated exact names (case-insensitive), resolved to ids from
+        # the reference cache: products in all of them, or in any of them with
+        # subcategories_match=any
+        names = {part.strip() for part in value.split(",") if part.strip()}
+        ids = reference_ids(SubCategory, names)
+        match_all = self.form.cleaned_data.get("subcategories_match") != "any"
+        if match_all and None in ids.values():
+            return queryset.none()
+        return queryset.in_subcategories(
+            [pk for pk in ids.values() if pk is not None], match_all=match_all
+        )
+
+    def filter_by_subcategories_match(self, queryset, name, value):
+        # Applied by filter_by_subcategories
+        return queryset
+
 
+class ProductCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the product primary key: each page seeks past the
+    last product_id of the previous one instead of using OFFSET.
+    """
+
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = "product_id"
 
-class ProductListCreateAPIView(generics.ListCreateAPIView):
+    def get_ordering(self, request, queryset, view):
+        # Search results are paged by relevance, ties broken by product_id
+        if "search_rank" in queryset.query.annotations:
+            return ("-search_rank", "product_id")
+        return super().get_ordering(request, queryset, view)
+
+
+class ProductListCreateAPIView(
+    ConditionalGetMixin, CatalogCacheMixin, generics.ListCreateAPIView
+):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsStaffOrReadOnly]
     filter_backends = [filters.DjangoFilterBackend]
     filterset_class = ProductFilter
+    pagination_class = ProductCursorPagination
+    stream_chunk_size = 500
 
     def get_queryset(self):
         queryset = super().get_queryset()
 
-        # Always filter for products that are on sale
-        queryset = queryset.filter(is_for_sale=True).prefetch_related("stocks")
-
-        # Apply additional filters based on query parameters
-        category_name = self.request.query_params.get("category", "").strip()
-        subcategory_name = self.request.query_params.get("subcategory", "").strip()
-        brand_name = self.request.query_params.get("brand", "").strip()
-
-        if category_name:
-            queryset = queryset.filter(category__name__icontains=category_name)
-
-        if subcategory_name:
-            queryset = queryset.filter(subcategories__name__icontains=subcategory_name)
-
-        if brand_name:
-            queryset = queryset.filter(brand__name__icontains=brand_name)
-
-        # Limit fields for unauthenticated users
-        if not self.request.user.is_authenticated:
-            queryset = queryset.only(
-                "product_id",
-                "product_name",
-                "description",
-                "brand",
-                "image1",
-                "image2",
-                "image3",
-            )
-
-        return queryset.distinct()
+        # Always filter for products that are on sale, and load what the
+        # requested serializer fields need up front
+        fields = ProductSerializer.get_requested_fields(self.request)
+        # Sensitive fields are dropped by the serializer; deferring them here
+        # would only trigger one extra query per product when it reads them.
+        # Query parameters are applied by ProductFilter.
+        return queryset.filter(is_for_sale=True).for_catalog(fields)
 
     def get_serializer_context(self):
         """
@@ -152,12 +228,236 @@ class ProductListCreateAPIView(generics.ListCreateAPIView):
         context["include_sensitive_fields"] = self.request.user.is_authenticated
         return context
 
+    def list(self, request, *args, **kwargs):
+        """
+        Return a cursor-paginated page, or the whole filtered catalog as a
+        streamed JSON array when a staff member passes `?stream=1`.
+        """
+        if request.query_params.get("stream") in ("1", "true"):
+            if not request.user.is_staff:
+                raise PermissionDenied("Only staff can stream the full catalog.")
+            return self.stream_catalog()
+        return super().list(request, *args, **kwargs)
+
+    def stream_catalog(self):
+        """
+        Stream the catalog in chunks so memory stays flat whatever its size.
+        """
+        queryset = self.filter_queryset(self.get_queryset()).order_by("product_id")
+        context = self.get_serializer_context()
+
+        def generate():
+            yield "["
+            separator = ""
+            for product in queryset.iterator(chunk_size=self.stream_chunk_size):
+                data = self.get_serializer_class()(product, context=context).data
+                yield separator + json.dumps(data, cls=JSONEncoder)
+                separator = ","
+            yield "]"
+
+        return StreamingHttpResponse(generate(), content_type="application/json")
+
+
+class ProductFacetsAPIView(generics.GenericAPIView):
+    """
+    Count the products matching the ProductFilter parameters per category,
+    brand, subcategory, packaging type and store with available stock.
+    """
+
+    queryset = Product.objects.filter(is_for_sale=True)
+    permission_classes = [IsStaffOrReadOnly]
+    filter_backends = [filters.DjangoFilterBackend]
+    filterset_class = ProductFilter
+    cache_timeout = 300
+    case_insensitive_filters = ("q", "category", "subcategories", "brand")
+
+    def get(self, request, *args, **kwargs):
+        cache_key = catalog_cache_key("facets", self.get_filter_params())
+        return Response(
+            get_or_compute(cache_key, self.get_facets, timeout=self.cache_timeout)
+        )
+
+    def get_filter_params(self):
+        """
+        Return the filter parameters in a normalized form, so that equivalent
+        requests share a cache entry.
+        """
+        params = {}
+        for name in self.filterset_class.base_filters:
+            value = self.request.query_params.get(name, "").strip()
+            if name in self.case_insensitive_filters:
+                value = value.lower()
+            if name == "subcategories":
+                value = ",".join(sorted(filter(None, value.split(","))))
+            if value:
+                params[name] = value
+        return params
+
+    def get_facets(self):
+        product_ids = self.filter_queryset(self.get_queryset()).values("pk")
+        products = Product.objects.filter(pk__in=product_ids)
+        categories = (
+            products.values("category_id", "category__name")
+            .annotate(count=Count("pk"))
+            .order_by("category__name")
+        )
+        brands = (
+            products.filter(brand__isnull=False)
+            .values("brand_id", "brand__name")
+            .annotate(count=Count("pk"))
+            .order_by("brand__name")
+        )
+        packaging_types = (
+            products.filter(packaging__isnull=False)
+            .values("packaging__packaging_type")
+            .annotate(count=Count("pk"))
+            .order_by("packaging__packaging_type")
+        )
+        subcategories = (
+            Product.subcategories.through.objects.filter(product_id__in=product_ids)
+            .values("subcategory_id", "subcategory__name")
+            .annotate(count=Count("product_id"))
+            .order_by("subcategory__name")
+        )
+        stores = (
+            Stock.objects.available()
+            .filter(product_id__in=product_ids)
+            .values("store_id", "store__name")
+            .annotate(count=Count("product_id"))
+            .order_by("store__name")
+        )
+        return {
+            "category": [
+                {
+                    "id": row["category_id"],
+                    "name": row["category__name"],
+                    "count": row["count"],
+                }
+                for row in categories
+            ],
+            "brand": [
+                {
+                    "id": row["brand_id"],
+                    "name": row["brand__name"],
+                    "count": row["count"],
+                }
+                for row in brands
+            ],
+            "subcategory": [
+                {
+                    "id": row["subcategory_id"],
+                    "name": row["subcategory__name"],
+                    "count": row["count"],
+                }
+                for row in subcategories
+            ],
+            "packaging_type": [
+                {"value": row["packaging__packaging_type"], "count": row["count"]}
+                for row in packaging_types
+            ],
+            "store": [
+                {
+                    "store_id": row["store_id"],
+                    "name": row["store__name"],
+                    "count": row["count"],
+                }
+                for row in stores
+            ],
+        }
+
+
+class ProductImportAPIView(generics.GenericAPIView):
+    """
+    Import or update products from an uploaded CSV or JSON Lines catalog
+    (multipart field `file`, optional `format`), see store.importers.
+    """
+
+    permission_classes = [IsStaffOrReadOnly]
+    parser_classes = [MultiPartParser]
+    batch_size = 1000
+    max_reported_errors = 1000
+
+    def post(self, request, *args, **kwargs):
+        uploaded_file = request.FILES.get("file")
+        if uploaded_file is None:
+            raise DRFValidationError({"file": "A catalog file is required."})
+        file_format = request.data.get("format") or detect_format(uploaded_file.name)
+        if file_format not in READERS:
+            raise DRFValidationError(
+                {"format": f"Format must be one of {', '.join(sorted(READERS))}."}
+            )
+
+        reader = READERS[file_format]
+        report = ProductImporter(batch_size=self.batch_size).run(
+            reader(open_upload(uploaded_file))
+        )
+        return Response(report.as_dict(max_errors=self.max_reported_errors))
+
+
+class ProductRepricingAPIView(generics.GenericAPIView):
+    """
+    Change the prices of every product matching a category, brand,
+    subcategory or tva, see store.repricing. Only reports the changes unless
+    `dry_run` is false.
+    """
+
+    serializer_class = RepricingSerializer
+    permission_classes = [IsAdminUser]
+    batch_size = 1000
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        queryset = select_products(
+            category=data.get("category"),
+            brand=data.get("brand"),
+            subcategory=data.get("subcategory"),
+            tva=data.get("tva"),
+        )
+        try:
+            repricing = Repricing(
+                data["rule"],
+                data["value"],
+                pending_items=data["pending_items"],
+                batch_size=self.batch_size,
+            )
+            report = repricing.run(queryset, dry_run=data["dry_run"])
+        except RepricingError as error:
+            raise DRFValidationError({"value": str(error)})
+        return Response(report)
+
+
+class ProductSuggestAPIView(generics.GenericAPIView):
+    """
+    Typeahead suggestions for `q`: products, brands and categories whose name
+    has a word starting with it, most popular first (see store.suggest).
+    """
+
+    permission_classes = [IsStaffOrReadOnly]
+    default_limit = 10
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get("q", "")
+        try:
+            limit = int(request.query_params.get("limit", self.default_limit))
+        except ValueError:
+            raise DRFValidationError({"limit": "Enter a whole number."})
+        limit = min(max(limit, 1), MAX_SUGGESTIONS)
+        return Response({"q": query, "suggestions": suggest(query, limit)})
 
-class ProductRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
+
+class ProductRetrieveUpdateDestroyAPIView(
+    ConditionalGetMixin, CatalogCacheMixin, generics.RetrieveUpdateDestroyAPIView
+):
     serializer_class = ProductSerializer
     permission_classes = [IsStaffOrReadOnly]
     queryset = Product.objects.filter(is_for_sale=True)
 
+    def get_queryset(self):
+        fields = ProductSerializer.get_requested_fields(self.request)
+        return super().get_queryset().for_catalog(fields)
+
     def perform_update(self, serializer):
         # Perform validations before saving the updated product
         self.validate_packaging(serializer)
@@ -181,12 +481,6 @@ class ProductRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView)
             packaging_type = packaging_data.get("packaging_type")
             if not (packaging_quantity and packaging_value and packaging_type):
                 raise DRFValidationError("All packaging fields must be provided.")
-            packaging, _ = Packaging.objects.get_or_create(
-                packaging_quantity=packaging_quantity,
-                packaging_value=packaging_value,
-                packaging_type=packaging_type,
-            )
-            serializer.validated_data["packaging"] = packaging
 
     def validate_product_uniqueness(self, serializer):
         """Ensure product_id and UPC are unique for the updated product."""
@@ -261,6 +555,172 @@ class StockListCreateAPIView(generics.ListCreateAPIView):
             )
 
 
+class StockBulkUpsertAPIView(generics.GenericAPIView):
+    """
+    Create or update many stock records of a store at once, see
+    store.inventory. The body is a JSON list of rows (product_id,
+    quantity_in_stock, expiration_date), or a CSV/JSON Lines inventory file
+    sent as the multipart field `file`.
+    """
+
+    permission_classes = [IsStaffOrReadOnly]
+    parser_classes = [JSONParser, MultiPartParser]
+    batch_size = 1000
+
+    def post(self, request, *args, **kwargs):
+        store = get_object_or_404(Store, store_id=self.kwargs["store_id"])
+        uploaded_file = request.FILES.get("file")
+        if uploaded_file is not None:
+            reader = READERS[detect_format(uploaded_file.name)]
+            rows = reader(open_upload(uploaded_file))
+        elif isinstance(request.data, list):
+            rows = enumerate(request.data, start=1)
+        else:
+            raise DRFValidationError("Send a list of stock rows or an inventory file.")
+
+        report = StockUpserter(store, batch_size=self.batch_size).run(rows)
+        return Response(report.as_dict())
+
+
+class StockMovementReportAPIView(generics.GenericAPIView):
+    """
+    Stock history of a store between `start` and `end` (dates or date-times,
+    the last 7 days by default), optionally for some products
+    (`product=P1,P2`): quantity at start, total movements of each kind and
+    quantity at end. See store.ledger.
+    """
+
+    permission_classes = [IsAdminUser]
+    default_period = datetime.timedelta(days=7)
+
+    def parse_moment(self, name, default):
+        value = self.request.query_params.get(name)
+        if not value:
+            return default
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                raise DRFValidationError({name: "Enter a valid date or date-time."})
+            moment = datetime.datetime.combine(day, datetime.time.min)
+        return make_aware(moment) if is_naive(moment) else moment
+
+    def get(self, request, *args, **kwargs):
+        store = get_object_or_404(Store, store_id=self.kwargs["store_id"])
+        end = self.parse_moment("end", now())
+        start = self.parse_moment("start", end - self.default_period)
+        if start > end:
+            raise DRFValidationError({"start": "Start must be before end."})
+        product = request.query_params.get("product")
+        product_ids = (
+            [value.strip() for value in product.split(",") if value.strip()]
+            if product
+            else None
+        )
+        return Response(
+            {
+                "store": store.store_id,
+                "start": start,
+                "end": end,
+                "products": movement_report(store.store_id, start, end, product_ids),
+            }
+        )
+
+
+class NearestStoresAPIView(generics.GenericAPIView):
+    """
+    The `k` stores nearest to `lat` and `lon`, or to a `postal_code`, closest
+    first, with their distance in kilometers (see store.locator). With a
+    `basket` (`P1:2,P2`, quantities default to 1), each store tells which
+    products it lacks; `available_only=true` keeps the stores that can serve
+    the whole basket, among the `max_candidates` nearest.
+    """
+
+    serializer_class = StoreSerializer
+    permission_classes = [IsStaffOrReadOnly]
+    default_k = 5
+    max_k = 50
+    max_candidates = 50
+
+    def parse_float(self, name, minimum, maximum):
+        try:
+            value = float(self.request.query_params[name])
+        except (KeyError, ValueError):
+            raise DRFValidationError({name: "Enter a number."})
+        if not (minimum <= value <= maximum):
+            raise DRFValidationError(
+                {name: f"Must be between {minimum} and {maximum}."}
+            )
+        return value
+
+    def parse_basket(self, value):
+        basket = {}
+        for part in value.split(","):
+            product_id, _, quantity = part.strip().partition(":")
+            if not product_id:
+                continue
+            try:
+                quantity = int(quantity or 1)
+            except ValueError:
+                quantity = 0
+            if quantity <= 0:
+                raise DRFValidationError(
+                    {"basket": f"Invalid quantity for product '{product_id}'."}
+                )
+            basket[product_id] = basket.get(product_id, 0) + quantity
+        return basket
+
+    def get(self, request, *args, **kwargs):
+        params = request.query_params
+        index = get_index()
+        if params.get("postal_code"):
+            location = index.locate_postal_code(params["postal_code"])
+            if location is None:
+                raise DRFValidationError({"postal_code": "Unknown postal code."})
+        elif "lat" in params or "lon" in params:
+            location = (
+                self.parse_float("lat", -90, 90),
+                self.parse_float("lon", -180, 180),
+            )
+        else:
+            raise DRFValidationError("Give either lat and lon or a postal_code.")
+        try:
+            k = min(max(int(params.get("k", self.default_k)), 1), self.max_k)
+        except ValueError:
+            raise DRFValidationError({"k": "Enter a whole number."})
+        basket = self.parse_basket(params.get("basket", ""))
+        available_only = bool(basket) and params.get("available_only") in (
+            "1",
+            "true",
+        )
+
+        nearest = index.nearest(
+            *location, max(k, self.max_candidates) if available_only else k
+        )
+        missing = (
+            basket_availability([store.store_id for _, store in nearest], basket)
+            if basket
+            else {}
+        )
+        results = []
+        for distance, store in nearest:
+            if available_only and missing[store.store_id]:
+                continue
+            result = self.get_serializer(store).data
+            result["distance_km"] = round(distance, 2)
+            if basket:
+                result["basket"] = {
+                    "complete": not missing[store.store_id],
+                    "missing": missing[store.store_id],
+                }
+            results.append(result)
+            if len(results) == k:
+                break
+        return Response(
+            {"latitude": location[0], "longitude": location[1], "results": results}
+        )
+
+
 class StockRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
     """
     API view to retrieve, update, or delete a Stock instance.
@@ -337,7 +797,59 @@ class StockRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
         instance.delete()
 
 
-class BrandListView(generics.ListAPIView):
+class BrandListView(CatalogCacheMixin, generics.ListAPIView):
     queryset = Brand.objects.all()  # Get all brands
     serializer_class = BrandSerializer  # Use the BrandSerializer for serializing data
     permission_classes = [IsStaffOrReadOnly]
+
+
+class CatalogSnapshotAPIView(generics.GenericAPIView):
+    """
+    Download the whole catalog (references, stores, products and stocks) as
+    gzip-compressed JSON lines, the first line giving its version. Offline
+    clients then follow it with CatalogChangesAPIView (see store.sync).
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        version = current_version()
+        etag = quote_etag(f"catalog-{version}")
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        response = StreamingHttpResponse(
+            gzip_chunks(json_lines(snapshot_rows(version))),
+            content_type="application/gzip",
+        )
+        response.headers["ETag"] = etag
+        response.headers["Content-Disposition"] = (
+            f'attachment; filename="catalog-{version}.jsonl.gz"'
+        )
+        return response
+
+
+class CatalogChangesAPIView(generics.GenericAPIView):
+    """
+    Rows changed since the catalog version `since`: upserted rows in their
+    current state and the keys of deleted ones. Answers 410 Gone when the
+    changes are no longer available and a new snapshot is needed.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            since = int(request.query_params["since"])
+            if since < 0:
+                raise ValueError
+        except (KeyError, ValueError):
+            raise DRFValidationError({"since": "Enter a catalog version."})
+        try:
+            changes = changes_since(since)
+        except VersionExpired:
+            return Response(
+                {"detail": "Version too old or unknown, download a new snapshot."},
+                status=status.HTTP_410_GONE,
+            )
+        return Response({"since": since, **changes})